@@ -1,29 +1,61 @@
 import json
 import os
-from azure.digitaltwins.core import DigitalTwinsClient
-from azure.identity import DefaultAzureCredential
 from datetime import datetime
 import pandas as pd
-import random
-import time
+import threading
+from telemetrysink import open_sink
+from provisioning import ProvisioningEngine
+from twinpatch import TwinPatchTracker
+from telemetryschema import TelemetrySchema
+from telemetrygenerator import VectorizedTelemetryGenerator
+import fleet
+from localtwins import InMemoryDigitalTwinsClient
+from topology import TopologyCache
+from deviceregistry import DeviceRegistry
+from metrics import metrics, InstrumentedClient
 
 
 class DigitalTwinSmartHome:
-    current_timestamp = datetime.now().timestamp()
-    def __init__(self,dtHostName,excel_path,dump_path,model_path) -> None:
+    def __init__(self,dtHostName,excel_path,dump_path,model_path,max_workers=16,seed=None) -> None:
         self.dt_client = None 
+        # When the service client was created, set by connection()
+        self.current_timestamp = None
+        self.provisioner = None
+        self.topology = None
+        self.max_workers = max_workers
+        self.patch_tracker = TwinPatchTracker()
+        self.state = None
+        self.registry = None
+        self._state_lock = threading.Lock()
         self.dtHostName = dtHostName
         self.excel_path = excel_path
         self.dump_path = dump_path
         self.model_path = model_path
+        self.sink = open_sink(dump_path, model_path)
+        self.publisher = None
+        self.generator = VectorizedTelemetryGenerator(TelemetrySchema.from_models(model_path), seed)
 
     def load_excel(self):
-        df = pd.read_excel(self.excel_path)
+        with metrics.timer('stage_seconds', stage='load_excel'):
+            df = pd.read_excel(self.excel_path)
         return df
 
     def connection(self):
         try:
-            self.dt_client = DigitalTwinsClient(f"{self.dtHostName}", DefaultAzureCredential())
+            if self.dtHostName.startswith("local://"):
+                # Offline runs and benchmarks against an in-memory twin graph
+                client = InMemoryDigitalTwinsClient()
+            else:
+                # The Azure SDK is only imported, and the credential only
+                # created, by runs that actually talk to the service
+                from azure.digitaltwins.core import DigitalTwinsClient
+                from azure.identity import DefaultAzureCredential
+                client = DigitalTwinsClient(f"{self.dtHostName}", DefaultAzureCredential())
+            # Every call is timed and counted per method for /metrics
+            self.dt_client = InstrumentedClient(client)
+            self.provisioner = ProvisioningEngine(self.dt_client, max_workers=self.max_workers)
+            self.topology = TopologyCache(self.dt_client, list_relationships=self.provisioner.list_relationships)
+            self.current_timestamp = datetime.now().timestamp()
             print("Service client created at: ",self.current_timestamp)
         except Exception as e:
             print("Error establishing donnection:", e)
@@ -53,89 +85,104 @@ class DigitalTwinSmartHome:
         except Exception as e:
             print("Error uploading models:", e)
 
+    def reconcile(self, dry_run=False, use_state_file=False, state_path=None):
+        # Incremental alternative to upload_models + create_digital_twins +
+        # create_relationships: only what differs from the sheet and models
+        from reconcile import Reconciler
+        state_path = state_path or os.path.splitext(self.excel_path)[0] + '.provisioned'
+        try:
+            return Reconciler(self, state_path).run(dry_run, use_state_file)
+        except Exception as e:
+            print("Error reconciling digital twins:", e)
+
+    def query_twin_ids(self):
+        return self.topology.twin_ids()
+
     def delete_relationships(self):
         try:
-            query_expression = 'SELECT * FROM digitaltwins'
-            query_result = self.dt_client.query_twins(query_expression)
-            total_relation = 0
-            for twin in query_result:
-                digital_twin_id = twin['$dtId']
-                relationships = self.dt_client.list_relationships(digital_twin_id)
-                for relationship in relationships:
-                    relationship_id = relationship['$relationshipId']
-                    total_relation+=1
-                    self.dt_client.delete_relationship(digital_twin_id, relationship_id)
-            print(f'Deleted {total_relation} relationships!')
+            # Topology comes from the cache, not one listing per twin
+            relationships = self.topology.relationships()
+            self.provisioner.delete_relationships(relationships)
+            print(f'Deleted {len(relationships)} relationships!')
         except Exception as e:
             print("Error deleteing relationships:", e)
+        finally:
+            self.topology.invalidate()
 
     def delete_digital_twins(self):
         try:
-            query_expression = 'SELECT * FROM digitaltwins'
-            query_result = self.dt_client.query_twins(query_expression)
-            total_twins = 0
-            for twin in query_result:
-                digital_twin_id = twin['$dtId']
-                self.dt_client.delete_digital_twin(digital_twin_id)
-                total_twins+=1
-            print(f'Deleted {total_twins} twins!')
+            results = self.provisioner.delete_twins(self.query_twin_ids())
+            print(f'Deleted {len(results)} twins!')
         except Exception as e:
             print("Error deleteing digital twins:", e)
+        finally:
+            self.topology.invalidate()
     
     def create_digital_twins(self):
         try:
+            # Relationships have to go before the twins they connect
             self.delete_relationships()
             self.delete_digital_twins()
             df = self.load_excel()
-            for index, row in df.iterrows():
-                model_id = row['ModelID']
-                digital_twin_id = row['ID (must be unique)']
-                metadata = {
+            twins = (
+                (row['ID (must be unique)'], {
                     "$metadata": {
-                        "$model": model_id
+                        "$model": row['ModelID']
                     },
-                    "$dtId": digital_twin_id
-                }
-                created_twin = self.dt_client.upsert_digital_twin(digital_twin_id, metadata)
-                print(f"Created Digital twin ID: {digital_twin_id} from {model_id}")
+                    "$dtId": row['ID (must be unique)']
+                })
+                for row in df.to_dict('records')
+            )
+            results = self.provisioner.create_twins(twins)
+            print(f"Created {len(results)} digital twins")
         except Exception as e:
             print("Error deleteing digital twins:", e)
+        finally:
+            self.topology.invalidate()
+
+    def relationships_from(self, df):
+        for row in df.to_dict('records'):
+            yield {
+                "$relationshipId": f"RoomContains{row['ID (must be unique)']}",
+                "$sourceId": row['Relationship (From)'],
+                "$relationshipName": row['Relationship Name'],
+                "$targetId": row['ID (must be unique)'],
+            }
 
     def create_relationships(self):
         try:
             df = pd.read_excel(self.excel_path)
-            all_relationships = []
-            for index, row in df.iterrows():
-                relationship = {
-                    "$relationshipId": f"RoomContains{row['ID (must be unique)']}",
-                    "$sourceId": row['Relationship (From)'],
-                    "$relationshipName": row['Relationship Name'],
-                    "$targetId": row['ID (must be unique)'],
-                }
-                all_relationships.append(relationship)
-            for relationship in all_relationships[1:]:
-                self.dt_client.upsert_relationship(
-                    relationship["$sourceId"],
-                    relationship["$relationshipId"],
-                    relationship
-                )
-                print("Created relationship", {relationship["$sourceId"]} ," > ",  {relationship["$targetId"]})
+            # The first row is the room itself, it has no incoming relationship
+            all_relationships = list(self.relationships_from(df))
+            results = self.provisioner.create_relationships(all_relationships[1:])
+            print(f"Created {len(results)} relationships")
+            self.provisioner.print_summary()
         except Exception as e:
             print("Error deleteing digital twins:", e)
-        
+        finally:
+            self.topology.invalidate()
+
+    def provision_fleet(self, homes, rooms_per_home, homes_per_chunk=100):
+        # Stamp the scenario sheet out as homes x rooms and stream it through
+        # the provisioning engine, twins of a chunk before its relationships
+        try:
+            template = self.load_excel()
+            total_twins = 0
+            total_relationships = 0
+            for chunk in fleet.iter_fleet(template, homes, rooms_per_home, homes_per_chunk):
+                total_twins += len(self.provisioner.create_twins(fleet.twins_from(chunk)))
+                total_relationships += len(self.provisioner.create_relationships(fleet.relationships_from(chunk)))
+            print(f"Provisioned {total_twins} twins and {total_relationships} relationships")
+            self.provisioner.print_summary()
+        except Exception as e:
+            print("Error provisioning fleet:", e)
+        finally:
+            self.topology.invalidate()
+
     def display_all(self):
         try:
-            query_expression = 'SELECT * FROM digitaltwins'
-            query_result = self.dt_client.query_twins(query_expression)
-            all_twins = []
-            all_relationships = set()
-            for twin in query_result:
-                all_twins.append(twin['$dtId'])
-                digital_twin_id = twin['$dtId']
-                relationships = self.dt_client.list_relationships(digital_twin_id)
-                for relationship in relationships:
-                    relationship_id = relationship['$relationshipId']
-                    all_relationships.add(relationship_id)
+            all_twins = self.topology.twin_ids()
+            all_relationships = {relationship_id for _, relationship_id in self.topology.relationships()}
 
             print('DigitalTwins: ',all_twins)
             print('Relationships:',all_relationships)
@@ -145,78 +192,102 @@ class DigitalTwinSmartHome:
     
     
 
+    def update_parameters(self, df):
+        # New values for every property of every device in a few vectorized
+        # draws; the typed columns ride along to the sink
+        return self.generator.update(df)
+
+    def device_registry(self):
+        # Device values live in the registry between ticks; it is rebuilt
+        # whenever the scenario sheet is (re)loaded
+        if self.state is None:
+            self.state = self.load_excel()
+        if self.registry is None or self.registry.frame is not self.state:
+            self.registry = DeviceRegistry(self.state, self.generator)
+        return self.registry
+
+    # Pipeline stages, used directly by the simulation scheduler. The scenario
+    # state is kept in memory between ticks and only saved on demand.
+    def generate_batch(self, device_ids=None):
+        with self._state_lock, metrics.timer('stage_seconds', stage='generate'):
+            batch = self.device_registry().tick(device_ids)
+        metrics.inc('property_updates_total', batch.updates())
+        return batch
+
+    def publish_telemetry(self, address=None):
+        # Push every persisted tick to dashboards subscribed on the bus
+        from telemetrybus import TelemetryPublisher
+        if self.publisher is None:
+            self.publisher = TelemetryPublisher(address).start()
+        return self.publisher
+
+    def persist_batch(self, batch):
+        with metrics.timer('stage_seconds', stage='persist'):
+            frame = batch.to_frame()
+            if self.publisher is None:
+                appended = self.sink.append(frame)
+            else:
+                # Stamp once so the published rows match the stored segment exactly
+                now = datetime.now()
+                rows = self.sink.prepare(frame, now)
+                appended = self.sink.append(rows, now)
+                self.publisher.publish(rows, self.sink.marker_for(appended))
+        metrics.inc('property_values_persisted_total', batch.updates())
+        if appended and os.path.exists(appended):
+            metrics.inc('bytes_total', os.path.getsize(appended), kind='sink')
+
+    @metrics.timed('stage_seconds', stage='upload')
+    def upload_batch(self, batch, mode='patch'):
+        # The first scenario row (the room) is not uploaded, as before
+        digital_twin_data = list(batch.records(skip_positions={0}))
+        if mode == 'patch':
+            self.patch_telemtry(digital_twin_data)
+        else:
+            for digital_twin_id, model_id, init_data in digital_twin_data:
+                data_update = {
+                    "$metadata": {
+                        "$model": model_id
+                    }
+                }
+                data_update.update(init_data)
+                self.dt_client.upsert_digital_twin(digital_twin_id, data_update)
+
+    def save_state(self):
+        with self._state_lock:
+            if self.state is not None:
+                state = self.state
+                if self.registry is not None and self.registry.frame is state:
+                    state = state.assign(**{'Init Data': self.registry.snapshot().init_data()})
+                state.to_excel(self.excel_path, index=False)
+
     def generate_telemtry(self):
-        def update_parameters(df):
-            for index, row in df.iterrows():
-                init_data = json.loads(row['Init Data'])
-                for key in init_data.keys():
-                    # Update only the values of Init Data parameters
-                    init_data[key] = get_random_value(key)
-                df.at[index, 'Init Data'] = json.dumps(init_data)
-            return df
-        
-        def get_random_value(key):
-            if key == 'temperature':
-                return random.randint(18, 23)
-            elif key == 'mode':
-                return random.choice(["Cool", "Normal", "Heat"])
-            elif key == 'fanSpeed':
-                return random.randint(0, 3)
-            elif key == 'onOff':
-                return random.choice([True, False])
-            elif key == 'occupancy':
-                return random.choice([True, False])
-            elif key == 'powerConsumed':
-                return random.uniform(0, 1)
-            elif key == 'volume':
-                return random.randint(0, 1)
-            elif key == 'channel':
-                return random.choice(["BBC", "CNN", "FOX", "ABC"])
-            elif key == 'brightness':
-                return random.randint(0, 100)
-            elif key == 'lighting':
-                return random.randint(0, 100)
-            elif key == 'humidity':
-                return random.randint(0, 100)
-            elif key == 'speed':
-                return random.randint(0, 5)
-            elif key == 'color':
-                return random.choice(["White", "Red", "Green", "Blue"])
-            elif key == 'status':
-                return random.choice(["Running", "Stopped", "Paused"])
-            
-        def append_to_datadump(updated_values, file_path):
-            updated_values['Date'] = datetime.now().strftime('%Y-%m-%d')
-            updated_values['Time'] = datetime.now().strftime('%H:%M:%S')
-            if os.path.exists(file_path):
-                existing_data = pd.read_excel(file_path)
-                updated_values = pd.concat([existing_data, updated_values], ignore_index=True)
-            updated_values.to_excel(file_path, index=False)
-
-        df = self.load_excel()
-        updated_df = update_parameters(df)
-        updated_df.to_excel(self.excel_path, index=False)
-        append_to_datadump(updated_df, self.dump_path)
+        self.state = self.load_excel()
+        updated_df = self.generate_batch()
+        self.save_state()
+        self.persist_batch(updated_df)
         print("Genrated new telemtry!")
 
-    def upload_telemtry(self):
-        df = self.load_excel()
-        digital_twin_data = []
-        for index, row in df.iterrows():
-            digital_twin_id = row['ID (must be unique)']
-            init_data = json.loads(row['Init Data'])
-            data_update = {
-                "$metadata": {
-                    "$model": row['ModelID']
-                }
-            }
-            data_update.update(init_data)
-            digital_twin_data.append((digital_twin_id, data_update))
-        for digital_twin_id, data_update in digital_twin_data[1:]:
-            self.dt_client.upsert_digital_twin(digital_twin_id, data_update)
+    def upload_telemtry(self, mode='patch'):
+        self.state = self.load_excel()
+        self.upload_batch(self.device_registry().snapshot(), mode)
+        print("Patch counters:", self.patch_tracker.counters())
         print("Connection established at: ",self.current_timestamp)
         print("Uploaded telemtry successfully at: ",datetime.now().timestamp())
 
-
-        
+    def patch_telemtry(self, digital_twin_data):
+        # Send JSON Patch operations for changed properties only, and skip
+        # twins that did not change since the last upload
+        patches = {}
+        patch_bytes = self.patch_tracker.patch_bytes
+        for digital_twin_id, model_id, init_data in digital_twin_data:
+            operations = self.patch_tracker.diff(digital_twin_id, model_id, init_data)
+            if operations:
+                patches[digital_twin_id] = (operations, init_data)
+        results = self.provisioner.run_batch('patch telemetry', (
+            (digital_twin_id, self.dt_client.update_digital_twin, (digital_twin_id, operations))
+            for digital_twin_id, (operations, init_data) in patches.items()
+        ))
+        for digital_twin_id, _ in results:
+            self.patch_tracker.sent(digital_twin_id, patches[digital_twin_id][1])
+        metrics.inc('bytes_total', self.patch_tracker.patch_bytes - patch_bytes, kind='patch')
 
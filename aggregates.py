@@ -0,0 +1,196 @@
+import math
+import threading
+import numpy as np
+import pandas as pd
+
+
+CORRELATION_PARAMETERS = ['temperature', 'humidity', 'brightness']
+
+
+class PairMoments:
+    # Running co-moments of two columns over the rows where both are present
+    # (pairwise-complete, like DataFrame.corr), merged with Chan/Welford.
+    __slots__ = ('n', 'mean_a', 'mean_b', 'm2_a', 'm2_b', 'c_ab')
+
+    def __init__(self, n=0, mean_a=0.0, mean_b=0.0, m2_a=0.0, m2_b=0.0, c_ab=0.0) -> None:
+        self.n = n
+        self.mean_a = mean_a
+        self.mean_b = mean_b
+        self.m2_a = m2_a
+        self.m2_b = m2_b
+        self.c_ab = c_ab
+
+    @classmethod
+    def from_values(cls, a, b):
+        mask = ~(np.isnan(a) | np.isnan(b))
+        a, b = a[mask], b[mask]
+        if len(a) == 0:
+            return cls()
+        mean_a, mean_b = a.mean(), b.mean()
+        da, db = a - mean_a, b - mean_b
+        return cls(len(a), mean_a, mean_b, (da * da).sum(), (db * db).sum(), (da * db).sum())
+
+    def merge(self, other):
+        if other.n == 0:
+            return
+        if self.n == 0:
+            for name in self.__slots__:
+                setattr(self, name, getattr(other, name))
+            return
+        n = self.n + other.n
+        delta_a = other.mean_a - self.mean_a
+        delta_b = other.mean_b - self.mean_b
+        weight = self.n * other.n / n
+        self.m2_a += other.m2_a + delta_a * delta_a * weight
+        self.m2_b += other.m2_b + delta_b * delta_b * weight
+        self.c_ab += other.c_ab + delta_a * delta_b * weight
+        self.mean_a += delta_a * other.n / n
+        self.mean_b += delta_b * other.n / n
+        self.n = n
+
+    def remove(self, other):
+        # Inverse of merge, used when rows leave the rolling window
+        if other.n == 0:
+            return
+        n = self.n - other.n
+        if n <= 0:
+            self.__init__()
+            return
+        mean_a = (self.n * self.mean_a - other.n * other.mean_a) / n
+        mean_b = (self.n * self.mean_b - other.n * other.mean_b) / n
+        delta_a = other.mean_a - mean_a
+        delta_b = other.mean_b - mean_b
+        weight = n * other.n / self.n
+        self.m2_a -= other.m2_a + delta_a * delta_a * weight
+        self.m2_b -= other.m2_b + delta_b * delta_b * weight
+        self.c_ab -= other.c_ab + delta_a * delta_b * weight
+        self.mean_a, self.mean_b, self.n = mean_a, mean_b, n
+
+    def correlation(self):
+        denominator = self.m2_a * self.m2_b
+        if self.n < 2 or denominator <= 0:
+            return np.nan
+        return max(-1.0, min(1.0, self.c_ab / math.sqrt(denominator)))
+
+
+def _batch_tables(batch):
+    power = batch['powerConsumed'].astype('float64')
+    on = batch['onOff'].astype('float64')
+    frame = pd.DataFrame({
+        'ModelID': batch['ModelID'],
+        'ID (must be unique)': batch['ID (must be unique)'],
+        'Hour': pd.to_datetime(batch['Time'], format='%H:%M:%S').dt.hour,
+        'power': power,
+        'on': on,
+    })
+    aggregations = dict(
+        power_sum=('power', 'sum'),
+        power_count=('power', 'count'),
+        on_sum=('on', 'sum'),
+        on_count=('on', 'count'),
+        rows=('power', 'size'),
+    )
+    return (
+        frame.groupby('ModelID').agg(**aggregations),
+        frame.groupby('ID (must be unique)').agg(**aggregations),
+        frame.groupby('Hour').agg(**aggregations),
+    )
+
+
+class TelemetryAggregates:
+    # Streaming replacement for the full recompute in update_metrics_and_graphs.
+    # Batches are added as they arrive and subtracted when they are evicted
+    # from the telemetry cache, so every update is O(new rows + devices).
+    def __init__(self, parameters=CORRELATION_PARAMETERS) -> None:
+        self.parameters = list(parameters)
+        self.power_sum = 0.0
+        self.power_count = 0
+        self.by_model = None
+        self.by_device = None
+        self.by_hour = None
+        self.pairs = {
+            (a, b): PairMoments()
+            for i, a in enumerate(self.parameters) for b in self.parameters[i:]
+        }
+        self._lock = threading.Lock()
+
+    def _combine(self, table, batch_table, sign):
+        if table is None:
+            table = batch_table.iloc[0:0]
+        combined = table.add(sign * batch_table, fill_value=0)
+        return combined[combined['rows'] > 0]
+
+    def _pair_moments(self, batch):
+        values = {name: batch[name].astype('float64').to_numpy() for name in self.parameters}
+        return {(a, b): PairMoments.from_values(values[a], values[b]) for (a, b) in self.pairs}
+
+    def _apply(self, batch, sign):
+        if batch is None or batch.empty:
+            return
+        by_model, by_device, by_hour = _batch_tables(batch)
+        pairs = self._pair_moments(batch)
+        with self._lock:
+            self.power_sum += sign * by_model['power_sum'].sum()
+            self.power_count += sign * int(by_model['power_count'].sum())
+            self.by_model = self._combine(self.by_model, by_model, sign)
+            self.by_device = self._combine(self.by_device, by_device, sign)
+            self.by_hour = self._combine(self.by_hour, by_hour, sign)
+            for key, moments in pairs.items():
+                if sign > 0:
+                    self.pairs[key].merge(moments)
+                else:
+                    self.pairs[key].remove(moments)
+
+    def add(self, batch):
+        self._apply(batch, 1)
+
+    def remove(self, batch):
+        self._apply(batch, -1)
+
+    def on_telemetry(self, new_rows, evicted_rows):
+        # TelemetryCache listener
+        self.add(new_rows)
+        self.remove(evicted_rows)
+
+    def total_power(self):
+        return self.power_sum
+
+    def average_power(self):
+        return self.power_sum / self.power_count if self.power_count else np.nan
+
+    def _empty(self, table):
+        return table is None or table.empty
+
+    def total_power_per_model(self):
+        if self._empty(self.by_model):
+            return {}
+        return self.by_model['power_sum'].to_dict()
+
+    def average_power_per_model(self):
+        if self._empty(self.by_model):
+            return {}
+        return (self.by_model['power_sum'] / self.by_model['power_count'].replace(0, np.nan)).to_dict()
+
+    def hourly_power(self):
+        if self._empty(self.by_hour):
+            return pd.DataFrame({'Hour': [], 'powerConsumed': []})
+        return self.by_hour['power_sum'].rename('powerConsumed').rename_axis('Hour').reset_index()
+
+    def utilization_per_device(self):
+        if self._empty(self.by_device):
+            return pd.Series(dtype='float64', name='onOff')
+        ratio = self.by_device['on_sum'] / self.by_device['on_count'].replace(0, np.nan)
+        return ratio.rename('onOff').sort_values(ascending=False)
+
+    def average_power_per_device(self):
+        if self._empty(self.by_device):
+            return pd.Series(dtype='float64', name='powerConsumed')
+        mean = self.by_device['power_sum'] / self.by_device['power_count'].replace(0, np.nan)
+        return mean.rename('powerConsumed').sort_values(ascending=False)
+
+    def correlation(self):
+        matrix = pd.DataFrame(np.nan, index=self.parameters, columns=self.parameters)
+        with self._lock:
+            for (a, b), moments in self.pairs.items():
+                matrix.loc[a, b] = matrix.loc[b, a] = moments.correlation()
+        return matrix
@@ -1,21 +1,35 @@
 import dash
 from dash import dcc, html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 import plotly.express as px
-import pandas as pd
 import json
 import numpy as np
-import time
-import seaborn as sns
-import matplotlib.pyplot as plt
-from statsmodels.tsa.arima.model import ARIMA
+from datetime import datetime, timedelta
 import plotly.graph_objects as go
+from telemetrycache import get_cache
+from metrics import metrics
+from aggregates import TelemetryAggregates
+from rollups import get_rollups, downsample, CHART_POINT_BUDGET
+from anomaly import get_detector
+from figurecache import figures
 
-df = pd.read_excel('./assests/datadump.xlsx')
-app = dash.Dash(__name__)
+telemetry = get_cache()
+aggregates = TelemetryAggregates()
+telemetry.add_listener(aggregates.on_telemetry)
+rollups = get_rollups(telemetry)
+detector = get_detector(telemetry)
+
+# Spans the trends chart can show: the cache's raw window, or longer ones
+# served from the rollups, including those persisted before the window
+TREND_RANGES = {
+    'window': None,
+    '1d': timedelta(days=1),
+    '7d': timedelta(days=7),
+    '90d': timedelta(days=90),
+}
 
 # Define app layout
-app.layout = html.Div([
+layout = html.Div([
     html.H1("Analytics Dashboard"),
     
     # Metric: Total power consumed in Room
@@ -45,7 +59,14 @@ app.layout = html.Div([
     # Graph: Trends of Power Consumption Across Devices
     html.Div([
         html.H3("Trends of Power Consumption Across Devices:"),
-        dcc.Graph(id='power_consumption_trends')
+        dcc.Dropdown(id='power_consumption_trends_range', value='window', clearable=False, options=[
+            {'label': 'Live window', 'value': 'window'},
+            {'label': 'Last day', 'value': '1d'},
+            {'label': 'Last 7 days', 'value': '7d'},
+            {'label': 'Last 90 days', 'value': '90d'},
+        ]),
+        dcc.Graph(id='power_consumption_trends'),
+        dcc.Store(id='power-trends-version')
     ]),
     
     # Graph: Power Consumption Outliers
@@ -90,6 +111,15 @@ app.layout = html.Div([
         dcc.Graph(id='power_consumption_room_when_off')
     ]),
 
+    # Table: Latest alerts from the streaming anomaly detector
+    html.Div([
+        html.H3("Recent Alerts:"),
+        html.Div(id='recent_alerts')
+    ]),
+
+    # Data version of the figures this browser is showing
+    dcc.Store(id='analyse-version'),
+
     # Interval component to trigger updates
     dcc.Interval(
         id='interval-component',
@@ -98,124 +128,159 @@ app.layout = html.Div([
     )
 ])
 
+# Box plot from server-side quartiles instead of shipping every row
+def box_figure(values, title):
+    values = values.astype('float64').dropna()
+    fig = go.Figure()
+    if len(values):
+        q1, median, q3 = values.quantile([0.25, 0.5, 0.75])
+        iqr = q3 - q1
+        inside = values[(values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)]
+        fig.add_trace(go.Box(q1=[q1], median=[median], q3=[q3], lowerfence=[inside.min()],
+                             upperfence=[inside.max()], name=values.name))
+    fig.update_layout(title=title, yaxis_title=values.name)
+    return fig
+
+# Histogram from server-side bin counts instead of shipping every row
+def histogram_figure(values, title, bins=50):
+    values = values.astype('float64').dropna()
+    counts, edges = np.histogram(values, bins=bins) if len(values) else ([], np.array([0.0]))
+    fig = px.bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, title=title)
+    fig.update_layout(bargap=0, xaxis_title=values.name, yaxis_title='count')
+    return fig
+
+# Latest anomaly events as a plain table
+def alerts_table(events):
+    if events.empty:
+        return "No anomalies detected"
+    columns = ['Timestamp', 'ID (must be unique)', 'Kind', 'Property', 'Value', 'Expected', 'Score']
+    header = html.Tr([html.Th(column) for column in columns])
+    rows = [
+        html.Tr([html.Td(f"{value:.2f}" if isinstance(value, float) else str(value)) for value in row])
+        for row in events.iloc[::-1][columns].itertuples(index=False)
+    ]
+    return html.Table([header] + rows)
+
 # Define callbacks to update dashboard components
-@app.callback(
-    Output('total_power_consumed_room', 'children'),
-    Output('total_power_per_device', 'children'),
-    Output('average_power_room', 'children'),
-    Output('average_power_per_device', 'children'),
-    Output('power_consumption_trends', 'figure'),
-    Output('power_consumption_outliers', 'figure'),
-    Output('peak_power_times', 'figure'),
-    Output('device_utilization_ratio', 'figure'),
-    Output('device_parameters_correlation', 'figure'),
-    Output('energy_efficiency_analysis', 'figure'),
-    Output('power_consumption_when_off', 'figure'),
-    Output('power_consumption_room_when_off', 'figure'),
-    Input('interval-component', 'n_intervals')
-)
-def update_metrics_and_graphs(n):
-    # Step 4: Extract 'powerConsumed' values from 'Init Data' column
-    def extract_power_consumed(init_data):
-        try:
-            init_data_dict = json.loads(init_data)
-            return init_data_dict.get('powerConsumed', np.nan)
-        except json.JSONDecodeError:
-            return np.nan
-    
-    def extract_onOff(init_data):
-        try:
-            init_data_dict = json.loads(init_data)
-            return init_data_dict.get('onOff', np.nan)
-        except json.JSONDecodeError:
-            return np.nan
-    
-    def extract_humidity(init_data):
-        try:
-            init_data_dict = json.loads(init_data)
-            return init_data_dict.get('humidity', np.nan)
-        except json.JSONDecodeError:
-            return np.nan
-    
-    def extract_temperature(init_data):
-        try:
-            init_data_dict = json.loads(init_data)
-            return init_data_dict.get('temperature', np.nan)
-        except json.JSONDecodeError:
-            return np.nan
-    
-    def extract_brightness(init_data):
-        try:
-            init_data_dict = json.loads(init_data)
-            return init_data_dict.get('brightness', np.nan)
-        except json.JSONDecodeError:
-            return np.nan
-    
-    df['powerConsumed'] = df['Init Data'].apply(extract_power_consumed)
-    df['onOff'] = df['Init Data'].apply(extract_onOff)
-    df['humidity'] = df['Init Data'].apply(extract_humidity)
-    df['temperature'] = df['Init Data'].apply(extract_temperature)
-    df['brightness'] = df['Init Data'].apply(extract_brightness)
+def update_metrics_and_graphs(n, shown_version=None):
+    # Pull in only the rows appended since the last tick. The shared frame
+    # is read-only: 'powerConsumed', 'onOff', 'humidity', 'temperature' and
+    # 'brightness' are typed columns written by the telemetry sink. The
+    # metrics are served from the running aggregates fed by the cache.
+    telemetry.refresh()
+    df, version = telemetry.snapshot()
+    
+    # Nothing new since this browser's last update
+    if shown_version == version:
+        return (dash.no_update,) * 13
+    
+    # Figures are built once per data version and shared by every browser
+    def cached(figure_id, build):
+        return figures.get(figure_id, version, telemetry.window, build)
     
     # Metric: Total power consumed in Room
-    total_power_room = df['powerConsumed'].sum()
+    total_power_room = aggregates.total_power()
     
     # Metric: Total power consumed per device
-    total_power_per_device = df.groupby('ModelID')['powerConsumed'].sum().to_dict()
+    total_power_per_device = aggregates.total_power_per_model()
     
     # Metric: Average power consumed in Room
-    average_power_room = df['powerConsumed'].mean()
+    average_power_room = aggregates.average_power()
     
     # Metric: Average power consumed per device
-    average_power_per_device = df.groupby('ModelID')['powerConsumed'].mean().to_dict()
-    
-    # Graph: Trends of Power Consumption Across Devices
-    fig_power_consumption_trends = px.line(df, x='Time', y='powerConsumed', color='ModelID', title='Trends of Power Consumption Across Devices')
+    average_power_per_device = aggregates.average_power_per_model()
     
     # Graph: Power Consumption Outliers
-    fig_power_consumption_outliers = px.box(df, y='powerConsumed', title='Power Consumption Outliers')
+    fig_power_consumption_outliers = cached('power_consumption_outliers', lambda: box_figure(df['powerConsumed'], title='Power Consumption Outliers'))
     
     # Graph: Peak Power Consumption Times
-    df['Time'] = pd.to_datetime(df['Time'])
-    df['Hour'] = df['Time'].dt.hour
-    peak_power_times = df.groupby('Hour')['powerConsumed'].sum().reset_index()
-    fig_peak_power_times = px.bar(peak_power_times, x='Hour', y='powerConsumed', title='Peak Power Consumption Times')
+    fig_peak_power_times = cached('peak_power_times', lambda: px.bar(aggregates.hourly_power(), x='Hour', y='powerConsumed', title='Peak Power Consumption Times'))
     
     # Graph: Device Utilization Ratio
-    device_utilization = df.groupby('ID (must be unique)')['onOff'].mean().sort_values(ascending=False)
-    fig_device_utilization_ratio = px.bar(device_utilization, title='Device Utilization Ratio')
+    fig_device_utilization_ratio = cached('device_utilization_ratio', lambda: px.bar(aggregates.utilization_per_device(), title='Device Utilization Ratio'))
     
     # Graph: Correlation between Device Parameters
-    device_parameters = ['temperature', 'humidity', 'brightness']
-    device_corr = df[device_parameters].corr()
-    fig_device_parameters_correlation = px.imshow(device_corr, title='Correlation between Device Parameters')
+    fig_device_parameters_correlation = cached('device_parameters_correlation', lambda: px.imshow(aggregates.correlation(), title='Correlation between Device Parameters'))
     
     # Graph: Energy Efficiency Analysis
-    energy_efficiency = df.groupby('ID (must be unique)')['powerConsumed'].mean().sort_values(ascending=False)
-    fig_energy_efficiency_analysis = px.bar(energy_efficiency, title='Energy Efficiency Analysis')
+    fig_energy_efficiency_analysis = cached('energy_efficiency_analysis', lambda: px.bar(aggregates.average_power_per_device(), title='Energy Efficiency Analysis'))
     
     # Graph: Power Consumption When Devices were Off
-    off_devices = df[df['onOff'] == False]
-    fig_power_consumption_when_off = px.histogram(off_devices, x='powerConsumed', title='Power Consumption When Devices were Off')
+    # (every off reading in the window, from the typed columns; the
+    # detector's bounded event log only feeds the alerts table)
+    def off_power():
+        return df.loc[(df['onOff'] == False).fillna(False).to_numpy(dtype=bool), ['Timestamp', 'powerConsumed']]
+    fig_power_consumption_when_off = cached('power_consumption_when_off', lambda: histogram_figure(off_power()['powerConsumed'], title='Power Consumption When Devices were Off'))
     
     # Graph: Power Consumption in Room When Devices were Off
-    room_power_off = off_devices.groupby(['Date', 'Time'])['powerConsumed'].sum().reset_index()
-    fig_power_consumption_room_when_off = px.line(room_power_off, x='Time', y='powerConsumed', title='Power Consumption in Room When Devices were Off')
+    def power_consumption_room_when_off():
+        room_power_off = off_power().groupby('Timestamp')['powerConsumed'].sum().reset_index()
+        room_power_off['Room'] = 'Room'
+        room_power_off = downsample(room_power_off, 'Room', 'powerConsumed', CHART_POINT_BUDGET)
+        return px.line(room_power_off, x='Timestamp', y='powerConsumed', title='Power Consumption in Room When Devices were Off')
+    fig_power_consumption_room_when_off = cached('power_consumption_room_when_off', power_consumption_room_when_off)
     
     return (
         total_power_room,
         json.dumps(total_power_per_device, indent=4),
         average_power_room,
         json.dumps(average_power_per_device, indent=4),
-        fig_power_consumption_trends,
         fig_power_consumption_outliers,
         fig_peak_power_times,
         fig_device_utilization_ratio,
         fig_device_parameters_correlation,
         fig_energy_efficiency_analysis,
         fig_power_consumption_when_off,
-        fig_power_consumption_room_when_off
+        fig_power_consumption_room_when_off,
+        cached('recent_alerts', lambda: alerts_table(detector.events(limit=20))),
+        version
     )
 
+# Graph: Trends of Power Consumption Across Devices
+# (raw rows or rollups for the selected range, downsampled to the chart's
+# point budget)
+def update_power_trends(trend_range, n, shown=None):
+    telemetry.refresh()
+    df, version = telemetry.snapshot()
+    if shown == {'range': trend_range, 'version': version}:
+        return dash.no_update, dash.no_update
+    span = TREND_RANGES.get(trend_range)
+    start = datetime.now() - span if span is not None else None
+    def power_consumption_trends():
+        trends = rollups.chart_frame(df, 'powerConsumed', group='ModelID', start=start, budget=CHART_POINT_BUDGET)
+        return px.line(trends, x='Timestamp', y='powerConsumed', color='ModelID', title='Trends of Power Consumption Across Devices')
+    fig = figures.get(f'power_consumption_trends:{trend_range}', version, telemetry.window, power_consumption_trends)
+    return fig, {'range': trend_range, 'version': version}
+
+# Define callbacks to update the page components
+def register_callbacks(app):
+    app.callback(
+        Output('total_power_consumed_room', 'children'),
+        Output('total_power_per_device', 'children'),
+        Output('average_power_room', 'children'),
+        Output('average_power_per_device', 'children'),
+        Output('power_consumption_outliers', 'figure'),
+        Output('peak_power_times', 'figure'),
+        Output('device_utilization_ratio', 'figure'),
+        Output('device_parameters_correlation', 'figure'),
+        Output('energy_efficiency_analysis', 'figure'),
+        Output('power_consumption_when_off', 'figure'),
+        Output('power_consumption_room_when_off', 'figure'),
+        Output('recent_alerts', 'children'),
+        Output('analyse-version', 'data'),
+        Input('interval-component', 'n_intervals'),
+        State('analyse-version', 'data')
+    )(metrics.timed('callback_seconds', callback='update_metrics_and_graphs')(update_metrics_and_graphs))
+    app.callback(
+        Output('power_consumption_trends', 'figure'),
+        Output('power-trends-version', 'data'),
+        Input('power_consumption_trends_range', 'value'),
+        Input('interval-component', 'n_intervals'),
+        State('power-trends-version', 'data')
+    )(metrics.timed('callback_seconds', callback='update_power_trends')(update_power_trends))
+
 if __name__ == '__main__':
+    app = dash.Dash(__name__)
+    app.layout = layout
+    register_callbacks(app)
     app.run_server(debug=True)
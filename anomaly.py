@@ -0,0 +1,241 @@
+import math
+import threading
+from collections import deque
+import numpy as np
+import pandas as pd
+from telemetrysink import row_timestamps
+from metrics import metrics
+
+
+ID_COLUMN = 'ID (must be unique)'
+ANOMALY_PROPERTIES = ['powerConsumed', 'temperature', 'humidity', 'brightness']
+EVENT_COLUMNS = ['Timestamp', 'ModelID', ID_COLUMN, 'Kind', 'Property', 'Value', 'Expected', 'Score']
+PHANTOM_LOAD = 'phantom_load'
+OUTLIER = 'outlier'
+# Mean absolute deviation of a normal variable, in standard deviations
+MAD_SCALE = math.sqrt(2 / math.pi)
+
+
+class DeviceStats:
+    # Per-device running statistics of one property, one array slot per
+    # device: an EWMA mean and variance, and a robust location/scale (a
+    # Huber-clipped EWMA and the EWMA of absolute deviations)
+    __slots__ = ('alpha', 'clip', 'count', 'mean', 'var', 'location', 'scale')
+
+    def __init__(self, alpha, clip=3.0, size=0) -> None:
+        self.alpha = alpha
+        self.clip = clip
+        self.count = np.zeros(size, dtype='int64')
+        self.mean = np.zeros(size)
+        self.var = np.zeros(size)
+        self.location = np.zeros(size)
+        self.scale = np.zeros(size)
+
+    def grow(self, size):
+        extra = size - len(self.count)
+        if extra <= 0:
+            return
+        for name in ('count', 'mean', 'var', 'location', 'scale'):
+            column = getattr(self, name)
+            setattr(self, name, np.concatenate([column, np.zeros(max(extra, len(column)), dtype=column.dtype)]))
+
+    def update(self, slots, values):
+        # `slots` must be unique. Scores use the statistics from before this
+        # value, so an outlier does not mask itself; NaN until there is spread.
+        alpha = self.alpha
+        count = self.count[slots]
+        mean = self.mean[slots]
+        var = self.var[slots]
+        location = self.location[slots]
+        scale = self.scale[slots]
+        first = count == 0
+        delta = values - mean
+        deviation = values - location
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = np.where((var > 0) & ~first, delta / np.sqrt(var), np.nan)
+            robust_z = np.where((scale > 0) & ~first, MAD_SCALE * deviation / scale, np.nan)
+        limit = np.where(scale > 0, self.clip * scale, np.abs(deviation))
+        self.mean[slots] = np.where(first, values, mean + alpha * delta)
+        self.var[slots] = np.where(first, 0.0, (1 - alpha) * (var + alpha * delta * delta))
+        self.location[slots] = np.where(first, values, location + alpha * np.clip(deviation, -limit, limit))
+        self.scale[slots] = np.where(first, 0.0, scale + alpha * (np.minimum(np.abs(deviation), limit) - scale))
+        self.count[slots] = count + 1
+        return z, robust_z, count
+
+
+class EventLog:
+    # Bounded log of anomaly events, stored as one frame per batch so that
+    # appending costs O(events in the batch)
+    def __init__(self, max_events=100000) -> None:
+        self.max_events = max_events
+        self.frames = deque()
+        self.size = 0
+        self.version = 0
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def append(self, events):
+        if events.empty:
+            return
+        with self._lock:
+            self.frames.append(events)
+            self.size += len(events)
+            for kind, count in events['Kind'].value_counts().items():
+                self.totals[kind] = self.totals.get(kind, 0) + int(count)
+            while self.size > self.max_events:
+                oldest = self.frames[0]
+                excess = self.size - self.max_events
+                if excess >= len(oldest):
+                    self.frames.popleft()
+                    self.size -= len(oldest)
+                else:
+                    self.frames[0] = oldest.iloc[excess:]
+                    self.size -= excess
+            self.version += 1
+
+    def query(self, start=None, end=None, kind=None, device=None, model=None, limit=None):
+        # Events in arrival order, optionally filtered; `limit` keeps the latest
+        with self._lock:
+            frames = list(self.frames)
+        if not frames:
+            return pd.DataFrame(columns=EVENT_COLUMNS)
+        events = pd.concat(frames, ignore_index=True)
+        mask = np.ones(len(events), dtype=bool)
+        if start is not None:
+            mask &= (events['Timestamp'] >= pd.Timestamp(start)).to_numpy()
+        if end is not None:
+            mask &= (events['Timestamp'] < pd.Timestamp(end)).to_numpy()
+        for column, wanted in (('Kind', kind), (ID_COLUMN, device), ('ModelID', model)):
+            if wanted is not None:
+                wanted = [wanted] if isinstance(wanted, str) else list(wanted)
+                mask &= events[column].isin(wanted).to_numpy()
+        events = events[mask]
+        if limit is not None:
+            events = events.iloc[-limit:] if limit > 0 else events.iloc[0:0]
+        return events.reset_index(drop=True)
+
+
+class AnomalyDetector:
+    # Streaming detector fed one telemetry batch at a time. Flags phantom
+    # load (powerConsumed above `phantom_power` while onOff is false) and
+    # values whose EWMA z-score and robust z-score both exceed `threshold`
+    # once a device has `warmup` readings. State is per device, so a batch
+    # costs O(rows in it) whatever the length of the history.
+    def __init__(self, properties=ANOMALY_PROPERTIES, alpha=0.05, threshold=4.0, warmup=20,
+                 phantom_power=0.0, max_events=100000) -> None:
+        self.properties = list(properties)
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        self.phantom_power = phantom_power
+        self.stats = {name: DeviceStats(alpha) for name in self.properties}
+        self.devices = {}
+        self.models = np.empty(0, dtype=object)
+        self.log = EventLog(max_events)
+        self._lock = threading.Lock()
+
+    def _slots(self, ids, models):
+        slots = np.fromiter((self.devices.setdefault(device_id, len(self.devices)) for device_id in ids),
+                            dtype='int64', count=len(ids))
+        if len(self.devices) > len(self.models):
+            for stats in self.stats.values():
+                stats.grow(len(self.devices))
+            self.models = np.concatenate([self.models, np.empty(len(self.devices) - len(self.models), dtype=object)])
+        self.models[slots] = models
+        return slots
+
+    def _events(self, rows, keys, kind, name, values, expected, scores):
+        timestamps, device_ids, model_ids = keys
+        return pd.DataFrame({
+            'Timestamp': timestamps[rows],
+            'ModelID': model_ids[rows],
+            ID_COLUMN: device_ids[rows],
+            'Kind': kind,
+            'Property': name,
+            'Value': values[rows],
+            'Expected': expected[rows],
+            'Score': scores[rows],
+        }, columns=EVENT_COLUMNS)
+
+    def update(self, batch):
+        if batch is None or batch.empty:
+            return pd.DataFrame(columns=EVENT_COLUMNS)
+        with self._lock, metrics.timer('stage_seconds', stage='anomaly_detection'):
+            keys = (row_timestamps(batch).to_numpy(), batch[ID_COLUMN].to_numpy(dtype=object),
+                    batch['ModelID'].to_numpy(dtype=object))
+            slots = self._slots(keys[1], keys[2])
+            events = []
+            if 'onOff' in batch.columns and 'powerConsumed' in batch.columns:
+                power = batch['powerConsumed'].astype('float64').to_numpy()
+                off = (batch['onOff'] == False).fillna(False).to_numpy(dtype=bool)
+                phantom = np.flatnonzero(off & (power > self.phantom_power))
+                events.append(self._events(phantom, keys, PHANTOM_LOAD, 'powerConsumed',
+                                           power, np.zeros(len(power)), power))
+            # A batch read from the sink can hold several ticks per device;
+            # it is applied in rounds with each device at most once per round
+            occurrence = pd.Series(slots).groupby(slots).cumcount().to_numpy()
+            order = np.argsort(occurrence, kind='stable')
+            bounds = np.searchsorted(occurrence[order], np.arange(occurrence.max() + 2))
+            for name in self.properties:
+                if name not in batch.columns:
+                    continue
+                values = batch[name].astype('float64').to_numpy()
+                expected = np.full(len(values), np.nan)
+                z = np.full(len(values), np.nan)
+                robust_z = np.full(len(values), np.nan)
+                seen = np.zeros(len(values), dtype='int64')
+                stats = self.stats[name]
+                for lower, upper in zip(bounds[:-1], bounds[1:]):
+                    rows = order[lower:upper]
+                    rows = rows[~np.isnan(values[rows])]
+                    if len(rows):
+                        expected[rows] = stats.mean[slots[rows]]
+                        z[rows], robust_z[rows], seen[rows] = stats.update(slots[rows], values[rows])
+                with np.errstate(invalid='ignore'):
+                    flagged = (seen >= self.warmup) & (np.abs(z) > self.threshold) & (np.abs(robust_z) > self.threshold)
+                outliers = np.flatnonzero(flagged)
+                events.append(self._events(outliers, keys, OUTLIER, name, values, expected, robust_z))
+            events = pd.concat([frame for frame in events if not frame.empty] or [pd.DataFrame(columns=EVENT_COLUMNS)],
+                               ignore_index=True)
+        if not events.empty:
+            events = events.sort_values('Timestamp', kind='stable').reset_index(drop=True)
+            for kind, count in events['Kind'].value_counts().items():
+                metrics.inc('anomalies_total', int(count), kind=kind)
+            self.log.append(events)
+        return events
+
+    def on_telemetry(self, new_rows, evicted_rows):
+        # TelemetryCache listener; the detector keeps its own state, so
+        # evicted rows need no work
+        self.update(new_rows)
+
+    def events(self, **filters):
+        return self.log.query(**filters)
+
+    def device_state(self, name='powerConsumed'):
+        # Current per-device baseline of one property
+        with self._lock:
+            stats = self.stats[name]
+            size = len(self.devices)
+            return pd.DataFrame({
+                'ModelID': self.models[:size],
+                'readings': stats.count[:size],
+                'mean': stats.mean[:size],
+                'std': np.sqrt(stats.var[:size]),
+                'location': stats.location[:size],
+                'scale': stats.scale[:size] / MAD_SCALE,
+            }, index=pd.Index(list(self.devices), name=ID_COLUMN))
+
+
+_detectors = {}
+_detectors_lock = threading.Lock()
+
+
+def get_detector(telemetry):
+    # One detector per telemetry cache, shared by every page reading it
+    with _detectors_lock:
+        detector = _detectors.get(telemetry)
+        if detector is None:
+            detector = _detectors[telemetry] = AnomalyDetector()
+            telemetry.add_listener(detector.on_telemetry)
+        return detector
@@ -0,0 +1,197 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+MODEL_PATH = './assests/'
+TEMPLATE_PATH = './assests/RoomScenario-smarthome.xlsx'
+
+
+def measure(name, params, fn, repeat=5, setup=None, items=None):
+    # Runs setup() untimed before every timed fn(setup_result)
+    timings = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        started = time.perf_counter()
+        fn(argument) if setup else fn()
+        timings.append(time.perf_counter() - started)
+    result = {
+        'name': name,
+        'params': params,
+        'repeat': repeat,
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.fmean(timings),
+        'max': max(timings),
+    }
+    if items:
+        result['items'] = items
+        result['items_per_second'] = items / result['median'] if result['median'] else None
+    print(f"{name} {params}: median {result['median'] * 1000:.2f}ms")
+    return result
+
+
+def make_home(tmp, homes, rooms_per_home, latency):
+    import pandas as pd
+    import fleet
+    from DigitalTwinSmartHome import DigitalTwinSmartHome
+    from telemetryschema import load_models
+    home = DigitalTwinSmartHome(
+        dtHostName="local://benchmark",
+        excel_path=os.path.join(tmp, 'scenario.xlsx'),
+        dump_path=os.path.join(tmp, 'telemetry'),
+        model_path=MODEL_PATH,
+        seed=0)
+    home.connection()
+    home.dt_client.create_models(load_models(MODEL_PATH))
+    home.dt_client.latency = latency
+    template = pd.read_excel(TEMPLATE_PATH)
+    home.state = pd.concat(fleet.iter_fleet(template, homes, rooms_per_home), ignore_index=True)
+    return home
+
+
+def simulator_benchmarks(homes, rooms_per_home, repeat, latency):
+    import fleet
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        home = make_home(tmp, homes, rooms_per_home, latency)
+        devices = len(home.state)
+        params = {'homes': homes, 'rooms_per_home': rooms_per_home, 'devices': devices, 'latency': latency}
+        relationships = list(fleet.relationships_from(home.state))
+
+        def provision():
+            home.provisioner.create_twins(fleet.twins_from(home.state))
+            home.provisioner.create_relationships(relationships)
+
+        def query_devices():
+            home.dt_client.query_twins("SELECT R.$dtId, AC.$dtId FROM digitaltwins R JOIN AC RELATED R.containsAC "
+                                       "WHERE IS_OF_MODEL(R, 'dtmi:example:Room;1')")
+
+        def counted(result):
+            # Twin API round trips per timed run, what each run would cost
+            # against the remote service
+            result['client_calls'] = (sum(home.dt_client.calls.values()) - before) / repeat
+            return result
+
+        before = sum(home.dt_client.calls.values())
+        results.append(counted(measure('provision', params, provision, repeat, items=devices + len(relationships))))
+        before = sum(home.dt_client.calls.values())
+        results.append(counted(measure('query_room_devices', params, query_devices, repeat, items=devices)))
+
+        registry = home.device_registry()
+        results.append({'name': 'device_state_bytes', 'params': params, 'bytes': registry.nbytes(),
+                        'bytes_per_device': registry.nbytes() / devices})
+        results.append(measure('generate_telemtry', params, home.generate_batch, repeat, items=devices))
+        before = sum(home.dt_client.calls.values())
+        results.append(counted(measure('upload_telemtry', params, lambda batch: home.upload_batch(batch),
+                                       repeat, setup=home.generate_batch, items=devices)))
+        results.append(measure('datadump_append', params, home.persist_batch,
+                               repeat, setup=home.generate_batch, items=devices))
+    return results
+
+
+def write_history(dump_path, devices, ticks):
+    import pandas as pd
+    import fleet
+    from telemetrysink import open_sink
+    from telemetrygenerator import VectorizedTelemetryGenerator
+    sink = open_sink(dump_path, MODEL_PATH)
+    generator = VectorizedTelemetryGenerator(sink.schema, seed=0)
+    template = pd.read_excel(TEMPLATE_PATH)
+    homes = max(1, devices // len(template))
+    state = pd.concat(fleet.iter_fleet(template, homes, 1), ignore_index=True)
+    start = datetime.now() - timedelta(seconds=10 * ticks)
+    for tick in range(ticks):
+        sink.append(generator.update(state), now=start + timedelta(seconds=10 * tick))
+    return sink, generator, state
+
+
+def dashboard_worker(devices, ticks, repeat):
+    # Runs in its own process so every history size starts with cold imports
+    # and an empty telemetry cache
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        dump_path = os.path.join(tmp, 'telemetry')
+        sink, generator, state = write_history(dump_path, devices, ticks)
+        os.environ['SMARTHOME_DUMP_PATH'] = dump_path
+        params = {'devices': len(state), 'history_ticks': ticks, 'rows': len(state) * ticks}
+
+        def new_tick():
+            sink.append(generator.update(state))
+
+        started = time.perf_counter()
+        import analyse
+        import liveanalytics
+        import forecast
+        elapsed = time.perf_counter() - started
+        results.append({'name': 'dashboard_import', 'params': params, 'repeat': 1,
+                        'min': elapsed, 'median': elapsed, 'mean': elapsed, 'max': elapsed})
+        for name, callback in [
+            ('update_metrics_and_graphs', analyse.update_metrics_and_graphs),
+            ('update_power_trends', lambda n: analyse.update_power_trends('window', n)),
+            ('update_forecast', forecast.update_forecast),
+            ('update_live_graph', liveanalytics.update_live_graph),
+        ]:
+            results.append(measure(name, params, lambda _: callback(0), repeat, setup=new_tick))
+        # Another browser opening the page with no new data: served from the figure cache
+        results.append(measure('update_metrics_and_graphs_shared', params, lambda: analyse.update_metrics_and_graphs(0), repeat))
+        # Background work behind update_forecast, run inline here
+        results.append(measure('forecast_refit', params, lambda _: forecast.forecasts.update(), repeat, setup=new_tick))
+        results.append(measure('forecast_device_refit', params, lambda _: forecast.forecasts.update_devices(), repeat,
+                               setup=new_tick))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput benchmarks for the simulator and dashboards")
+    parser.add_argument('--fleet-sizes', default='1,10,100', help="homes per simulator run (comma separated)")
+    parser.add_argument('--rooms-per-home', type=int, default=1)
+    parser.add_argument('--history-sizes', default='10,100,1000', help="telemetry ticks of history for the dashboards")
+    parser.add_argument('--dashboard-devices', type=int, default=90)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0, help="simulated seconds per twin API call")
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--skip-dashboards', action='store_true')
+    parser.add_argument('--dashboard-worker', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--worker-output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.dashboard_worker is not None:
+        with open(args.worker_output, 'w') as f:
+            json.dump(dashboard_worker(args.dashboard_devices, args.dashboard_worker, args.repeat), f)
+        return
+
+    results = []
+    for homes in [int(size) for size in args.fleet_sizes.split(',')]:
+        results.extend(simulator_benchmarks(homes, args.rooms_per_home, args.repeat, args.latency))
+    if not args.skip_dashboards:
+        for ticks in [int(size) for size in args.history_sizes.split(',')]:
+            with tempfile.NamedTemporaryFile(suffix='.json') as worker_output:
+                subprocess.run(
+                    [sys.executable, __file__, '--dashboard-worker', str(ticks),
+                     '--dashboard-devices', str(args.dashboard_devices), '--repeat', str(args.repeat),
+                     '--worker-output', worker_output.name],
+                    check=True)
+                with open(worker_output.name) as f:
+                    results.extend(json.load(f))
+
+    report = {
+        'created': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
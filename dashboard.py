@@ -0,0 +1,60 @@
+import importlib
+import dash
+from dash import dcc, html
+from dash.dependencies import Input, Output
+from flask import Flask
+from telemetrycache import get_cache
+from metrics import register_metrics_route
+
+
+# path -> (page module, navigation title). Every page reads the same shared
+# telemetry cache, so the history is held in memory once.
+PAGES = {
+    '/': ('analyse', 'Analytics'),
+    '/forecast': ('forecast', 'Forecasting'),
+    '/live': ('liveanalytics', 'Live Analytics'),
+}
+
+server = Flask(__name__)  # Initialize Flask app
+app = dash.Dash(__name__, server=server, suppress_callback_exceptions=True)
+register_metrics_route(server)  # Prometheus text format on /metrics
+
+
+def page(pathname):
+    return importlib.import_module(PAGES[pathname][0])
+
+
+# Define app layout
+app.layout = html.Div([
+    dcc.Location(id='url'),
+    html.Nav([
+        dcc.Link(title, href=pathname, style={'marginRight': '1em'})
+        for pathname, (_, title) in PAGES.items()
+    ]),
+    html.Div(id='page-content')
+])
+
+# Callbacks have to be known before the first request, so the page modules
+# are imported here; their heavy work (statsmodels, the forecast worker
+# pool) only starts once a page is first visited.
+for pathname in PAGES:
+    page(pathname).register_callbacks(app)
+
+
+@app.callback(
+    Output('page-content', 'children'),
+    Input('url', 'pathname')
+)
+def display_page(pathname):
+    if pathname not in PAGES:
+        return html.H1("Page not found")
+    module = page(pathname)
+    if hasattr(module, 'forecasts'):
+        module.forecasts.start()
+    return module.layout
+
+
+if __name__ == '__main__':
+    # Ticks published by `src.py simulate` reach every page without file I/O
+    get_cache().subscribe()
+    server.run(debug=True, port=8050)
@@ -0,0 +1,189 @@
+import json
+import numpy as np
+import pandas as pd
+from telemetrygenerator import DeviceLayout
+
+
+ID_COLUMN = 'ID (must be unique)'
+
+
+def empty_column(dtype, size):
+    if dtype == 'float64':
+        return np.full(size, np.nan)
+    if dtype == 'Int64':
+        return np.zeros(size, dtype='int64')
+    if dtype == 'boolean':
+        return np.zeros(size, dtype=bool)
+    return np.full(size, None, dtype=object)
+
+
+def parse_init_data(value):
+    if not isinstance(value, str) or not value:
+        return {}
+    try:
+        payload = json.loads(value)
+    except ValueError:
+        return {}
+    return payload if isinstance(payload, dict) else {}
+
+
+class ModelBlock:
+    # Struct-of-arrays state for every device of one model: one typed array
+    # per declared property plus a mask of which values are set
+    __slots__ = ('model_id', 'positions', 'ids', 'names', 'values', 'valid')
+
+    def __init__(self, model_id, positions, ids, names, schema) -> None:
+        self.model_id = model_id
+        # Row of each device in the scenario sheet
+        self.positions = positions
+        self.ids = ids
+        self.names = names
+        self.values = {name: empty_column(schema.dtype(name), len(ids)) for name in names}
+        self.valid = {name: np.zeros(len(ids), dtype=bool) for name in names}
+
+    def nbytes(self):
+        return (self.positions.nbytes + self.ids.nbytes
+                + sum(column.nbytes for column in self.values.values())
+                + sum(mask.nbytes for mask in self.valid.values()))
+
+
+class DeviceBatch:
+    # Immutable snapshot of some devices after a tick. The simulator passes
+    # these between stages; JSON and DataFrames are only built at the edges.
+    __slots__ = ('registry', 'parts')
+
+    def __init__(self, registry, parts) -> None:
+        self.registry = registry
+        # [(model id, positions, ids, {name: values}, {name: valid})]
+        self.parts = parts
+
+    def __len__(self):
+        return sum(len(part[2]) for part in self.parts)
+
+    def updates(self):
+        # Property values carried by the batch
+        return sum(int(mask.sum()) for part in self.parts for mask in part[4].values())
+
+    def positions(self):
+        if not self.parts:
+            return np.empty(0, dtype='int64')
+        return np.sort(np.concatenate([part[1] for part in self.parts]))
+
+    def records(self, skip_positions=()):
+        # (device id, model id, {property: value}) with plain Python values
+        for model_id, positions, ids, values, valid in self.parts:
+            names = list(values)
+            columns = [values[name].tolist() for name in names]
+            masks = [valid[name].tolist() for name in names]
+            for i, device_id in enumerate(ids.tolist()):
+                if positions[i] in skip_positions:
+                    continue
+                yield device_id, model_id, {
+                    name: column[i] for name, column, mask in zip(names, columns, masks) if mask[i]
+                }
+
+    def init_data(self):
+        # 'Init Data' JSON payloads in scenario row order
+        rows = np.searchsorted(self.positions(), np.concatenate([part[1] for part in self.parts])) if self.parts else []
+        payloads = np.empty(len(self), dtype=object)
+        payloads[rows] = [json.dumps(properties) for _, _, properties in self.records()]
+        return payloads
+
+    def to_frame(self, with_init_data=True):
+        # Scenario rows for these devices plus typed property columns, the
+        # shape the telemetry sink stores
+        registry = self.registry
+        positions = self.positions()
+        frame = registry.frame.iloc[positions]
+        model_rows = {}
+        parts = {}
+        for model_id, model_positions, _, values, valid in self.parts:
+            rows = np.searchsorted(positions, model_positions)
+            model_rows[model_id] = rows
+            for name, column in values.items():
+                parts.setdefault(name, []).append((rows[valid[name]], column[valid[name]]))
+        draws = {}
+        for name, pieces in parts.items():
+            rows = np.concatenate([piece[0] for piece in pieces])
+            values = np.concatenate([piece[1] for piece in pieces])
+            order = np.argsort(rows, kind='stable')
+            draws[name] = (rows[order], values[order])
+        layout = DeviceLayout(len(positions), {name: rows for name, (rows, _) in draws.items()}, model_rows)
+        columns = registry.generator.typed_columns(layout, draws)
+        if with_init_data:
+            columns['Init Data'] = self.init_data()
+        return frame.assign(**{name: pd.Series(values, index=frame.index) for name, values in columns.items()})
+
+
+class DeviceRegistry:
+    # Owns the simulation state between ticks. Built once from the scenario
+    # sheet (the only time 'Init Data' is parsed); each tick draws new
+    # values straight into the per-model arrays.
+    def __init__(self, frame, generator) -> None:
+        self.frame = frame
+        self.generator = generator
+        schema = generator.schema
+        model_ids = frame['ModelID'].to_numpy(dtype=object)
+        ids = frame[ID_COLUMN].to_numpy(dtype=object)
+        init_data = frame['Init Data'].tolist() if 'Init Data' in frame.columns else [None] * len(frame)
+        self.blocks = {}
+        self.index = {}
+        self._selections = {}
+        for model_id in pd.unique(model_ids):
+            positions = np.flatnonzero(model_ids == model_id)
+            names = list(schema.model_properties.get(model_id, []))
+            block = ModelBlock(model_id, positions, ids[positions], names, schema)
+            for slot, position in enumerate(positions.tolist()):
+                for name, value in parse_init_data(init_data[position]).items():
+                    if name in block.values and value is not None:
+                        try:
+                            block.values[name][slot] = value
+                        except (TypeError, ValueError):
+                            continue
+                        block.valid[name][slot] = True
+            self.blocks[model_id] = block
+            for slot, device_id in enumerate(block.ids.tolist()):
+                self.index[device_id] = (model_id, slot)
+
+    def __len__(self):
+        return len(self.index)
+
+    def nbytes(self):
+        return sum(block.nbytes() for block in self.blocks.values())
+
+    def selection(self, device_ids=None):
+        # [(block, slots)] for a set of devices; cached, since the scheduler
+        # asks for the same cadence groups on every tick
+        if device_ids is None:
+            return [(block, np.arange(len(block.ids))) for block in self.blocks.values()]
+        key = hash(tuple(device_ids))
+        if key not in self._selections:
+            slots = {}
+            for device_id in device_ids:
+                if device_id in self.index:
+                    model_id, slot = self.index[device_id]
+                    slots.setdefault(model_id, []).append(slot)
+            if len(self._selections) > 64:
+                self._selections = {}
+            self._selections[key] = [(self.blocks[model_id], np.asarray(sorted(model_slots))) for model_id, model_slots in slots.items()]
+        return self._selections[key]
+
+    def tick(self, device_ids=None, draw=True):
+        generator = self.generator
+        parts = []
+        for block, slots in self.selection(device_ids):
+            values = {}
+            valid = {}
+            for name in block.names:
+                if draw and name in generator.distributions:
+                    block.values[name][slots] = generator.draw_values(name, len(slots))
+                    block.valid[name][slots] = True
+                # Fancy indexing copies, so later ticks never alter this batch
+                values[name] = block.values[name][slots]
+                valid[name] = block.valid[name][slots]
+            parts.append((block.model_id, block.positions[slots], block.ids[slots], values, valid))
+        return DeviceBatch(self, parts)
+
+    def snapshot(self, device_ids=None):
+        # Current values without drawing new ones
+        return self.tick(device_ids, draw=False)
@@ -0,0 +1,67 @@
+import json
+import threading
+from collections import OrderedDict
+from metrics import metrics
+
+
+class FigureCache:
+    # LRU of built figures keyed by (figure id, data version, time window),
+    # shared by every browser session. A figure is built and run through the
+    # Plotly encoder once per key; callbacks then hand out the same plain
+    # JSON payload, and concurrent misses on one key wait for a single build.
+    def __init__(self, max_entries=64) -> None:
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self._building = {}
+        self._lock = threading.Lock()
+
+    def payload(self, figure):
+        # Plain dicts and lists, which Dash serializes without the Plotly
+        # encoder's per-value work
+        if hasattr(figure, 'to_json'):
+            text = figure.to_json()
+            metrics.inc('bytes_total', len(text), kind='figure')
+            return json.loads(text)
+        return figure
+
+    def get(self, figure_id, version, window, build):
+        key = (figure_id, version, window)
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                metrics.inc('figure_cache_total', result='hit')
+                return self.entries[key]
+            building = self._building.get(key)
+            if building is None:
+                building = self._building[key] = threading.Event()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            building.wait()
+            with self._lock:
+                if key in self.entries:
+                    metrics.inc('figure_cache_total', result='hit')
+                    return self.entries[key]
+            # The build failed in the other session; build here instead
+            return self.payload(build())
+        try:
+            payload = self.payload(build())
+            with self._lock:
+                self.entries[key] = payload
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        finally:
+            with self._lock:
+                del self._building[key]
+            building.set()
+        metrics.inc('figure_cache_total', result='miss')
+        return payload
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+
+# One cache for every dashboard page
+figures = FigureCache()
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+
+ID_COLUMN = 'ID (must be unique)'
+SOURCE_COLUMN = 'Relationship (From)'
+
+
+def room_prefix(home, room):
+    return f"H{home:05d}R{room:03d}-"
+
+
+def stamp_rooms(template, prefixes):
+    # Repeat the template once per prefix, renaming every twin and every
+    # relationship source inside the copy
+    prefixes = np.asarray(prefixes, dtype=object)
+    size = len(template)
+    repeated = np.repeat(prefixes, size)
+    chunk = pd.DataFrame({column: np.tile(template[column].to_numpy(dtype=object), len(prefixes))
+                          for column in template.columns})
+    chunk[ID_COLUMN] = repeated + chunk[ID_COLUMN].astype(str).to_numpy(dtype=object)
+    sources = chunk[SOURCE_COLUMN]
+    has_source = sources.notna() & (sources.astype(str) != '')
+    chunk[SOURCE_COLUMN] = sources.where(~has_source, pd.Series(repeated, index=chunk.index) + sources.astype(str))
+    return chunk
+
+
+def iter_fleet(template, homes, rooms_per_home, homes_per_chunk=100, first_home=0):
+    # Stream the fleet a few homes at a time instead of building one frame;
+    # homes are numbered from first_home, so shards get disjoint twin ids
+    end = first_home + homes
+    for first_home in range(first_home, end, homes_per_chunk):
+        last_home = min(first_home + homes_per_chunk, end)
+        prefixes = [room_prefix(home, room) for home in range(first_home, last_home) for room in range(rooms_per_home)]
+        yield stamp_rooms(template, prefixes)
+
+
+def twins_from(chunk):
+    for model_id, digital_twin_id in zip(chunk['ModelID'], chunk[ID_COLUMN]):
+        yield digital_twin_id, {
+            "$metadata": {
+                "$model": model_id
+            },
+            "$dtId": digital_twin_id
+        }
+
+
+def relationships_from(chunk):
+    # Same relationship naming as DigitalTwinSmartHome.create_relationships;
+    # rows without a source (the rooms) have no incoming relationship
+    sources = chunk[SOURCE_COLUMN]
+    chunk = chunk[sources.notna() & (sources.astype(str) != '')]
+    for source, name, target in zip(chunk[SOURCE_COLUMN], chunk['Relationship Name'], chunk[ID_COLUMN]):
+        yield {
+            "$relationshipId": f"RoomContains{target}",
+            "$sourceId": source,
+            "$relationshipName": name,
+            "$targetId": target,
+        }
+
+
+def write_fleet(template_path, excel_path, homes, rooms_per_home):
+    # Materialise a fleet as a scenario workbook the simulator can run
+    template = pd.read_excel(template_path)
+    fleet = pd.concat(iter_fleet(template, homes, rooms_per_home), ignore_index=True)
+    fleet.to_excel(excel_path, index=False)
+    print(f"Wrote {len(fleet)} twins for {homes} homes x {rooms_per_home} rooms to {excel_path}")
+    return len(fleet)
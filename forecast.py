@@ -1,22 +1,19 @@
 import dash
 from dash import dcc, html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 import plotly.graph_objects as go
-import pandas as pd
-import json
-import time
 import numpy as np
-from statsmodels.tsa.arima.model import ARIMA
-import matplotlib.pyplot as plt
 from flask import Flask  
+from telemetrycache import get_cache
+from metrics import metrics, register_metrics_route
+from forecasting import ForecastService, ForecastSpec, DeviceForecaster
+from rollups import lttb, CHART_POINT_BUDGET
+from figurecache import figures
 
-df = pd.read_excel('./assests/datadump.xlsx')
-server = Flask(__name__)  # Initialize Flask app
+telemetry = get_cache()
 
-# Define Dash app
-app = dash.Dash(__name__, server=server)  # Connect Dash to Flask app
-
-app.layout = html.Div([
+# Define app layout
+layout = html.Div([
     html.H1("Forecasting Dashboard"),
     
     # Graph: Forecast for AC Power Consumption
@@ -37,6 +34,17 @@ app.layout = html.Div([
         dcc.Graph(id='energy_cost_forecast')
     ]),
     
+    # Graph: Per-device Power Consumption Forecast
+    html.Div([
+        html.H3("Per-device Power Consumption Forecast:"),
+        dcc.Dropdown(id='forecast_device'),
+        dcc.Graph(id='device_power_forecast')
+    ]),
+    
+    # Forecast versions of the figures this browser is showing
+    dcc.Store(id='forecast-version'),
+    dcc.Store(id='device-forecast-version'),
+    
     # Interval component to trigger updates
     dcc.Interval(
         id='interval-component',
@@ -45,96 +53,121 @@ app.layout = html.Div([
     )
 ])
 
-# Define function to extract 'powerConsumed' values
-def extract_power_consumed(init_data):
-    try:
-        init_data_dict = json.loads(init_data)
-        return init_data_dict.get('powerConsumed', np.nan)
-    except json.JSONDecodeError:
-        return np.nan
-
-# Define function to extract temperature values
-def extract_temperature(init_data):
-    try:
-        init_data_dict = json.loads(init_data)
-        return init_data_dict.get('temperature', np.nan)
-    except json.JSONDecodeError:
-        return np.nan
-
-# Apply function to extract 'powerConsumed' values
-df['powerConsumed'] = df['Init Data'].apply(extract_power_consumed)
-
-# Apply function to extract temperature values
-df['temperature'] = df['Init Data'].apply(extract_temperature)
-
-# Extract data for the AC device
-ac_df = df[df['ModelID'] == 'dtmi:example:Room;1'].copy()
-
-# Parse 'Init Data' column to extract 'powerConsumed' values
-ac_df['powerConsumed'] = ac_df['Init Data'].apply(lambda x: json.loads(x)['powerConsumed'])
-
-# Create a new DataFrame with index and 'powerConsumed' values for AC
-ac_power_df = pd.DataFrame(ac_df['powerConsumed'].values, columns=['AC_Power_Consumption'])
-
-# Set the index starting from 1
-ac_power_df.index = ac_power_df.index + 1
+# Series to forecast; the 'AC' series is the room's power consumption
+def ac_power_series(frame):
+    return frame.loc[frame['ModelID'] == 'dtmi:example:Room;1', 'powerConsumed'].to_numpy(dtype='float64')
 
-# Define ARIMA model for AC power consumption
-ac_model = ARIMA(ac_power_df['AC_Power_Consumption'], order=(2, 2, 2))
+def temperature_series(frame):
+    return frame['temperature'].to_numpy(dtype='float64')
 
-# Fit the ARIMA model
-ac_model_fit = ac_model.fit()
+# ARIMA fits run on a background worker and are published as a snapshot.
+# The energy cost forecast reuses the AC power fit, assuming a rate of
+# $0.2 per unit of power consumption.
+forecasts = ForecastService(telemetry, [
+    ForecastSpec('ac_power', ac_power_series, order=(2, 2, 2)),
+    ForecastSpec('temperature', temperature_series, order=(2, 2, 2)),
+    ForecastSpec('energy_cost', ac_power_series, order=(2, 2, 2), transform=lambda forecast: forecast * 0.2),
+], device_forecaster=DeviceForecaster(properties=('powerConsumed', 'temperature'), order=(2, 2, 2)))
 
-# Forecast next 10 values for AC power consumption
-ac_forecast = ac_model_fit.forecast(steps=10)
-
-# Define ARIMA model for temperature
-temperature_model = ARIMA(df['temperature'], order=(2, 2, 2))
-
-# Fit the ARIMA model
-temperature_model_fit = temperature_model.fit()
-
-# Forecast next 10 values for temperature
-temperature_forecast = temperature_model_fit.forecast(steps=10)
-
-# Define ARIMA model for AC power consumption (for energy cost)
-ac_energy_cost_model = ARIMA(ac_power_df['AC_Power_Consumption'], order=(2, 2, 2))
-
-# Fit the ARIMA model
-ac_energy_cost_model_fit = ac_energy_cost_model.fit()
-
-# Forecast next 10 values for AC power consumption (for energy cost)
-ac_energy_cost_forecast = ac_energy_cost_model_fit.forecast(steps=10)
-
-# Calculate energy cost forecast assuming a rate of $0.2 per unit of power consumption
-energy_cost_forecast = ac_energy_cost_forecast * 0.2
-
-# Define callback to update forecast graphs
-@app.callback(
-    Output('ac_power_forecast', 'figure'),
-    Output('temperature_forecast', 'figure'),
-    Output('energy_cost_forecast', 'figure'),
-    Input('interval-component', 'n_intervals')
-)
-def update_forecast(n):
-    # Plot AC power consumption forecast
+# Plot AC power consumption forecast
+def ac_power_figure(ac_result):
     ac_fig = go.Figure()
-    ac_fig.add_trace(go.Scatter(x=ac_power_df.index, y=ac_power_df['AC_Power_Consumption'], mode='lines', name='Original Data'))
-    ac_fig.add_trace(go.Scatter(x=np.arange(ac_power_df.index[-1] + 1, ac_power_df.index[-1] + 11), y=ac_forecast, mode='markers+lines', name='Forecast', line=dict(color='red')))
+    if ac_result is not None:
+        ac_index = np.arange(1, len(ac_result.history) + 1)
+        shown = lttb(ac_index, ac_result.history, CHART_POINT_BUDGET)
+        ac_fig.add_trace(go.Scatter(x=ac_index[shown], y=ac_result.history[shown], mode='lines', name='Original Data'))
+        ac_fig.add_trace(go.Scatter(x=np.arange(ac_index[-1] + 1, ac_index[-1] + 11), y=ac_result.forecast, mode='markers+lines', name='Forecast', line=dict(color='red')))
     ac_fig.update_layout(title='Forecast for AC Power Consumption', xaxis_title='Index', yaxis_title='AC Power Consumption')
+    return ac_fig
 
-    # Plot temperature forecast
+# Plot temperature forecast
+def temperature_figure(temperature_result):
     temperature_fig = go.Figure()
-    temperature_fig.add_trace(go.Scatter(x=df.index, y=df['temperature'], mode='lines', name='Original Data'))
-    temperature_fig.add_trace(go.Scatter(x=np.arange(df.index[-1] + 1, df.index[-1] + 11), y=temperature_forecast, mode='markers+lines', name='Forecast', line=dict(color='red')))
+    if temperature_result is not None:
+        temperature_index = np.arange(len(temperature_result.history))
+        shown = lttb(temperature_index, temperature_result.history, CHART_POINT_BUDGET)
+        temperature_fig.add_trace(go.Scatter(x=temperature_index[shown], y=temperature_result.history[shown], mode='lines', name='Original Data'))
+        temperature_fig.add_trace(go.Scatter(x=np.arange(temperature_index[-1] + 1, temperature_index[-1] + 11), y=temperature_result.forecast, mode='markers+lines', name='Forecast', line=dict(color='red')))
     temperature_fig.update_layout(title='Temperature Forecast', xaxis_title='Index', yaxis_title='Temperature')
+    return temperature_fig
 
-    # Plot energy cost forecast
+# Plot energy cost forecast
+def energy_cost_figure(energy_cost_result):
     energy_cost_fig = go.Figure()
-    energy_cost_fig.add_trace(go.Scatter(x=np.arange(ac_power_df.index[-1] + 1, ac_power_df.index[-1] + 11), y=energy_cost_forecast, mode='markers+lines', name='Energy Cost Forecast', line=dict(color='green')))
+    if energy_cost_result is not None:
+        last_index = len(energy_cost_result.history)
+        energy_cost_fig.add_trace(go.Scatter(x=np.arange(last_index + 1, last_index + 11), y=energy_cost_result.forecast, mode='markers+lines', name='Energy Cost Forecast', line=dict(color='green')))
     energy_cost_fig.update_layout(title='Forecast for Energy Cost', xaxis_title='Index', yaxis_title='Energy Cost')
+    return energy_cost_fig
+
+# Define callback to update forecast graphs
+def update_forecast(n, shown_version=None):
+    # Never blocks on a fit: plots whatever forecasts were last published.
+    # Figures are built once per forecast version and shared by every
+    # browser; a browser already showing this version gets no update.
+    version = forecasts.version
+    if shown_version == version:
+        return dash.no_update, dash.no_update, dash.no_update, dash.no_update
+    snapshot = forecasts.latest()
+    return (
+        figures.get('ac_power_forecast', version, None, lambda: ac_power_figure(snapshot.get('ac_power'))),
+        figures.get('temperature_forecast', version, None, lambda: temperature_figure(snapshot.get('temperature'))),
+        figures.get('energy_cost_forecast', version, None, lambda: energy_cost_figure(snapshot.get('energy_cost'))),
+        version
+    )
 
-    return ac_fig, temperature_fig, energy_cost_fig
+# Define callback to list the devices that have a forecast
+def update_forecast_devices(n):
+    return forecasts.device_forecaster.devices()
+
+# Plot one device's power consumption forecast
+def device_forecast_figure(device_id):
+    device_fig = go.Figure()
+    result = forecasts.device_forecast(device_id, 'powerConsumed') if device_id else None
+    if result is not None:
+        device_index = np.arange(1, len(result.history) + 1)
+        shown = lttb(device_index, result.history, CHART_POINT_BUDGET)
+        device_fig.add_trace(go.Scatter(x=device_index[shown], y=result.history[shown], mode='lines', name='Original Data'))
+        device_fig.add_trace(go.Scatter(x=np.arange(device_index[-1] + 1, device_index[-1] + 11), y=result.forecast, mode='markers+lines', name='Forecast', line=dict(color='red')))
+    device_fig.update_layout(title=f'Power Consumption Forecast for {device_id or "..."}', xaxis_title='Index', yaxis_title='Power Consumption')
+    return device_fig
+
+# Define callback to plot the selected device's forecast
+def update_device_forecast(device_id, n, shown=None):
+    version = forecasts.version
+    if shown == {'device': device_id, 'version': version}:
+        return dash.no_update, dash.no_update
+    device_fig = figures.get(f'device_power_forecast:{device_id}', version, None, lambda: device_forecast_figure(device_id))
+    return device_fig, {'device': device_id, 'version': version}
+
+# Define callbacks to update the page components
+def register_callbacks(app):
+    app.callback(
+        Output('ac_power_forecast', 'figure'),
+        Output('temperature_forecast', 'figure'),
+        Output('energy_cost_forecast', 'figure'),
+        Output('forecast-version', 'data'),
+        Input('interval-component', 'n_intervals'),
+        State('forecast-version', 'data')
+    )(metrics.timed('callback_seconds', callback='update_forecast')(update_forecast))
+    app.callback(
+        Output('forecast_device', 'options'),
+        Input('interval-component', 'n_intervals')
+    )(metrics.timed('callback_seconds', callback='update_forecast_devices')(update_forecast_devices))
+    app.callback(
+        Output('device_power_forecast', 'figure'),
+        Output('device-forecast-version', 'data'),
+        Input('forecast_device', 'value'),
+        Input('interval-component', 'n_intervals'),
+        State('device-forecast-version', 'data')
+    )(metrics.timed('callback_seconds', callback='update_device_forecast')(update_device_forecast))
 
 if __name__ == '__main__':
+    server = Flask(__name__)  # Initialize Flask app
+    app = dash.Dash(__name__, server=server)  # Connect Dash to Flask app
+    register_metrics_route(server)  # Prometheus text format on /metrics
+    app.layout = layout
+    register_callbacks(app)
+    # The process pool for device forecasts needs the main-module guard
+    forecasts.start()
     server.run(debug=True, port=8000)  
@@ -0,0 +1,289 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from metrics import metrics
+
+
+class ForecastSpec:
+    # series(frame) -> 1-D float array to model; transform(forecast) lets
+    # several published forecasts share one fit (e.g. power -> energy cost)
+    def __init__(self, name, series, order=(2, 2, 2), steps=10, transform=None) -> None:
+        self.name = name
+        self.series = series
+        self.order = order
+        self.steps = steps
+        self.transform = transform
+
+
+class ForecastResult:
+    __slots__ = ('history', 'forecast', 'fitted_at', 'data_version')
+
+    def __init__(self, history, forecast, fitted_at, data_version) -> None:
+        self.history = history
+        self.forecast = forecast
+        self.fitted_at = fitted_at
+        self.data_version = data_version
+
+
+class SeriesModel:
+    # Fitted model for one series, updated in place as the series grows
+    def __init__(self, order) -> None:
+        self.order = order
+        self.values = None
+        self.result = None
+        self.updates = 0
+
+    def fit(self, values, refit_every):
+        from statsmodels.tsa.arima.model import ARIMA
+        if self.result is not None and np.array_equal(values, self.values, equal_nan=True):
+            return self.result
+        if self.result is not None and self.updates < refit_every:
+            return self.extend(values)
+        model = ARIMA(values, order=self.order)
+        start_params = self.result.params if self.result is not None else None
+        self.result = model.fit(start_params=start_params)
+        self.updates = 0
+        self.values = values
+        return self.result
+
+    def extend(self, values):
+        # Takes in the changed series with the current parameters instead of
+        # re-estimating them: new points are appended to the state space
+        # model, and a window that also dropped old points is re-filtered
+        grows = len(values) > len(self.values) and np.array_equal(values[:len(self.values)], self.values, equal_nan=True)
+        if grows:
+            self.result = self.result.append(values[len(self.values):], refit=False)
+        else:
+            self.result = self.result.apply(values, refit=False)
+        self.updates += 1
+        self.values = values
+        return self.result
+
+    def load(self, values, params):
+        # Takes parameters estimated elsewhere (e.g. in a worker process)
+        from statsmodels.tsa.arima.model import ARIMA
+        self.result = ARIMA(values, order=self.order).filter(params)
+        self.updates = 0
+        self.values = values
+        return self.result
+
+
+def series_version(values):
+    return hashlib.sha1(values.tobytes()).hexdigest()
+
+
+def fit_forecast(task):
+    # Runs in a worker process: (key, values, order, steps, start_params)
+    # -> (key, forecast, params). Only plain arrays cross the process boundary.
+    from statsmodels.tsa.arima.model import ARIMA
+    key, values, order, steps, start_params = task
+    try:
+        result = ARIMA(values, order=order).fit(start_params=start_params)
+    except Exception:
+        if start_params is None:
+            raise
+        result = ARIMA(values, order=order).fit()
+    return key, np.asarray(result.forecast(steps=steps)), np.asarray(result.params)
+
+
+class DeviceForecaster:
+    # Batch mode: one model per (device, property) series. Only series that
+    # changed since the last round are updated: in place with the current
+    # parameters, and every `refit_every` updates re-estimated across a
+    # process pool.
+    def __init__(self, properties=('powerConsumed', 'temperature'), order=(2, 2, 2), steps=10,
+                 max_workers=None, refit_every=30, device_column='ID (must be unique)') -> None:
+        self.properties = list(properties)
+        self.order = order
+        self.steps = steps
+        self.max_workers = max_workers or os.cpu_count()
+        self.refit_every = refit_every
+        self.device_column = device_column
+        self.forecasts = {}
+        self.models = {}
+        self._versions = {}
+        self._executor = None
+
+    def _pool(self):
+        # Spawned workers: forking the threaded dashboard process could
+        # copy locks held by other threads
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def tasks(self, frame):
+        minimum = sum(self.order) + 1
+        columns = [name for name in self.properties if name in frame.columns]
+        for device_id, group in frame.groupby(self.device_column, sort=False)[columns]:
+            for name in columns:
+                values = group[name].to_numpy(dtype='float64', na_value=np.nan)
+                values = values[~np.isnan(values)]
+                if len(values) < minimum:
+                    continue
+                key = (device_id, name)
+                version = series_version(values)
+                if self._versions.get(key) == version:
+                    continue
+                yield key, version, values
+
+    def update(self, frame, data_version=None):
+        pending = {}
+        work = []
+        fitted = 0
+        for key, version, values in self.tasks(frame):
+            model = self.models.get(key)
+            if model is not None and model.updates < self.refit_every:
+                try:
+                    forecast = np.asarray(model.extend(values).forecast(steps=self.steps))
+                except Exception:
+                    pass
+                else:
+                    self._publish(key, version, values, forecast, data_version)
+                    fitted += 1
+                    continue
+            pending[key] = (version, values)
+            work.append((key, values, self.order, self.steps, None if model is None else model.result.params))
+        if not work:
+            return fitted
+        chunksize = max(1, len(work) // (self.max_workers * 4))
+        for key, forecast, params in self._pool().map(fit_forecast, work, chunksize=chunksize):
+            version, values = pending[key]
+            self.models.setdefault(key, SeriesModel(self.order)).load(values, params)
+            self._publish(key, version, values, forecast, data_version)
+            fitted += 1
+        return fitted
+
+    def _publish(self, key, version, values, forecast, data_version):
+        self.forecasts[key] = ForecastResult(values, forecast, time.time(), data_version)
+        self._versions[key] = version
+
+    def forecast(self, device_id, name='powerConsumed'):
+        return self.forecasts.get((device_id, name))
+
+    def devices(self):
+        return sorted({device_id for device_id, _ in list(self.forecasts)})
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+class ForecastService:
+    # Fits forecasts on a background thread and publishes the latest results
+    # as one immutable snapshot, so dashboard callbacks never wait on a fit.
+    # Per-device forecasts are fitted on a second thread, every
+    # `device_interval` seconds, so they never hold up the main ones.
+    def __init__(self, telemetry, specs, interval=10.0, refit_every=30, device_forecaster=None,
+                 device_interval=None) -> None:
+        self.telemetry = telemetry
+        self.specs = specs
+        self.device_forecaster = device_forecaster
+        self.interval = interval
+        self.device_interval = device_interval or interval
+        self.refit_every = refit_every
+        self.snapshot = {}
+        # Bumped whenever new forecasts are published
+        self.version = 0
+        self._models = {}
+        self._fitted_version = None
+        self._device_version = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._device_thread = None
+        self._lock = threading.Lock()
+
+    def latest(self, name=None):
+        snapshot = self.snapshot
+        return snapshot if name is None else snapshot.get(name)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='forecast-service', daemon=True)
+            self._thread.start()
+        if self.device_forecaster is not None and self._device_thread is None:
+            self._device_thread = threading.Thread(target=self._run_devices, name='forecast-devices', daemon=True)
+            self._device_thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self.device_forecaster is not None:
+            self.device_forecaster.shutdown()
+
+    def device_forecast(self, device_id, name='powerConsumed'):
+        if self.device_forecaster is None:
+            return None
+        return self.device_forecaster.forecast(device_id, name)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with metrics.timer('stage_seconds', stage='forecast_refit'):
+                    self.update()
+            except Exception as e:
+                print("Error updating forecasts:", e)
+            self._stop.wait(self.interval)
+
+    def _run_devices(self):
+        while not self._stop.is_set():
+            try:
+                with metrics.timer('stage_seconds', stage='forecast_device_refit'):
+                    self.update_devices()
+            except Exception as e:
+                print("Error fitting device forecasts:", e)
+            self._stop.wait(self.device_interval)
+
+    def _publish(self):
+        with self._lock:
+            self.version += 1
+
+    def update(self):
+        self.telemetry.refresh()
+        version = self.telemetry.version
+        if version == self._fitted_version:
+            return self.snapshot
+        frame = self.telemetry.frame
+        snapshot = {}
+        fitted = {}
+        for spec in self.specs:
+            values = np.asarray(spec.series(frame), dtype='float64')
+            if len(values) <= sum(spec.order):
+                continue
+            # Identical series with the same order are only fitted once
+            key = (spec.order, spec.steps, hashlib.sha1(values.tobytes()).hexdigest())
+            try:
+                if key not in fitted:
+                    model = self._models.setdefault((spec.name, spec.order), SeriesModel(spec.order))
+                    fitted[key] = model.fit(values, self.refit_every).forecast(steps=spec.steps)
+            except Exception as e:
+                print(f"Error fitting forecast {spec.name}:", e)
+                if spec.name in self.snapshot:
+                    snapshot[spec.name] = self.snapshot[spec.name]
+                continue
+            forecast = np.asarray(fitted[key])
+            if spec.transform is not None:
+                forecast = spec.transform(forecast)
+            snapshot[spec.name] = ForecastResult(values, forecast, time.time(), version)
+        # A single assignment publishes the whole snapshot atomically; the
+        # version moves with it
+        self.snapshot = snapshot
+        self._fitted_version = version
+        self._publish()
+        return snapshot
+
+    def update_devices(self):
+        self.telemetry.refresh()
+        version = self.telemetry.version
+        if self.device_forecaster is None or version == self._device_version:
+            return 0
+        fitted = self.device_forecaster.update(self.telemetry.frame, version)
+        self._device_version = version
+        if fitted:
+            self._publish()
+        return fitted
@@ -1,46 +1,70 @@
 import dash
 from dash import dcc, html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 import pandas as pd
-import json
-import time
 import plotly.graph_objects as go
+from telemetrycache import get_cache
+from metrics import metrics
+from rollups import lttb, CHART_POINT_BUDGET
 
-df = pd.read_excel('./assests/datadump.xlsx')
-app = dash.Dash(__name__)
+telemetry = get_cache()
+
+AC_MODEL = 'dtmi:example:AC;1'
+# Poll period of the browser; with the bus connected each poll is served
+# from memory and only ships the rows the browser has not seen yet
+LIVE_INTERVAL_MS = 500
 
 # Define app layout
-app.layout = html.Div([
+layout = html.Div([
     html.H1("Live Analytics"),
     
     # Graph: Live AC Power Consumption
     dcc.Graph(id='live-ac-power-consumption'),
     
+    # Rows of the shared cache already sent to this browser
+    dcc.Store(id='live-position'),
+    
     # Interval component to trigger updates
     dcc.Interval(
         id='interval-component',
-        interval=10000,  # in milliseconds (10 seconds)
+        interval=LIVE_INTERVAL_MS,
         n_intervals=0
     )
 ])
 
-# Define callback to update the live graph
-@app.callback(
-    Output('live-ac-power-consumption', 'figure'),
-    Input('interval-component', 'n_intervals')
-)
-def update_live_graph(n):
+def ac_power(df):
+    return df.loc[df['ModelID'] == AC_MODEL, 'powerConsumed'].astype('float64')
 
-    df = pd.read_excel('./assests/datadump.xlsx')
+# Define callback to update the live graph. The whole figure is only built
+# for a new browser (or one that fell out of the cache window); after that
+# new points are appended through extendData.
+def update_live_graph(n, position=None):
+
+    telemetry.refresh()
+
+    if position is not None:
+        # Only the cache chunks holding rows this browser has not seen
+        new_rows, rows_seen = telemetry.tail(position['rows'])
+        if new_rows is not None and position['rows'] <= rows_seen:
+            if position['rows'] == rows_seen:
+                return dash.no_update, dash.no_update, dash.no_update
+            new_power = ac_power(new_rows)
+            points = position['points'] + len(new_power)
+            if new_power.empty:
+                return dash.no_update, dash.no_update, {'rows': rows_seen, 'points': points}
+            x = list(range(position['points'] + 1, points + 1))
+            extension = (dict(x=[x], y=[new_power.tolist()]), [0], CHART_POINT_BUDGET)
+            return dash.no_update, extension, {'rows': rows_seen, 'points': points}
+
+    df, rows_seen = telemetry.snapshot()
 
-    ac_df = df[df['ModelID'] == 'dtmi:example:AC;1'].copy()
-    
-    # Parse 'Init Data' column to extract 'powerConsumed' values
-    ac_df['powerConsumed'] = ac_df['Init Data'].apply(lambda x: json.loads(x)['powerConsumed'])
-    
     # Create a new DataFrame with index and 'powerConsumed' values for AC
-    ac_power_df = pd.DataFrame(ac_df['powerConsumed'].values, columns=['AC_Power_Consumption'])
+    ac_power_df = pd.DataFrame(ac_power(df).values, columns=['AC_Power_Consumption'])
     ac_power_df.index = ac_power_df.index + 1
+    points = len(ac_power_df)
+    
+    # Cap the trace at the chart's point budget
+    ac_power_df = ac_power_df.iloc[lttb(ac_power_df.index.to_numpy(), ac_power_df['AC_Power_Consumption'].to_numpy(), CHART_POINT_BUDGET)]
     
     # Plot the live graph using Plotly
     live_graph = go.Figure()
@@ -49,7 +73,21 @@ def update_live_graph(n):
                              xaxis_title='Index',
                              yaxis_title='AC Power Consumption')
     
-    return live_graph
+    return live_graph, dash.no_update, {'rows': rows_seen, 'points': points}
+
+# Define callbacks to update the page components
+def register_callbacks(app):
+    app.callback(
+        Output('live-ac-power-consumption', 'figure'),
+        Output('live-ac-power-consumption', 'extendData'),
+        Output('live-position', 'data'),
+        Input('interval-component', 'n_intervals'),
+        State('live-position', 'data')
+    )(metrics.timed('callback_seconds', callback='update_live_graph')(update_live_graph))
 
 if __name__ == '__main__':
+    telemetry.subscribe()
+    app = dash.Dash(__name__)
+    app.layout = layout
+    register_callbacks(app)
     app.run_server(debug=True, port=5000)
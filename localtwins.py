@@ -0,0 +1,211 @@
+import copy
+import threading
+import time
+from twinquery import QueryError, run_query
+
+
+class LocalTwinsError(Exception):
+    # Mirrors the status_code attribute of azure.core HttpResponseError
+    def __init__(self, message, status_code) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LocalModel:
+    def __init__(self, model) -> None:
+        self.id = model['@id']
+        self.model = model
+
+
+def apply_patch(twin, operations):
+    for operation in operations:
+        key = operation['path'].lstrip('/').replace('~1', '/').replace('~0', '~')
+        if operation['op'] in ('add', 'replace'):
+            if operation['op'] == 'replace' and key not in twin:
+                raise LocalTwinsError(f"Property {key} does not exist", 400)
+            twin[key] = copy.deepcopy(operation['value'])
+        elif operation['op'] == 'remove':
+            twin.pop(key, None)
+        else:
+            raise LocalTwinsError(f"Unsupported patch operation {operation['op']}", 400)
+
+
+class InMemoryDigitalTwinsClient:
+    # Stand-in for the parts of azure.digitaltwins.core.DigitalTwinsClient
+    # that DigitalTwinSmartHome uses. `latency` adds a fixed delay per call
+    # to mimic the service round trip; `calls` counts calls per method.
+    # Twins are indexed by $dtId and model, relationships by source and
+    # target, so point lookups, model filters and JOINs avoid full scans.
+    def __init__(self, latency=0.0) -> None:
+        self.latency = latency
+        self.models = {}
+        self.twins = {}
+        self.twins_by_model = {}
+        self.relationships = {}
+        self.incoming = {}
+        self.calls = {}
+        self._lock = threading.RLock()
+
+    def _call(self, name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def list_models(self, **kwargs):
+        self._call('list_models')
+        with self._lock:
+            return [LocalModel(model) for model in self.models.values()]
+
+    def create_models(self, models):
+        self._call('create_models')
+        with self._lock:
+            for model in models:
+                if model['@id'] in self.models:
+                    raise LocalTwinsError(f"Model {model['@id']} already exists", 409)
+            for model in models:
+                self.models[model['@id']] = copy.deepcopy(model)
+        return [LocalModel(model) for model in models]
+
+    def delete_model(self, model_id):
+        self._call('delete_model')
+        with self._lock:
+            if self.models.pop(model_id, None) is None:
+                raise LocalTwinsError(f"Model {model_id} not found", 404)
+
+    def upsert_digital_twin(self, digital_twin_id, digital_twin):
+        self._call('upsert_digital_twin')
+        with self._lock:
+            model_id = digital_twin.get('$metadata', {}).get('$model')
+            if model_id not in self.models:
+                raise LocalTwinsError(f"Model {model_id} not found", 400)
+            twin = copy.deepcopy(digital_twin)
+            twin['$dtId'] = digital_twin_id
+            previous = self.twins.get(digital_twin_id)
+            if previous is not None:
+                self.twins_by_model[previous['$metadata']['$model']].discard(digital_twin_id)
+            self.twins[digital_twin_id] = twin
+            self.twins_by_model.setdefault(model_id, set()).add(digital_twin_id)
+            return copy.deepcopy(twin)
+
+    def get_digital_twin(self, digital_twin_id):
+        self._call('get_digital_twin')
+        with self._lock:
+            if digital_twin_id not in self.twins:
+                raise LocalTwinsError(f"Twin {digital_twin_id} not found", 404)
+            return copy.deepcopy(self.twins[digital_twin_id])
+
+    def update_digital_twin(self, digital_twin_id, json_patch):
+        self._call('update_digital_twin')
+        with self._lock:
+            if digital_twin_id not in self.twins:
+                raise LocalTwinsError(f"Twin {digital_twin_id} not found", 404)
+            apply_patch(self.twins[digital_twin_id], json_patch)
+
+    def delete_digital_twin(self, digital_twin_id):
+        self._call('delete_digital_twin')
+        with self._lock:
+            if digital_twin_id not in self.twins:
+                raise LocalTwinsError(f"Twin {digital_twin_id} not found", 404)
+            if self.relationships.get(digital_twin_id):
+                raise LocalTwinsError(f"Twin {digital_twin_id} still has relationships", 400)
+            if self.incoming.get(digital_twin_id):
+                raise LocalTwinsError(f"Twin {digital_twin_id} still has incoming relationships", 400)
+            twin = self.twins.pop(digital_twin_id)
+            self.twins_by_model[twin['$metadata']['$model']].discard(digital_twin_id)
+            self.relationships.pop(digital_twin_id, None)
+            self.incoming.pop(digital_twin_id, None)
+
+    def query_twins(self, query_expression):
+        self._call('query_twins')
+        with self._lock:
+            try:
+                return copy.deepcopy(run_query(query_expression, self))
+            except QueryError as e:
+                raise LocalTwinsError(f"Invalid query {query_expression!r}: {e}", 400)
+
+    # Query engine hooks (see twinquery.run_query)
+    def model_ancestors(self, model_id):
+        ancestors = set()
+        pending = [model_id]
+        while pending:
+            extends = self.models.get(pending.pop(), {}).get('extends', [])
+            for parent in [extends] if isinstance(extends, str) else extends:
+                parent = parent if isinstance(parent, str) else parent.get('@id')
+                if parent and parent not in ancestors:
+                    ancestors.add(parent)
+                    pending.append(parent)
+        return ancestors
+
+    def is_of_model(self, twin, model_id, exact=False):
+        if not isinstance(twin, dict) or '$metadata' not in twin:
+            return False
+        twin_model = twin['$metadata'].get('$model')
+        return twin_model == model_id or (not exact and model_id in self.model_ancestors(twin_model))
+
+    def candidates(self, collection, alias, hints):
+        # Narrow the scan with the first index the WHERE clause allows
+        hints = [(key, value) for hint_alias, key, value in hints if hint_alias == alias]
+        if collection == 'RELATIONSHIPS':
+            for key, value in hints:
+                if key == '$sourceId':
+                    return list(self.relationships.get(value, {}).values())
+                if key == '$targetId':
+                    return [self.relationships[source][relationship_id]
+                            for source, relationship_id in self.incoming.get(value, ())]
+            return [relationship for relationships in self.relationships.values() for relationship in relationships.values()]
+        for key, value in hints:
+            if key == '$dtId':
+                return [self.twins[value]] if value in self.twins else []
+            if key == 'model':
+                model_id, exact = value
+                models = [model_id] if exact else [
+                    candidate for candidate in self.twins_by_model
+                    if candidate == model_id or model_id in self.model_ancestors(candidate)
+                ]
+                return [self.twins[twin_id] for candidate in models for twin_id in self.twins_by_model.get(candidate, ())]
+        return list(self.twins.values())
+
+    def related(self, twin, relationship_name):
+        if not isinstance(twin, dict):
+            return []
+        return [
+            (relationship, self.twins[relationship['$targetId']])
+            for relationship in self.relationships.get(twin['$dtId'], {}).values()
+            if relationship.get('$relationshipName') == relationship_name and relationship['$targetId'] in self.twins
+        ]
+
+    def upsert_relationship(self, digital_twin_id, relationship_id, relationship):
+        self._call('upsert_relationship')
+        with self._lock:
+            if digital_twin_id not in self.twins:
+                raise LocalTwinsError(f"Twin {digital_twin_id} not found", 404)
+            if relationship.get('$targetId') not in self.twins:
+                raise LocalTwinsError(f"Twin {relationship.get('$targetId')} not found", 400)
+            stored = copy.deepcopy(relationship)
+            stored['$sourceId'] = digital_twin_id
+            stored['$relationshipId'] = relationship_id
+            previous = self.relationships.get(digital_twin_id, {}).get(relationship_id)
+            if previous is not None:
+                self.incoming[previous['$targetId']].discard((digital_twin_id, relationship_id))
+            self.relationships.setdefault(digital_twin_id, {})[relationship_id] = stored
+            self.incoming.setdefault(stored['$targetId'], set()).add((digital_twin_id, relationship_id))
+            return copy.deepcopy(stored)
+
+    def list_relationships(self, digital_twin_id, relationship_id=None):
+        self._call('list_relationships')
+        with self._lock:
+            relationships = self.relationships.get(digital_twin_id, {}).values()
+            # The SDK's relationship_id argument filters by relationship name
+            return [
+                copy.deepcopy(relationship) for relationship in relationships
+                if relationship_id is None or relationship.get('$relationshipName') == relationship_id
+            ]
+
+    def delete_relationship(self, digital_twin_id, relationship_id):
+        self._call('delete_relationship')
+        with self._lock:
+            relationship = self.relationships.get(digital_twin_id, {}).pop(relationship_id, None)
+            if relationship is None:
+                raise LocalTwinsError(f"Relationship {relationship_id} not found", 404)
+            self.incoming[relationship['$targetId']].discard((digital_twin_id, relationship_id))
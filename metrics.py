@@ -0,0 +1,252 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Latency buckets in seconds, from a fast in-memory call to a slow refit
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels) + '}'
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    # Process-wide counters and latency histograms, keyed by metric name and
+    # a sorted tuple of label pairs, rendered in the Prometheus text format
+    def __init__(self, prefix='smarthome_') -> None:
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        self.help = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name, **labels):
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        # Picklable copy of every series, for shipping across processes
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': {key: (h.buckets, list(h.counts), h.sum, h.count) for key, h in self.histograms.items()},
+            }
+
+    def absorb(self, snapshot, **labels):
+        # Add another registry's snapshot, with extra labels on every series
+        extra = tuple(sorted(labels.items()))
+        with self._lock:
+            for (name, series), value in snapshot['counters'].items():
+                key = (name, tuple(sorted(series + extra)))
+                self.counters[key] = self.counters.get(key, 0) + value
+            for (name, series), (buckets, counts, total, count) in snapshot['histograms'].items():
+                key = (name, tuple(sorted(series + extra)))
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(buckets)
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.sum += total
+                histogram.count += count
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+            histograms = [(key, list(h.buckets), list(h.counts), h.sum, h.count) for key, h in histograms]
+        lines = []
+        seen = set()
+        for (name, labels), value in counters:
+            metric = f"{self.prefix}{name}"
+            if metric not in seen:
+                seen.add(metric)
+                if name in self.help:
+                    lines.append(f"# HELP {metric} {self.help[name]}")
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{label_text(labels)} {value}")
+        for (name, labels), buckets, counts, total, count in histograms:
+            metric = f"{self.prefix}{name}"
+            if metric not in seen:
+                seen.add(metric)
+                if name in self.help:
+                    lines.append(f"# HELP {metric} {self.help[name]}")
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{metric}_bucket{label_text(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{metric}_bucket{label_text(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{metric}_sum{label_text(labels)} {total}")
+            lines.append(f"{metric}_count{label_text(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+metrics.describe('stage_seconds', "Time spent per simulator stage")
+metrics.describe('adt_call_seconds', "Latency of Digital Twins API calls")
+metrics.describe('adt_calls_total', "Digital Twins API calls by method and outcome")
+metrics.describe('adt_retries_total', "Throttled Digital Twins API calls that were retried")
+metrics.describe('callback_seconds', "Dashboard callback latency")
+metrics.describe('bytes_total', "Bytes written to the sink and sent to the twin service")
+metrics.describe('property_updates_total', "Device property values generated by the simulator")
+metrics.describe('property_values_persisted_total', "Device property values written to the telemetry sink")
+metrics.describe('shard_failures_total', "Sharded simulation workers that exited with an error")
+metrics.describe('figure_cache_total', "Dashboard figure cache lookups by result")
+metrics.describe('anomalies_total', "Phantom load and outlier events flagged by the anomaly detector")
+
+
+class InstrumentedClient:
+    # Wraps a DigitalTwinsClient (or the in-memory one) so every call is
+    # timed and counted per method; other attributes pass straight through
+    def __init__(self, client) -> None:
+        object.__setattr__(self, 'client', client)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute) or name.startswith('_'):
+            return attribute
+
+        @functools.wraps(attribute)
+        def call(*args, **kwargs):
+            outcome = 'ok'
+            started = time.perf_counter()
+            try:
+                result = attribute(*args, **kwargs)
+                # Listing/query calls page lazily; time the whole read
+                if name.startswith(('list_', 'query_')):
+                    result = list(result)
+                return result
+            except Exception as e:
+                outcome = str(getattr(e, 'status_code', None) or type(e).__name__)
+                raise
+            finally:
+                metrics.observe('adt_call_seconds', time.perf_counter() - started, method=name)
+                metrics.inc('adt_calls_total', method=name, outcome=outcome)
+        return call
+
+    def __setattr__(self, name, value):
+        setattr(self.client, name, value)
+
+
+def register_metrics_route(server, path='/metrics'):
+    # Prometheus scrape endpoint on a Flask server
+    from flask import Response
+
+    def metrics_endpoint():
+        return Response(metrics.render(), mimetype=CONTENT_TYPE)
+    server.add_url_rule(path, 'metrics', metrics_endpoint)
+    return server
+
+
+def serve_metrics(port, host='0.0.0.0', registry=None):
+    # Standalone scrape endpoint for processes without a Flask server (the
+    # simulator), served from a daemon thread
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = (registry or metrics).render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=httpd.serve_forever, name='metrics-server', daemon=True).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return httpd
+
+
+class TickProfiler:
+    # Captures one simulator tick under cProfile on demand: call arm(), send
+    # SIGUSR1 (see install_signal) or start with --profile-tick. The stats go
+    # to profile-tick-<time>.prof and the top entries are printed.
+    def __init__(self, output_dir='.', top=25) -> None:
+        self.output_dir = output_dir
+        self.top = top
+        self.armed = threading.Event()
+
+    def arm(self, *args):
+        self.armed.set()
+
+    def install_signal(self):
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self.arm)
+
+    def capture(self, fn, *args):
+        self.armed.clear()
+        profile = cProfile.Profile()
+        result = profile.runcall(fn, *args)
+        path = os.path.join(self.output_dir, f"profile-tick-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+        profile.dump_stats(path)
+        output = io.StringIO()
+        pstats.Stats(profile, stream=output).sort_stats('cumulative').print_stats(self.top)
+        print(f"Profiled one tick, stats written to {path}")
+        print(output.getvalue())
+        return result
@@ -0,0 +1,183 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from metrics import metrics
+
+
+# Status codes Azure Digital Twins uses for throttling / transient overload
+RETRY_STATUS = {429, 503}
+
+
+def retry_after(error):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class PhaseReport:
+    def __init__(self, name) -> None:
+        self.name = name
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+        self.elapsed = 0.0
+        self.errors = []
+
+    def __str__(self):
+        rate = self.succeeded / self.elapsed if self.elapsed else 0.0
+        return (f"{self.name}: {self.succeeded} ok, {self.failed} failed, "
+                f"{self.retries} retries in {self.elapsed:.2f}s ({rate:.1f}/s)")
+
+
+class ProvisioningEngine:
+    # Fans DigitalTwinsClient calls out over a bounded thread pool. Phases run
+    # one after another so dependencies hold (twins before relationships,
+    # relationships before twin deletes); calls inside a phase are concurrent.
+    def __init__(self, client, max_workers=16, max_retries=5, base_delay=0.5, max_delay=30.0) -> None:
+        self.client = client
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Reports of the phases since the last print_summary, newest kept
+        self.reports = deque(maxlen=256)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def call(self, report, fn, *args):
+        attempt = 0
+        while True:
+            try:
+                return fn(*args)
+            except Exception as e:
+                status = getattr(e, 'status_code', None)
+                if status not in RETRY_STATUS or attempt >= self.max_retries:
+                    raise
+                delay = retry_after(e)
+                if delay is None:
+                    # Exponential backoff with full jitter
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                attempt += 1
+                metrics.inc('adt_retries_total', method=getattr(fn, '__name__', 'call'))
+                with self._lock:
+                    report.retries += 1
+                time.sleep(delay)
+
+    def executor(self):
+        # One long-lived pool, so per-tick uploads do not start new threads
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='adt')
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def _run(self, report, calls):
+        # calls: iterable of (label, fn, args). Only a bounded number of calls
+        # is in flight, so very large fleets can be streamed through.
+        executor = self.executor()
+        results = []
+        started = time.monotonic()
+        in_flight = set()
+        pending_labels = {}
+
+        def collect(done):
+            for future in done:
+                label = pending_labels.pop(future)
+                try:
+                    results.append((label, future.result()))
+                    report.succeeded += 1
+                except Exception as e:
+                    report.failed += 1
+                    if len(report.errors) < 20:
+                        report.errors.append((label, str(e)))
+
+        for label, fn, args in calls:
+            if len(in_flight) >= self.max_workers * 4:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            future = executor.submit(self.call, report, fn, *args)
+            pending_labels[future] = label
+            in_flight.add(future)
+        done, _ = wait(in_flight)
+        collect(done)
+        report.elapsed = time.monotonic() - started
+        return results
+
+    def print_report(self, report):
+        print(report)
+        for label, error in report.errors:
+            print(f"  {label}: {error}")
+
+    def run_phase(self, name, calls):
+        # Provisioning phase: reported now and kept for print_summary
+        report = PhaseReport(name)
+        results = self._run(report, calls)
+        self.reports.append(report)
+        self.print_report(report)
+        return results
+
+    def run_batch(self, name, calls):
+        # Per-tick variant of run_phase: keeps no report and only prints
+        # when calls failed; call counts and latency go to /metrics
+        report = PhaseReport(name)
+        results = self._run(report, calls)
+        if report.failed:
+            self.print_report(report)
+        return results
+
+    def create_twins(self, twins):
+        # twins: iterable of (digital_twin_id, twin document)
+        return self.run_phase('create twins', (
+            (digital_twin_id, self.client.upsert_digital_twin, (digital_twin_id, twin))
+            for digital_twin_id, twin in twins
+        ))
+
+    def create_relationships(self, relationships):
+        return self.run_phase('create relationships', (
+            (relationship["$relationshipId"], self.client.upsert_relationship,
+             (relationship["$sourceId"], relationship["$relationshipId"], relationship))
+            for relationship in relationships
+        ))
+
+    def list_relationships(self, digital_twin_ids):
+        # Returns (source id, relationship id) for every outgoing relationship
+        def list_relationships(twin_id):
+            return list(self.client.list_relationships(twin_id))
+        results = self.run_phase('list relationships', (
+            (digital_twin_id, list_relationships, (digital_twin_id,))
+            for digital_twin_id in digital_twin_ids
+        ))
+        return [
+            (digital_twin_id, relationship['$relationshipId'])
+            for digital_twin_id, relationships in results
+            for relationship in relationships
+        ]
+
+    def delete_relationships(self, relationships):
+        # relationships: iterable of (source id, relationship id)
+        return self.run_phase('delete relationships', (
+            (relationship_id, self.client.delete_relationship, (digital_twin_id, relationship_id))
+            for digital_twin_id, relationship_id in relationships
+        ))
+
+    def delete_twins(self, digital_twin_ids):
+        return self.run_phase('delete twins', (
+            (digital_twin_id, self.client.delete_digital_twin, (digital_twin_id,))
+            for digital_twin_id in digital_twin_ids
+        ))
+
+    def print_summary(self):
+        print("Provisioning summary:")
+        for report in self.reports:
+            print(f"  {report}")
+        self.reports.clear()
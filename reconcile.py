@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import fleet
+from telemetryschema import load_models
+
+
+def fingerprint(document):
+    return hashlib.sha256(json.dumps(document, sort_keys=True, separators=(',', ':'), default=str).encode()).hexdigest()
+
+
+def twin_fingerprint(model_id):
+    # A twin is only (re)created for its identity and model; property values
+    # are telemetry and go through the upload path
+    return fingerprint({'$model': model_id})
+
+
+def relationship_fingerprint(relationship):
+    return fingerprint({key: relationship.get(key) for key in ('$targetId', '$relationshipName')})
+
+
+class ProvisionState:
+    # Fingerprints of what is (or should be) provisioned:
+    #   models: model id -> fingerprint
+    #   twins: twin id -> fingerprint
+    #   relationships: source id -> relationship id -> fingerprint
+    def __init__(self, models=None, twins=None, relationships=None) -> None:
+        self.models = models or {}
+        self.twins = twins or {}
+        self.relationships = relationships or {}
+
+    def relationship_keys(self):
+        return {(source, relationship_id) for source, relationships in self.relationships.items() for relationship_id in relationships}
+
+    def relationship(self, key):
+        return self.relationships.get(key[0], {}).get(key[1])
+
+    def set_relationship(self, key, value):
+        if value is None:
+            self.relationships.get(key[0], {}).pop(key[1], None)
+            if not self.relationships.get(key[0], True):
+                del self.relationships[key[0]]
+        else:
+            self.relationships.setdefault(key[0], {})[key[1]] = value
+
+    @classmethod
+    def load(cls, path):
+        if not path or not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            data = json.load(f)
+        return cls(data.get('models'), data.get('twins'), data.get('relationships'))
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'models': self.models, 'twins': self.twins, 'relationships': self.relationships}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+
+class ReconcilePlan:
+    def __init__(self) -> None:
+        self.create_models = []
+        self.delete_models = []
+        self.upsert_twins = []
+        self.delete_twins = []
+        self.upsert_relationships = []
+        self.delete_relationships = []
+
+    def empty(self):
+        return not any(vars(self).values())
+
+    def __str__(self):
+        return ", ".join(f"{name.replace('_', ' ')}: {len(items)}" for name, items in vars(self).items())
+
+
+class Reconciler:
+    # Diffs the DTDL models and the scenario sheet against the provisioned
+    # state and applies only the difference, in dependency order:
+    # models, twins, relationships, then deletes in reverse.
+    def __init__(self, home, state_path=None) -> None:
+        self.home = home
+        self.state_path = state_path
+
+    def desired(self, df):
+        models = {model['@id']: model for model in load_models(self.home.model_path)}
+        twins = dict(zip(df[fleet.ID_COLUMN], df['ModelID']))
+        relationships = {
+            (relationship['$sourceId'], relationship['$relationshipId']): relationship
+            for relationship in fleet.relationships_from(df)
+        }
+        return models, twins, relationships
+
+    def desired_state(self, models, twins, relationships):
+        state = ProvisionState(
+            {model_id: fingerprint(model) for model_id, model in models.items()},
+            {twin_id: twin_fingerprint(model_id) for twin_id, model_id in twins.items()})
+        for key, relationship in relationships.items():
+            state.set_relationship(key, relationship_fingerprint(relationship))
+        return state
+
+    def remote_state(self):
+        # Three reads: the model list and the topology cache's two queries
+        client = self.home.dt_client
+        state = ProvisionState()
+        try:
+            models = client.list_models(include_model_definition=True)
+        except TypeError:
+            models = client.list_models()
+        for model in models:
+            definition = getattr(model, 'model', None)
+            state.models[model.id] = fingerprint(definition) if definition else None
+        topology = self.home.topology
+        topology.invalidate()
+        topology.ensure()
+        state.twins = {twin_id: twin_fingerprint(model_id) for twin_id, model_id in topology.twins.items()}
+        for source, relationships in topology.outgoing.items():
+            for relationship_id, relationship in relationships.items():
+                state.set_relationship((source, relationship_id), relationship_fingerprint(relationship))
+        return state
+
+    def plan(self, current, target):
+        plan = ReconcilePlan()
+        for model_id, value in target.models.items():
+            if current.models.get(model_id) != value:
+                if model_id in current.models:
+                    # Models are immutable once uploaded: replace them
+                    plan.delete_models.append(model_id)
+                plan.create_models.append(model_id)
+        plan.delete_models.extend(model_id for model_id in current.models if model_id not in target.models)
+        for twin_id, value in target.twins.items():
+            if current.twins.get(twin_id) != value:
+                plan.upsert_twins.append(twin_id)
+        plan.delete_twins = [twin_id for twin_id in current.twins if twin_id not in target.twins]
+        for key in target.relationship_keys():
+            if current.relationship(key) != target.relationship(key):
+                plan.upsert_relationships.append(key)
+        deleted = set(plan.delete_twins)
+        plan.delete_relationships = [
+            key for key in current.relationship_keys()
+            if target.relationship(key) is None or key[0] in deleted
+        ]
+        return plan
+
+    def incoming(self, twin_ids):
+        # Relationships from twins we do not manage into twins we delete
+        topology = self.home.topology
+        return {
+            (relationship['$sourceId'], relationship['$relationshipId'])
+            for twin_id in twin_ids
+            for relationship in topology.relationships_to(twin_id)
+        }
+
+    def run(self, dry_run=False, use_state_file=False):
+        home = self.home
+        df = home.load_excel()
+        models, twins, relationships = self.desired(df)
+        target = self.desired_state(models, twins, relationships)
+        current = ProvisionState.load(self.state_path) if use_state_file else None
+        source = 'state file'
+        if current is None:
+            current = self.remote_state()
+            source = 'remote'
+        plan = self.plan(current, target)
+        if plan.delete_twins and source == 'remote':
+            plan.delete_relationships = sorted(set(plan.delete_relationships) | self.incoming(plan.delete_twins))
+        print(f"Reconcile against {source} state: {plan}")
+        if dry_run or plan.empty():
+            if plan.empty() and self.state_path:
+                target.save(self.state_path)
+            return plan
+        self.apply(plan, current, models, twins, relationships)
+        if self.state_path:
+            current.save(self.state_path)
+        home.topology.invalidate()
+        home.provisioner.print_summary()
+        return plan
+
+    def phase(self, name, calls):
+        calls = list(calls)
+        return self.home.provisioner.run_phase(name, calls) if calls else []
+
+    def apply(self, plan, current, models, twins, relationships):
+        # `current` is updated as operations succeed, so a partial run leaves
+        # an accurate state file behind
+        home = self.home
+        client = home.dt_client
+        replaced = [model_id for model_id in plan.delete_models if model_id in plan.create_models]
+        for model_id, _ in self.phase('replace models', (
+                (model_id, client.delete_model, (model_id,)) for model_id in replaced)):
+            current.models.pop(model_id, None)
+        if plan.create_models:
+            try:
+                client.create_models([models[model_id] for model_id in plan.create_models])
+                for model_id in plan.create_models:
+                    current.models[model_id] = fingerprint(models[model_id])
+            except Exception as e:
+                print("Error uploading models:", e)
+        for twin_id, _ in self.phase('upsert twins', (
+                (twin_id, client.upsert_digital_twin, (twin_id, {"$metadata": {"$model": twins[twin_id]}, "$dtId": twin_id}))
+                for twin_id in plan.upsert_twins)):
+            current.twins[twin_id] = twin_fingerprint(twins[twin_id])
+        for key, _ in self.phase('delete relationships', (
+                (key, client.delete_relationship, key) for key in plan.delete_relationships)):
+            current.set_relationship(key, None)
+        for key, _ in self.phase('upsert relationships', (
+                (key, client.upsert_relationship, (key[0], key[1], relationships[key]))
+                for key in plan.upsert_relationships)):
+            current.set_relationship(key, relationship_fingerprint(relationships[key]))
+        for twin_id, _ in self.phase('delete twins', (
+                (twin_id, client.delete_digital_twin, (twin_id,)) for twin_id in plan.delete_twins)):
+            current.twins.pop(twin_id, None)
+        for model_id, _ in self.phase('delete models', (
+                (model_id, client.delete_model, (model_id,))
+                for model_id in plan.delete_models if model_id not in replaced)):
+            current.models.pop(model_id, None)
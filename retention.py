@@ -0,0 +1,141 @@
+import os
+import threading
+from datetime import datetime, timedelta
+import pandas as pd
+from metrics import metrics
+from rollups import RESOLUTIONS, rollup_frame
+
+
+ROLLUP_DIR = 'rollups'
+
+
+class RetentionPolicy:
+    # How long each tier is kept; None keeps it forever
+    def __init__(self, raw=timedelta(days=7), rollups=None) -> None:
+        self.raw = raw
+        self.rollups = rollups if rollups is not None else {
+            '1min': timedelta(days=90),
+            '1h': timedelta(days=365),
+            '1d': None,
+        }
+
+
+def rollup_path(root, resolution, day):
+    return os.path.join(root, ROLLUP_DIR, resolution, f"date={day}.parquet")
+
+
+def rollup_days(root, resolution):
+    directory = os.path.join(root, ROLLUP_DIR, resolution)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name[len('date='):-len('.parquet')] for name in os.listdir(directory)
+                  if name.startswith('date=') and name.endswith('.parquet'))
+
+
+def read_rollups(root, resolution, start=None, end=None):
+    first_day = pd.Timestamp(start).strftime('%Y-%m-%d') if start is not None else None
+    last_day = pd.Timestamp(end).strftime('%Y-%m-%d') if end is not None else None
+    frames = []
+    for day in rollup_days(root, resolution):
+        if (first_day is not None and day < first_day) or (last_day is not None and day > last_day):
+            continue
+        try:
+            frames.append(pd.read_parquet(rollup_path(root, resolution, day)))
+        except FileNotFoundError:
+            continue
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+def load_rollups(root, retention, before):
+    # Persisted rollups for the span each in-memory resolution keeps
+    tables = {}
+    for resolution, width in RESOLUTIONS.items():
+        keep = retention.get(resolution)
+        start = pd.Timestamp(before) - keep * width if keep is not None else None
+        tables[resolution] = read_rollups(root, resolution, start, before)
+    return tables
+
+
+class Compactor:
+    # Background maintenance of a ParquetTelemetrySink:
+    #  - merges per-tick segments older than `min_age` into one sorted file
+    #    per partition and run,
+    #  - writes 1min/1h/1d rollups for every closed day,
+    #  - drops raw partitions past the policy once their rollups exist,
+    #  - expires rollup files per resolution.
+    def __init__(self, sink, policy=None, interval=300.0, min_age=timedelta(minutes=10)) -> None:
+        self.sink = sink
+        self.policy = policy or RetentionPolicy()
+        self.interval = interval
+        self.min_age = min_age
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='telemetry-compactor', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print("Error compacting telemetry:", e)
+            self._stop.wait(self.interval)
+
+    def persist_rollups(self, day):
+        df = self.sink.read_segments(self.sink.segments(day))
+        for resolution in RESOLUTIONS:
+            path = rollup_path(self.sink.root, resolution, day)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+            rollup_frame(df, resolution).to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, path)
+
+    def has_rollups(self, day):
+        return all(os.path.exists(rollup_path(self.sink.root, resolution, day)) for resolution in RESOLUTIONS)
+
+    def run_once(self, now=None):
+        now = now or datetime.now()
+        today = now.strftime('%Y-%m-%d')
+        # Segment numbers are time_ns, so this selects segments by age
+        max_sequence = int((now - self.min_age).timestamp() * 1e9)
+        raw_cutoff = (now - self.policy.raw).strftime('%Y-%m-%d') if self.policy.raw is not None else None
+        compacted = persisted = dropped = expired = 0
+        with metrics.timer('stage_seconds', stage='compact'):
+            for day in self.sink.partitions():
+                self.sink.sweep(day)
+                result = self.sink.compact(day, None if day < today else max_sequence)
+                if result is not None:
+                    compacted += result[1]
+                if day < today and not self.has_rollups(day):
+                    self.persist_rollups(day)
+                    persisted += 1
+                if raw_cutoff is not None and day < raw_cutoff and self.has_rollups(day):
+                    dropped += self.sink.drop_partition(day)
+            for resolution, keep in self.policy.rollups.items():
+                if keep is None:
+                    continue
+                cutoff = (now - keep).strftime('%Y-%m-%d')
+                for day in rollup_days(self.sink.root, resolution):
+                    if day < cutoff:
+                        os.remove(rollup_path(self.sink.root, resolution, day))
+                        expired += 1
+        metrics.inc('compacted_segments_total', compacted)
+        metrics.inc('dropped_partitions_total', dropped)
+        if compacted or persisted or dropped or expired:
+            print(f"Compaction: {compacted} segments merged, {persisted} days rolled up, "
+                  f"{dropped} raw partitions and {expired} rollup files expired")
+        return compacted, persisted, dropped, expired
+
+
+def compactor_for(sink, **kwargs):
+    # Only the Parquet sink has segments to compact
+    return Compactor(sink, **kwargs) if hasattr(sink, 'compact') else None
@@ -0,0 +1,200 @@
+import threading
+import numpy as np
+import pandas as pd
+from telemetrysink import row_timestamps
+
+
+# Rollup resolutions, finest first, and how many buckets of each are kept
+RESOLUTIONS = {
+    '1min': pd.Timedelta(minutes=1),
+    '1h': pd.Timedelta(hours=1),
+    '1d': pd.Timedelta(days=1),
+}
+DEFAULT_RETENTION = {
+    '1min': 7 * 24 * 60,
+    '1h': 90 * 24,
+    '1d': None,
+}
+ROLLUP_PROPERTIES = ['powerConsumed', 'temperature', 'humidity', 'brightness', 'lighting', 'onOff']
+KEYS = ['ModelID', 'ID (must be unique)', 'Property']
+STATS = ['min', 'max', 'sum', 'count']
+# Default number of points a single chart is allowed to ship
+CHART_POINT_BUDGET = 2000
+
+
+def rollup_frame(df, resolution, properties=ROLLUP_PROPERTIES):
+    # min/max/sum/count per (bucket, model, device, property) for one batch
+    properties = [name for name in properties if name in df.columns]
+    if df.empty or not properties:
+        return pd.DataFrame(columns=['Bucket'] + KEYS + STATS)
+    values = df[properties].astype('float64')
+    values['Bucket'] = row_timestamps(df).dt.floor(RESOLUTIONS[resolution])
+    values['ModelID'] = df['ModelID']
+    values['ID (must be unique)'] = df['ID (must be unique)']
+    long = values.melt(id_vars=['Bucket', 'ModelID', 'ID (must be unique)'], var_name='Property', value_name='value')
+    long = long.dropna(subset=['value'])
+    grouped = long.groupby(['Bucket'] + KEYS, sort=False)['value'].agg(STATS)
+    return grouped.reset_index()
+
+
+def merge_stats(left, right):
+    # Combine two rollup tables over the same keys
+    combined = pd.concat([left, right], ignore_index=True)
+    return combined.groupby(KEYS, sort=False).agg(
+        min=('min', 'min'), max=('max', 'max'), sum=('sum', 'sum'), count=('count', 'sum')).reset_index()
+
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets downsampling; keeps the first and last
+    # point and, per bucket, the point spanning the largest triangle
+    x = np.asarray(x)
+    y = np.asarray(y, dtype='float64')
+    size = len(x)
+    if threshold >= size or threshold < 3:
+        return np.arange(size)
+    xs = x.astype('datetime64[ns]').astype('int64').astype('float64') if np.issubdtype(x.dtype, np.datetime64) else x.astype('float64')
+    selected = np.empty(threshold, dtype='int64')
+    selected[0] = 0
+    selected[-1] = size - 1
+    edges = np.linspace(1, size - 1, threshold - 1).astype('int64')
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        next_start, next_end = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else size
+        next_end = max(next_end, next_start + 1)
+        average_x = xs[next_start:next_end].mean()
+        average_y = y[next_start:next_end].mean()
+        areas = np.abs(
+            (xs[previous] - average_x) * (y[start:end] - y[previous])
+            - (xs[previous] - xs[start:end]) * (average_y - y[previous])
+        )
+        previous = start + int(np.nanargmax(areas)) if not np.all(np.isnan(areas)) else start
+        selected[i + 1] = previous
+    return selected
+
+
+class RollupStore:
+    # 1-minute, 1-hour and 1-day pre-aggregated tables, kept per bucket so an
+    # update only touches the buckets the new rows fall into
+    def __init__(self, retention=DEFAULT_RETENTION, properties=ROLLUP_PROPERTIES) -> None:
+        self.retention = dict(retention)
+        self.properties = list(properties)
+        self.buckets = {resolution: {} for resolution in RESOLUTIONS}
+        self._lock = threading.Lock()
+
+    def update(self, new_rows):
+        if new_rows is None or new_rows.empty:
+            return
+        for resolution in RESOLUTIONS:
+            partial = rollup_frame(new_rows, resolution, self.properties)
+            with self._lock:
+                buckets = self.buckets[resolution]
+                for bucket, table in partial.groupby('Bucket', sort=True):
+                    table = table.drop(columns=['Bucket'])
+                    buckets[bucket] = merge_stats(buckets[bucket], table) if bucket in buckets else table.reset_index(drop=True)
+                self._trim(resolution)
+
+    def _trim(self, resolution):
+        buckets = self.buckets[resolution]
+        keep = self.retention.get(resolution)
+        if keep is not None and len(buckets) > keep:
+            for bucket in sorted(buckets)[:len(buckets) - keep]:
+                del buckets[bucket]
+
+    def load(self, tables, before):
+        # Seed with persisted rollups (see retention.py) for the history the
+        # raw telemetry no longer covers. Only buckets that end before
+        # `before` are taken, so nothing is counted twice with the raw rows.
+        for resolution, table in tables.items():
+            if table.empty:
+                continue
+            limit = pd.Timestamp(before).floor(RESOLUTIONS[resolution])
+            with self._lock:
+                buckets = self.buckets[resolution]
+                for bucket, part in table[table['Bucket'] < limit].groupby('Bucket', sort=True):
+                    if bucket not in buckets:
+                        buckets[bucket] = part.drop(columns=['Bucket']).reset_index(drop=True)
+                self._trim(resolution)
+
+    def on_telemetry(self, new_rows, evicted_rows):
+        # TelemetryCache listener; rollups outlive the raw window
+        self.update(new_rows)
+
+    def table(self, resolution, start=None, end=None):
+        with self._lock:
+            selected = [
+                table.assign(Bucket=bucket) for bucket, table in sorted(self.buckets[resolution].items())
+                if (start is None or bucket >= pd.Timestamp(start).floor(RESOLUTIONS[resolution]))
+                and (end is None or bucket < pd.Timestamp(end))
+            ]
+        if not selected:
+            return pd.DataFrame(columns=['Bucket'] + KEYS + STATS + ['mean'])
+        table = pd.concat(selected, ignore_index=True)
+        table['mean'] = table['sum'] / table['count']
+        return table
+
+    def resolution_for(self, start, end, groups, budget):
+        # Finest resolution that fits the point budget for the window
+        span = pd.Timestamp(end) - pd.Timestamp(start)
+        for resolution, width in RESOLUTIONS.items():
+            if (span / width) * groups <= budget:
+                return resolution
+        return list(RESOLUTIONS)[-1]
+
+    def chart_frame(self, frame, name, group='ModelID', start=None, end=None, budget=CHART_POINT_BUDGET):
+        # Long frame of (Timestamp, group, name) for one chart, capped at
+        # about `budget` points: raw rows when the requested window lies in
+        # `frame` and they fit, otherwise the right rollup resolution (which
+        # also covers the loaded history before the raw window), and LTTB
+        # per group for whatever is left over
+        if frame.empty and start is None:
+            return pd.DataFrame(columns=['Timestamp', group, name])
+        timestamps = row_timestamps(frame) if not frame.empty else pd.Series(dtype='datetime64[ns]')
+        first = timestamps.iloc[0] if len(timestamps) else pd.Timestamp.now()
+        start = pd.Timestamp(start) if start is not None else first
+        if end is None:
+            end = timestamps.iloc[-1] + pd.Timedelta(seconds=1) if len(timestamps) else pd.Timestamp.now()
+        end = pd.Timestamp(end)
+        in_window = (timestamps >= start) & (timestamps < end)
+        groups = max(1, frame.loc[in_window, group].nunique() if len(timestamps) else 0)
+        if start >= first and in_window.sum() <= budget:
+            points = pd.DataFrame({'Timestamp': timestamps[in_window], group: frame.loc[in_window, group],
+                                   name: frame.loc[in_window, name].astype('float64')})
+        else:
+            table = self.table(self.resolution_for(start, end, groups, budget), start, end)
+            table = table[table['Property'] == name]
+            points = table.groupby(['Bucket', group], sort=True)[['sum', 'count']].sum().reset_index()
+            points[name] = points['sum'] / points['count']
+            points = points.rename(columns={'Bucket': 'Timestamp'})[['Timestamp', group, name]]
+        return downsample(points, group, name, budget)
+
+
+def downsample(points, group, name, budget):
+    groups = points[group].nunique()
+    if len(points) <= budget or groups == 0:
+        return points
+    per_group = max(3, budget // groups)
+    parts = []
+    for _, part in points.groupby(group, sort=False):
+        part = part.sort_values('Timestamp')
+        parts.append(part.iloc[lttb(part['Timestamp'].to_numpy(), part[name].to_numpy(), per_group)])
+    return pd.concat(parts, ignore_index=True)
+
+
+_rollups = {}
+_rollups_lock = threading.Lock()
+
+
+def get_rollups(telemetry):
+    # One rollup store per telemetry cache, shared by every page reading it
+    with _rollups_lock:
+        rollups = _rollups.get(telemetry)
+        if rollups is None:
+            rollups = _rollups[telemetry] = RollupStore()
+            root = getattr(telemetry.sink, 'root', None)
+            if root is not None and telemetry.window:
+                from retention import load_rollups
+                before = pd.Timestamp.now() - telemetry.window
+                rollups.load(load_rollups(root, rollups.retention, before), before)
+            telemetry.add_listener(rollups.on_telemetry)
+        return rollups
@@ -0,0 +1,146 @@
+import asyncio
+
+
+class TickStats:
+    # Lateness of each tick against its fixed-rate deadline
+    def __init__(self, name, period) -> None:
+        self.name = name
+        self.period = period
+        self.ticks = 0
+        self.missed = 0
+        self.jitter_total = 0.0
+        self.jitter_max = 0.0
+
+    def record(self, jitter):
+        self.ticks += 1
+        self.jitter_total += jitter
+        self.jitter_max = max(self.jitter_max, jitter)
+
+    def __str__(self):
+        mean = self.jitter_total / self.ticks if self.ticks else 0.0
+        return (f"{self.name} every {self.period}s: {self.ticks} ticks, {self.missed} missed deadlines, "
+                f"jitter mean {mean * 1000:.1f}ms max {self.jitter_max * 1000:.1f}ms")
+
+
+class SimulationScheduler:
+    # Fixed-rate asyncio driver for DigitalTwinSmartHome. Devices are grouped
+    # by cadence; each group generates on its own monotonic schedule, and the
+    # persist and upload stages run behind bounded queues so a slow stage
+    # pushes back on generation instead of letting the backlog grow.
+    def __init__(self, home, period, cadences=None, queue_size=4, upload_mode='patch', profiler=None,
+                 save_state=True) -> None:
+        self.home = home
+        self.period = period
+        # cadences: device id or model id -> period in seconds
+        self.cadences = cadences or {}
+        self.queue_size = queue_size
+        # 'patch', 'upsert', or None to only generate and persist
+        self.upload_mode = upload_mode
+        # metrics.TickProfiler; an armed profiler captures the next tick
+        self.profiler = profiler
+        # Write the scenario state back to the workbook when the run ends
+        self.save_state = save_state
+        self.stats = {}
+
+    def device_groups(self):
+        if self.home.state is None:
+            self.home.state = self.home.load_excel()
+        groups = {}
+        for row in self.home.state.to_dict('records'):
+            device_id = row['ID (must be unique)']
+            period = self.cadences.get(device_id, self.cadences.get(row['ModelID'], self.period))
+            groups.setdefault(period, []).append(device_id)
+        return groups
+
+    async def _generate(self, period, device_ids, queue, max_ticks, duration):
+        loop = asyncio.get_running_loop()
+        stats = self.stats[period] = TickStats(f"{len(device_ids)} devices", period)
+        start = loop.time()
+        tick = 0
+        while max_ticks is None or stats.ticks < max_ticks:
+            deadline = start + tick * period
+            if duration is not None and deadline - start >= duration:
+                break
+            delay = deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            lateness = loop.time() - deadline
+            if lateness >= period:
+                # Skip the ticks we can no longer make instead of bursting
+                skipped = int(lateness // period)
+                stats.missed += skipped
+                tick += skipped
+                lateness -= skipped * period
+            stats.record(lateness)
+            if self.profiler is not None and self.profiler.armed.is_set():
+                # All three stages in one thread, so one profile covers the tick
+                try:
+                    await asyncio.to_thread(self.profiler.capture, self.run_tick, device_ids)
+                except Exception as e:
+                    print("Error profiling tick:", e)
+                tick += 1
+                continue
+            try:
+                batch = await asyncio.to_thread(self.home.generate_batch, device_ids)
+                await queue.put(batch)
+            except Exception as e:
+                print("Error generating telemetry:", e)
+            tick += 1
+
+    def run_tick(self, device_ids):
+        batch = self.home.generate_batch(device_ids)
+        self.home.persist_batch(batch)
+        if self.upload_mode is not None:
+            self.home.upload_batch(batch, self.upload_mode)
+        return batch
+
+    async def _persist(self, queue, upload_queue):
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                await upload_queue.put(None)
+                return
+            try:
+                await asyncio.to_thread(self.home.persist_batch, batch)
+            except Exception as e:
+                print("Error persisting telemetry:", e)
+            await upload_queue.put(batch)
+
+    async def _upload(self, queue):
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
+            if self.upload_mode is None:
+                continue
+            try:
+                await asyncio.to_thread(self.home.upload_batch, batch, self.upload_mode)
+            except Exception as e:
+                print("Error uploading telemetry:", e)
+
+    async def run(self, max_ticks=None, duration=None):
+        persist_queue = asyncio.Queue(maxsize=self.queue_size)
+        upload_queue = asyncio.Queue(maxsize=self.queue_size)
+        consumers = [
+            asyncio.create_task(self._persist(persist_queue, upload_queue)),
+            asyncio.create_task(self._upload(upload_queue)),
+        ]
+        producers = [
+            self._generate(period, device_ids, persist_queue, max_ticks, duration)
+            for period, device_ids in sorted(self.device_groups().items())
+        ]
+        try:
+            await asyncio.gather(*producers)
+        finally:
+            await persist_queue.put(None)
+            await asyncio.gather(*consumers)
+            if self.save_state:
+                self.home.save_state()
+        self.report()
+
+    def report(self):
+        print("Simulation schedule:")
+        for period in sorted(self.stats):
+            print(f"  {self.stats[period]}")
+        if self.upload_mode == 'patch':
+            print("Patch counters:", self.home.patch_tracker.counters())
@@ -0,0 +1,303 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from metrics import MetricsRegistry, metrics, serve_metrics
+
+
+# Seconds between progress reports from each worker
+REPORT_INTERVAL = 2.0
+
+
+def shard_homes(homes, shards):
+    # Contiguous, near-equal ranges of home numbers: [(first home, homes)]
+    base, extra = divmod(homes, shards)
+    ranges = []
+    first = 0
+    for shard in range(shards):
+        count = base + (1 if shard < extra else 0)
+        if count:
+            ranges.append((first, count))
+        first += count
+    return ranges
+
+
+def counter(snapshot, name):
+    if not snapshot:
+        return 0
+    return sum(value for (metric, _), value in snapshot['counters'].items() if metric == name)
+
+
+class ShardSpec:
+    # Everything a worker process needs to build its own simulator. Each
+    # shard gets its own twin client, generator seed and sink directory
+    # (<dump root>/shard=<index>).
+    def __init__(self, index, first_home, homes, rooms_per_home, ticks, period, host, template_path, model_path,
+                 dump_root, upload_mode='patch', seed=None, provision=False, compact=True) -> None:
+        self.index = index
+        self.first_home = first_home
+        self.homes = homes
+        self.rooms_per_home = rooms_per_home
+        self.ticks = ticks
+        self.period = period
+        self.host = host
+        self.template_path = template_path
+        self.model_path = model_path
+        self.dump_root = dump_root
+        self.upload_mode = upload_mode
+        self.seed = seed
+        self.provision = provision
+        self.compact = compact
+
+    def path(self):
+        return os.path.join(self.dump_root, f"shard={self.index}")
+
+
+def provision_shard(home, models=False):
+    # Upserts only this shard's twins and relationships. The models are
+    # shared, so against the service they must already be provisioned; an
+    # in-memory graph gets its own copy.
+    import fleet
+    from telemetryschema import load_models
+    if models:
+        home.dt_client.create_models(load_models(home.model_path))
+    home.provisioner.create_twins(fleet.twins_from(home.state))
+    home.provisioner.create_relationships(fleet.relationships_from(home.state))
+
+
+def run_shard(spec, progress, ticks_done=0):
+    # Worker process entry point: simulates the shard's homes for the ticks
+    # still to do, reporting progress and a metrics snapshot to the
+    # coordinator every REPORT_INTERVAL seconds
+    import pandas as pd
+    import fleet
+    from DigitalTwinSmartHome import DigitalTwinSmartHome
+    from scheduler import SimulationScheduler
+    from retention import compactor_for
+
+    def report(kind, scheduler):
+        ticks = max((stats.ticks for stats in scheduler.stats.values()), default=0) if scheduler else 0
+        missed = sum(stats.missed for stats in scheduler.stats.values()) if scheduler else 0
+        progress.put((kind, spec.index, os.getpid(), {
+            'ticks': ticks_done + ticks,
+            'missed': missed,
+            'metrics': metrics.snapshot(),
+        }))
+
+    scheduler = None
+    stopped = threading.Event()
+    try:
+        os.makedirs(spec.path(), exist_ok=True)
+        home = DigitalTwinSmartHome(
+            dtHostName=spec.host,
+            excel_path=os.path.join(spec.path(), 'scenario.xlsx'),
+            dump_path=spec.path(),
+            model_path=spec.model_path,
+            seed=spec.seed)
+        home.connection()
+        if home.dt_client is None:
+            raise RuntimeError(f"no twin client for {spec.host}")
+        template = pd.read_excel(spec.template_path)
+        home.state = pd.concat(fleet.iter_fleet(template, spec.homes, spec.rooms_per_home, first_home=spec.first_home),
+                               ignore_index=True)
+        local = spec.host.startswith('local://')
+        if spec.provision or local:
+            provision_shard(home, models=local)
+        # A restarted shard rebuilds its fleet from the template, so the
+        # state workbook would never be read back
+        scheduler = SimulationScheduler(home, period=spec.period, upload_mode=spec.upload_mode, save_state=False)
+        compactor = compactor_for(home.sink) if spec.compact else None
+        if compactor is not None:
+            compactor.start()
+
+        def reporter():
+            while not stopped.wait(REPORT_INTERVAL):
+                report('progress', scheduler)
+        threading.Thread(target=reporter, name='shard-reporter', daemon=True).start()
+        try:
+            asyncio.run(scheduler.run(max_ticks=max(0, spec.ticks - ticks_done)))
+        finally:
+            stopped.set()
+            if compactor is not None:
+                compactor.stop()
+        report('done', scheduler)
+    except Exception as e:
+        stopped.set()
+        print(f"Error in shard {spec.index}:", e)
+        progress.put(('failed', spec.index, os.getpid(), {'error': str(e)}))
+        raise SystemExit(1)
+
+
+class ShardState:
+    def __init__(self, spec) -> None:
+        self.spec = spec
+        self.process = None
+        self.status = 'pending'
+        self.ticks = 0
+        self.missed = 0
+        self.restarts = 0
+        self.restart_at = None
+        self.error = None
+        # Metrics of the running worker, and of workers that were replaced
+        self.snapshot = None
+        self.retired = []
+
+    def updates(self):
+        return sum(counter(snapshot, 'property_values_persisted_total') for snapshot in self.retired + [self.snapshot])
+
+
+class ShardCoordinator:
+    # Runs one worker process per shard (spawned, so each has its own
+    # interpreter and GIL), collects their progress and metrics, and
+    # restarts a failed shard from its last reported tick up to
+    # max_restarts times
+    def __init__(self, specs, max_restarts=3, restart_delay=1.0) -> None:
+        self.specs = specs
+        self.max_restarts = max_restarts
+        self.restart_delay = restart_delay
+        self.context = multiprocessing.get_context('spawn')
+        self.progress = self.context.Queue()
+        self.shards = {spec.index: ShardState(spec) for spec in specs}
+        self._lock = threading.Lock()
+
+    def start_shard(self, shard):
+        shard.process = self.context.Process(
+            target=run_shard, args=(shard.spec, self.progress, shard.ticks), name=f"shard-{shard.spec.index}")
+        shard.process.start()
+        shard.status = 'running'
+        shard.restart_at = None
+
+    def receive(self, timeout):
+        try:
+            message = self.progress.get(timeout=timeout)
+        except queue.Empty:
+            return
+        while True:
+            kind, index, pid, payload = message
+            shard = self.shards[index]
+            # Late messages from a replaced worker are ignored
+            if shard.process is not None and shard.process.pid == pid:
+                with self._lock:
+                    if kind == 'failed':
+                        shard.error = payload['error']
+                    else:
+                        shard.ticks = payload['ticks']
+                        shard.missed = payload['missed']
+                        shard.snapshot = payload['metrics']
+                        if kind == 'done':
+                            shard.status = 'done'
+            try:
+                message = self.progress.get_nowait()
+            except queue.Empty:
+                return
+
+    def supervise(self):
+        now = time.monotonic()
+        for shard in self.shards.values():
+            if shard.status == 'restarting' and now >= shard.restart_at:
+                print(f"Restarting shard {shard.spec.index} at tick {shard.ticks} "
+                      f"(restart {shard.restarts} of {self.max_restarts})")
+                self.start_shard(shard)
+            if shard.status != 'running' or shard.process.is_alive():
+                continue
+            if shard.process.exitcode == 0:
+                shard.status = 'done'
+                continue
+            print(f"Shard {shard.spec.index} exited with code {shard.process.exitcode}: {shard.error or 'no error reported'}")
+            metrics.inc('shard_failures_total', shard=str(shard.spec.index))
+            with self._lock:
+                if shard.snapshot is not None:
+                    shard.retired.append(shard.snapshot)
+                    shard.snapshot = None
+            if shard.restarts >= self.max_restarts:
+                shard.status = 'failed'
+                continue
+            shard.restarts += 1
+            shard.status = 'restarting'
+            shard.restart_at = now + self.restart_delay * 2 ** (shard.restarts - 1)
+
+    def active(self):
+        return any(shard.status in ('running', 'restarting') for shard in self.shards.values())
+
+    def run(self, report_interval=REPORT_INTERVAL):
+        started = time.perf_counter()
+        for shard in self.shards.values():
+            self.start_shard(shard)
+        last_report = started
+        last_updates = 0
+        try:
+            while self.active():
+                self.receive(timeout=0.5)
+                self.supervise()
+                now = time.perf_counter()
+                if now - last_report >= report_interval:
+                    updates = self.updates()
+                    print(self.progress_line(updates, (updates - last_updates) / (now - last_report)))
+                    last_report, last_updates = now, updates
+            self.receive(timeout=0.1)
+        except KeyboardInterrupt:
+            print("Stopping shards")
+            for shard in self.shards.values():
+                if shard.process is not None and shard.process.is_alive():
+                    shard.process.terminate()
+        finally:
+            for shard in self.shards.values():
+                if shard.process is not None:
+                    shard.process.join()
+        return self.report(time.perf_counter() - started)
+
+    def updates(self):
+        with self._lock:
+            return sum(shard.updates() for shard in self.shards.values())
+
+    def progress_line(self, updates, rate):
+        ticks = sum(shard.ticks for shard in self.shards.values())
+        target = sum(shard.spec.ticks for shard in self.shards.values())
+        running = sum(shard.status == 'running' for shard in self.shards.values())
+        return f"Shards: {running} running, {ticks}/{target} ticks, {updates} property values persisted ({rate:,.0f}/s)"
+
+    def render(self):
+        # Prometheus text of every shard's metrics, labelled by shard, plus
+        # the coordinator's own
+        registry = MetricsRegistry(metrics.prefix)
+        registry.help = dict(metrics.help)
+        registry.absorb(metrics.snapshot())
+        with self._lock:
+            for index, shard in self.shards.items():
+                for snapshot in shard.retired + [shard.snapshot]:
+                    if snapshot is not None:
+                        registry.absorb(snapshot, shard=str(index))
+        return registry.render()
+
+    def report(self, elapsed):
+        summary = {'elapsed': elapsed, 'shards': {}}
+        print(f"Sharded simulation finished in {elapsed:.1f}s:")
+        for index, shard in sorted(self.shards.items()):
+            updates = shard.updates()
+            summary['shards'][index] = {'status': shard.status, 'ticks': shard.ticks, 'missed': shard.missed,
+                                        'restarts': shard.restarts, 'updates': updates}
+            print(f"  shard {index}: {shard.status}, {shard.spec.homes} homes, {shard.ticks}/{shard.spec.ticks} ticks, "
+                  f"{shard.missed} missed, {shard.restarts} restarts, {updates} property values persisted")
+        summary['updates'] = self.updates()
+        summary['updates_per_second'] = summary['updates'] / elapsed if elapsed else None
+        print(f"  total: {summary['updates']} property values persisted, {summary['updates_per_second'] or 0:,.0f}/s")
+        return summary
+
+
+def run_sharded(homes, shards, rooms_per_home=1, ticks=20, period=1.0, host='local://sharded',
+                template_path='./assests/RoomScenario-smarthome.xlsx', model_path='./assests/',
+                dump_root='./assests/telemetry', upload_mode='patch', seed=None, provision=False,
+                compact=True, metrics_port=None, max_restarts=3):
+    shards = max(1, min(shards, homes))
+    specs = [
+        ShardSpec(index, first_home, count, rooms_per_home, ticks, period, host, template_path, model_path,
+                  dump_root, upload_mode, None if seed is None else seed + index, provision, compact)
+        for index, (first_home, count) in enumerate(shard_homes(homes, shards))
+    ]
+    coordinator = ShardCoordinator(specs, max_restarts=max_restarts)
+    if metrics_port:
+        serve_metrics(metrics_port, registry=coordinator)
+    print(f"Simulating {homes} homes x {rooms_per_home} rooms on {len(specs)} worker processes")
+    return coordinator.run()
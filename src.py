@@ -1,20 +1,38 @@
-from DigitalTwinSmartHome import *
+import argparse
+import os
+
+
+DT_HOST_NAME = "https://ADT-FYP-smarthomes-name.api.wcus.digitaltwins.azure.net"
+EXCEL_PATH = "./assests/RoomScenario-smarthome.xlsx"
+DUMP_PATH = "./assests/telemetry"
+MODEL_PATH = "./assests/"
 
 
 class src:
-    def __init__(self,maxRuns,sleepDuration) -> None:
+    def __init__(self,maxRuns,sleepDuration,cadences=None,dtHostName=DT_HOST_NAME,excel_path=EXCEL_PATH,dump_path=DUMP_PATH,model_path=MODEL_PATH) -> None:
+        # pandas and the Azure SDK are only imported once a simulator is built
+        from DigitalTwinSmartHome import DigitalTwinSmartHome
         self.maxRuns = maxRuns
         self.sleepDuration = sleepDuration
+        # Per device / per model tick periods in seconds, e.g.
+        # {"dtmi:example:Room;1": 1, "dtmi:example:Fridge;1": 60}
+        self.cadences = cadences or {}
         self.help = DigitalTwinSmartHome(
-            dtHostName = "https://ADT-FYP-smarthomes-name.api.wcus.digitaltwins.azure.net",
-            excel_path = "./assests/RoomScenario-smarthome.xlsx",
-            dump_path = "./assests/datadump.xlsx",
-            model_path = "./assests/")
+            dtHostName = dtHostName,
+            excel_path = excel_path,
+            dump_path = dump_path,
+            model_path = model_path)
         #Establish Connection
         self.help.connection()
 
-    def run(self):    
+    def run(self, reconcile=False, dry_run=False, use_state_file=False):    
         
+        if reconcile:
+            #Only apply what changed since the last provisioning
+            self.help.reconcile(dry_run, use_state_file)
+            if not dry_run:
+                self.help.display_all()
+            return
 
         #Models
         self.help.upload_models()
@@ -26,20 +44,143 @@ class src:
         #Validate
         self.help.display_all()
 
-    def simulate(self):
-        #Real Time Simulation
-        for i in range(self.maxRuns):
-            self.help.generate_telemtry()
-            self.help.upload_telemtry()
-            print(f"Run Successfull. next run in {self.sleepDuration} seconds")
-            time.sleep(self.sleepDuration)
+    def simulate(self, bus=None, metrics_port=None, profile_tick=False, compact=True):
+        import asyncio
+        from scheduler import SimulationScheduler
+        from metrics import TickProfiler, serve_metrics
+        from retention import compactor_for
+        if metrics_port:
+            serve_metrics(metrics_port)
+        #kill -USR1 <pid> profiles the next tick
+        profiler = TickProfiler()
+        profiler.install_signal()
+        if profile_tick:
+            profiler.arm()
+        #Publish ticks to subscribed dashboards as they are written
+        if bus != 'off':
+            self.help.publish_telemetry(bus)
+        #Merge old segments and apply the retention policy in the background
+        compactor = compactor_for(self.help.sink) if compact else None
+        if compactor is not None:
+            compactor.start()
+        #Real Time Simulation, fixed-rate ticks for maxRuns periods
+        scheduler = SimulationScheduler(self.help, period=self.sleepDuration, cadences=self.cadences, profiler=profiler)
+        try:
+            asyncio.run(scheduler.run(duration=self.maxRuns * self.sleepDuration))
+        finally:
+            if compactor is not None:
+                compactor.stop()
+
+    def upload_once(self, mode='patch'):
+        #Single tick: generate, persist and upload, then save the scenario
+        batch = self.help.generate_batch()
+        self.help.persist_batch(batch)
+        self.help.upload_batch(batch, mode)
+        self.help.save_state()
+        print(f"Uploaded telemtry for {len(batch)} devices")
+        print("Patch counters:", self.help.patch_tracker.counters())
+
+
+def export(dump_path, excel_path, start=None, end=None, model_path=MODEL_PATH):
+    # Only needs the sink, so no twin client (or credential) is created
+    from telemetrysink import open_sink
+    return open_sink(dump_path, model_path).export_excel(excel_path, start, end)
+
+
+def compact(dump_path, model_path=MODEL_PATH, raw_days=None):
+    # One maintenance pass, for cron when no simulator is running
+    from datetime import timedelta
+    from telemetrysink import open_sink
+    from retention import RetentionPolicy, compactor_for
+    policy = RetentionPolicy(raw=timedelta(days=raw_days)) if raw_days is not None else RetentionPolicy()
+    compactor = compactor_for(open_sink(dump_path, model_path), policy=policy)
+    if compactor is None:
+        print("Compaction needs a Parquet telemetry sink, skipping", dump_path)
+        return None
+    return compactor.run_once()
+
+
+def cadence(text):
+    # --cadence <model or device id>=<seconds>
+    key, sep, seconds = text.rpartition('=')
+    try:
+        period = float(seconds)
+    except ValueError:
+        period = 0
+    if not sep or not key or period <= 0:
+        raise argparse.ArgumentTypeError(f"expected <model or device id>=<seconds>, got {text!r}")
+    return key, period
 
-# Usage
-s = src(maxRuns=20,sleepDuration=10)
-s.run()    
-s.simulate()    
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Smart home digital twin simulator")
+    parser.add_argument('--host', default=DT_HOST_NAME, help="Azure Digital Twins host, or local://<name> for an in-memory graph")
+    parser.add_argument('--excel', default=EXCEL_PATH, help="scenario workbook")
+    parser.add_argument('--dump', default=DUMP_PATH, help="telemetry sink (directory, or a .xlsx file)")
+    parser.add_argument('--models', default=MODEL_PATH, help="directory of DTDL models")
+    commands = parser.add_subparsers(dest='command', required=True)
 
+    provision = commands.add_parser('provision', help="upload models, twins and relationships")
+    provision.add_argument('--recreate', action='store_true', help="delete and re-create everything instead of reconciling")
+    provision.add_argument('--dry-run', action='store_true', help="only print the reconcile plan")
+    provision.add_argument('--state-file', action='store_true', help="diff against the local state file instead of the service")
+    simulate = commands.add_parser('simulate', help="run the real time simulation")
+    simulate.add_argument('--runs', type=int, default=20)
+    simulate.add_argument('--period', type=float, default=10, help="seconds per tick")
+    simulate.add_argument('--provision', action='store_true', help="provision the twin graph first")
+    simulate.add_argument('--bus', help="host:port to publish ticks on for live dashboards, or 'off'")
+    simulate.add_argument('--metrics-port', type=int, help="serve Prometheus metrics on this port")
+    simulate.add_argument('--profile-tick', action='store_true', help="profile the first tick (later ones: kill -USR1)")
+    simulate.add_argument('--no-compact', action='store_true', help="do not compact the telemetry sink while simulating")
+    simulate.add_argument('--cadence', type=cadence, action='append', default=[], metavar='ID=SECONDS',
+                          help="tick period for a model or device id (repeatable; default: --period)")
+    upload_once = commands.add_parser('upload-once', help="generate and upload a single tick of telemetry")
+    upload_once.add_argument('--mode', choices=['patch', 'upsert'], default='patch')
+    export_parser = commands.add_parser('export', help="export the telemetry history to a workbook")
+    export_parser.add_argument('output')
+    export_parser.add_argument('--start')
+    export_parser.add_argument('--end')
+    sharded = commands.add_parser('sharded', help="simulate a fleet of homes across worker processes")
+    sharded.add_argument('--homes', type=int, required=True)
+    sharded.add_argument('--shards', type=int, default=os.cpu_count() or 1, help="worker processes (default: one per core)")
+    sharded.add_argument('--rooms-per-home', type=int, default=1)
+    sharded.add_argument('--runs', type=int, default=20)
+    sharded.add_argument('--period', type=float, default=1, help="seconds per tick")
+    sharded.add_argument('--upload', choices=['patch', 'upsert', 'off'], default='patch')
+    sharded.add_argument('--provision', action='store_true', help="upsert each shard's twins first (always for local://)")
+    sharded.add_argument('--seed', type=int)
+    sharded.add_argument('--metrics-port', type=int, help="serve the shards' Prometheus metrics on this port")
+    sharded.add_argument('--max-restarts', type=int, default=3)
+    compact_parser = commands.add_parser('compact', help="compact the telemetry sink and apply the retention policy")
+    compact_parser.add_argument('--raw-days', type=int, help="days of raw telemetry to keep (default 7)")
+    args = parser.parse_args(argv)
 
+    if args.command == 'export':
+        export(args.dump, args.output, args.start, args.end, args.models)
+        return
+    if args.command == 'compact':
+        compact(args.dump, args.models, args.raw_days)
+        return
+    if args.command == 'sharded':
+        #The scenario workbook is the per-room template; each shard writes to <dump>/shard=<k>
+        from sharding import run_sharded
+        run_sharded(args.homes, args.shards, args.rooms_per_home, args.runs, args.period, args.host,
+                    args.excel, args.models, args.dump, None if args.upload == 'off' else args.upload,
+                    args.seed, args.provision, metrics_port=args.metrics_port, max_restarts=args.max_restarts)
+        return
+    runs, period = (args.runs, args.period) if args.command == 'simulate' else (1, 0)
+    cadences = dict(args.cadence) if args.command == 'simulate' else None
+    s = src(maxRuns=runs, sleepDuration=period, cadences=cadences, dtHostName=args.host,
+            excel_path=args.excel, dump_path=args.dump, model_path=args.models)
+    if args.command == 'provision':
+        s.run(not args.recreate, args.dry_run, args.state_file)
+    elif args.command == 'simulate' and args.provision:
+        s.run(reconcile=True)
+    if args.command == 'simulate':
+        s.simulate(args.bus, args.metrics_port, args.profile_tick, not args.no_compact)
+    elif args.command == 'upload-once':
+        s.upload_once(args.mode)
 
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+import json
+import os
+import queue
+import secrets
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+import pyarrow as pa
+
+
+def bus_address(value=None):
+    # "host:port", defaulting to SMARTHOME_BUS_ADDRESS or localhost:6001
+    value = value or os.environ.get('SMARTHOME_BUS_ADDRESS', 'localhost:6001')
+    host, port = value.rsplit(':', 1)
+    return host, int(port)
+
+
+BUS_KEY_FILE = os.path.join(os.path.expanduser('~'), '.smarthome', 'bus.key')
+
+
+def bus_authkey(create=False):
+    # SMARTHOME_BUS_AUTHKEY, else the key in SMARTHOME_BUS_KEYFILE (default
+    # ~/.smarthome/bus.key). With `create` (the publisher) a random key is
+    # written there, readable by the owner only, if there is none yet.
+    # None when there is no key: there is no built-in default.
+    key = os.environ.get('SMARTHOME_BUS_AUTHKEY')
+    if key:
+        return key.encode()
+    path = os.environ.get('SMARTHOME_BUS_KEYFILE', BUS_KEY_FILE)
+    if create and not os.path.exists(path):
+        try:
+            os.makedirs(os.path.dirname(path) or '.', mode=0o700, exist_ok=True)
+            descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(descriptor, 'w') as f:
+                f.write(secrets.token_hex(32))
+        except FileExistsError:
+            pass
+        except OSError as e:
+            print("Error creating telemetry bus key:", e)
+    try:
+        with open(path) as f:
+            key = f.read().strip()
+    except OSError:
+        return None
+    return key.encode() or None
+
+
+def encode_message(previous, marker, rows):
+    # Arrow IPC stream of the rows, with the sink markers in its metadata;
+    # no pickles cross the bus
+    table = pa.Table.from_pandas(rows, preserve_index=False)
+    markers = json.dumps({'previous': previous, 'marker': marker}).encode()
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'smarthome': markers})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def decode_message(payload):
+    table = pa.ipc.open_stream(payload).read_all()
+    markers = json.loads(table.schema.metadata[b'smarthome'])
+    previous, marker = (tuple(value) if isinstance(value, list) else value
+                        for value in (markers['previous'], markers['marker']))
+    return previous, marker, table.to_pandas()
+
+
+class TelemetryPublisher:
+    # Local pub/sub channel for telemetry ticks. Each message is
+    # (previous_marker, marker, rows), where the markers are sink positions,
+    # so a subscriber can tell whether it missed a tick; it is sent as Arrow
+    # bytes (see encode_message). Every subscriber has
+    # its own bounded queue and sender thread; a slow subscriber drops ticks
+    # (and catches up from the sink) instead of holding up the simulator.
+    def __init__(self, address=None, authkey=None, queue_size=16) -> None:
+        self.address = bus_address(address) if not isinstance(address, tuple) else address
+        self.authkey = authkey
+        self.queue_size = queue_size
+        self.previous = None
+        self._subscribers = []
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.authkey is None:
+            self.authkey = bus_authkey(create=True)
+        if self.authkey is None:
+            print("Error starting telemetry bus: no authkey, set SMARTHOME_BUS_AUTHKEY or SMARTHOME_BUS_KEYFILE")
+            return self
+        try:
+            self._listener = Listener(self.address, authkey=self.authkey)
+        except OSError as e:
+            print("Error starting telemetry bus:", e)
+            return self
+        threading.Thread(target=self._accept, args=(self._listener,), name='telemetry-bus', daemon=True).start()
+        print(f"Publishing telemetry on {self.address[0]}:{self.address[1]}")
+        return self
+
+    def _accept(self, listener):
+        while self._listener is listener:
+            try:
+                connection = listener.accept()
+            except OSError:
+                return
+            except Exception as e:
+                # e.g. a client with the wrong authkey
+                print("Error accepting telemetry subscriber:", e)
+                continue
+            if self._listener is not listener:
+                # Closed while blocked in accept()
+                connection.close()
+                return
+            outbox = queue.Queue(maxsize=self.queue_size)
+            with self._lock:
+                self._subscribers.append(outbox)
+            threading.Thread(target=self._send, args=(connection, outbox), daemon=True).start()
+
+    def _send(self, connection, outbox):
+        try:
+            while True:
+                message = outbox.get()
+                if message is None:
+                    return
+                connection.send_bytes(message)
+        except (OSError, EOFError):
+            pass
+        finally:
+            with self._lock:
+                if outbox in self._subscribers:
+                    self._subscribers.remove(outbox)
+            connection.close()
+
+    def publish(self, rows, marker=None):
+        previous, self.previous = self.previous, marker
+        with self._lock:
+            subscribers = list(self._subscribers)
+        if not subscribers:
+            return
+        message = encode_message(previous, marker, rows)
+        for outbox in subscribers:
+            try:
+                outbox.put_nowait(message)
+            except queue.Full:
+                pass
+
+    def close(self):
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.close()
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, []
+        for outbox in subscribers:
+            try:
+                outbox.put_nowait(None)
+            except queue.Full:
+                pass
+
+
+class TelemetrySubscriber:
+    # Feeds published ticks into a TelemetryCache, reconnecting whenever the
+    # publisher is not (yet) running
+    def __init__(self, cache, address=None, authkey=None, retry=2.0) -> None:
+        self.cache = cache
+        self.address = bus_address(address) if not isinstance(address, tuple) else address
+        self.authkey = authkey
+        self.retry = retry
+        self.connected = False
+        self.received = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='telemetry-subscriber', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            # The publisher may only create the key file when it starts
+            authkey = self.authkey or bus_authkey()
+            if authkey is None:
+                self._stop.wait(self.retry)
+                continue
+            try:
+                connection = Client(self.address, authkey=authkey)
+            except AuthenticationError as e:
+                print("Error subscribing to telemetry bus:", e)
+                self._stop.wait(self.retry)
+                continue
+            except OSError:
+                self._stop.wait(self.retry)
+                continue
+            self.connected = True
+            try:
+                while not self._stop.is_set():
+                    previous, marker, rows = decode_message(connection.recv_bytes())
+                    self.received += 1
+                    self.cache.apply(rows, marker, previous)
+            except (OSError, EOFError):
+                pass
+            except Exception as e:
+                print("Error applying telemetry from bus:", e)
+            finally:
+                self.connected = False
+                connection.close()
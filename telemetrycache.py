@@ -0,0 +1,165 @@
+import os
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from telemetrysink import open_sink, row_timestamps
+from metrics import metrics
+
+
+DUMP_PATH = os.environ.get('SMARTHOME_DUMP_PATH', './assests/telemetry')
+DEFAULT_WINDOW = timedelta(days=7)
+
+
+class TelemetryCache:
+    # In-process view of the most recent `window` of telemetry. Each refresh
+    # only pulls the rows appended to the sink since the previous refresh.
+    # The window is held as a list of chunks (frame, timestamps), so taking
+    # in and evicting rows costs O(new + evicted rows); the combined frame
+    # is only built when asked for, once per version.
+    def __init__(self, sink, window=DEFAULT_WINDOW) -> None:
+        self.sink = sink
+        self.window = window
+        self.chunks = []
+        self.size = 0
+        self.version = 0
+        self._frame = pd.DataFrame()
+        self._frame_version = 0
+        # Total rows ever taken in, so clients can address rows across evictions
+        self.rows_seen = 0
+        self.subscriber = None
+        self._marker = None
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def add_listener(self, listener):
+        # listener(new_rows, evicted_rows) is called once per refresh that
+        # brought in new rows. A late listener is first seeded with the
+        # current frame.
+        with self._lock:
+            frame = self._combined()
+            if not frame.empty:
+                listener(frame, frame.iloc[0:0])
+            self._listeners.append(listener)
+
+    def subscribe(self, address=None):
+        # Take ticks pushed over the telemetry bus instead of polling the sink
+        from telemetrybus import TelemetrySubscriber
+        if self.subscriber is None:
+            self.subscriber = TelemetrySubscriber(self, address).start()
+        return self.subscriber
+
+    @property
+    def frame(self):
+        with self._lock:
+            return self._combined()
+
+    def snapshot(self):
+        with self._lock:
+            return self._combined(), self.rows_seen
+
+    def tail(self, rows_from):
+        # Rows numbered rows_from and later (see rows_seen), built from the
+        # newest chunks only; None once those rows have been evicted
+        with self._lock:
+            if rows_from < self.rows_seen - self.size:
+                return None, self.rows_seen
+            needed = self.rows_seen - rows_from
+            frames = []
+            for frame, _ in reversed(self.chunks):
+                if needed <= 0:
+                    break
+                frames.append(frame.iloc[-needed:] if needed < len(frame) else frame)
+                needed -= len(frame)
+            if not frames:
+                return self._empty(), self.rows_seen
+            return pd.concat(frames[::-1], ignore_index=True), self.rows_seen
+
+    def _empty(self):
+        return self.chunks[0][0].iloc[0:0] if self.chunks else pd.DataFrame()
+
+    def _combined(self):
+        if self._frame_version != self.version:
+            frames = [frame for frame, _ in self.chunks]
+            self._frame = pd.concat(frames, ignore_index=True) if len(frames) > 1 else (
+                frames[0].reset_index(drop=True) if frames else pd.DataFrame())
+            self._frame_version = self.version
+        return self._frame
+
+    def refresh(self, force=False):
+        # While the bus subscriber is connected the pushed ticks keep the
+        # frame current, so the sink is not polled
+        if not force and self.subscriber is not None and self.subscriber.connected:
+            with self._lock:
+                return self._empty()
+        with self._lock:
+            start = self._window_start()
+            with metrics.timer('stage_seconds', stage='sink_load'):
+                new_rows, self._marker = self.sink.changes_since(self._marker, start)
+            return self._ingest(new_rows, start)
+
+    def apply(self, new_rows, marker, previous):
+        # Rows pushed over the bus are only taken as-is when they directly
+        # follow what the cache has seen; after a gap the sink is read instead
+        with self._lock:
+            if marker is not None and previous is not None and previous == self._marker:
+                self._marker = marker
+                return self._ingest(new_rows, self._window_start())
+        return self.refresh(force=True)
+
+    def _window_start(self):
+        return datetime.now() - self.window if self.window else None
+
+    def _ingest(self, new_rows, start):
+        if new_rows.empty:
+            return new_rows
+        self.chunks.append((new_rows.reset_index(drop=True), row_timestamps(new_rows).to_numpy()))
+        self.size += len(new_rows)
+        self._merge()
+        evicted_rows = self._evict(start)
+        self.rows_seen += len(new_rows)
+        self.version += 1
+        for listener in self._listeners:
+            listener(new_rows, evicted_rows)
+        return new_rows
+
+    def _merge(self):
+        # Keep chunk sizes growing towards the past, merging the newest two
+        # while the older one is no larger: O(log rows) chunks, and each row
+        # is copied O(log rows) times over its life in the window
+        while len(self.chunks) > 1 and len(self.chunks[-2][0]) <= len(self.chunks[-1][0]):
+            (older, older_times), (newer, newer_times) = self.chunks[-2:]
+            self.chunks[-2:] = [(pd.concat([older, newer], ignore_index=True),
+                                 np.concatenate([older_times, newer_times]))]
+
+    def _evict(self, start):
+        if start is None or not self.chunks:
+            return self._empty()
+        # Rows arrive in time order, so expired rows are always a prefix:
+        # whole chunks go first, then the head of the oldest one is cut
+        start = np.datetime64(pd.Timestamp(start))
+        evicted = []
+        while self.chunks and self.chunks[0][1][-1] < start:
+            evicted.append(self.chunks.pop(0)[0])
+        if self.chunks:
+            frame, times = self.chunks[0]
+            cut = int(times.searchsorted(start))
+            if cut:
+                evicted.append(frame.iloc[:cut])
+                self.chunks[0] = (frame.iloc[cut:].reset_index(drop=True), times[cut:])
+        if not evicted:
+            return self._empty()
+        self.size -= sum(len(frame) for frame in evicted)
+        return pd.concat(evicted, ignore_index=True) if len(evicted) > 1 else evicted[0]
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(dump_path=DUMP_PATH, window=DEFAULT_WINDOW):
+    # One shared cache per sink so every callback sees the same frame
+    with _caches_lock:
+        if dump_path not in _caches:
+            _caches[dump_path] = TelemetryCache(open_sink(dump_path), window)
+        return _caches[dump_path]
@@ -0,0 +1,135 @@
+import json
+import numpy as np
+import pandas as pd
+
+
+# Value distributions per property, the same ranges the original
+# get_random_value if/elif chain used
+PROPERTY_DISTRIBUTIONS = {
+    'temperature': ('integer', 18, 23),
+    'mode': ('choice', ["Cool", "Normal", "Heat"]),
+    'fanSpeed': ('integer', 0, 3),
+    'onOff': ('boolean',),
+    'occupancy': ('boolean',),
+    'powerConsumed': ('uniform', 0.0, 1.0),
+    'volume': ('integer', 0, 1),
+    'channel': ('choice', ["BBC", "CNN", "FOX", "ABC"]),
+    'brightness': ('integer', 0, 100),
+    'lighting': ('integer', 0, 100),
+    'humidity': ('integer', 0, 100),
+    'speed': ('integer', 0, 5),
+    'color': ('choice', ["White", "Red", "Green", "Blue"]),
+    'status': ('choice', ["Running", "Stopped", "Paused"]),
+}
+
+# Fallbacks for DTDL properties without an explicit distribution
+SCHEMA_DISTRIBUTIONS = {
+    'double': ('uniform', 0.0, 1.0),
+    'float': ('uniform', 0.0, 1.0),
+    'integer': ('integer', 0, 100),
+    'long': ('integer', 0, 100),
+    'boolean': ('boolean',),
+}
+
+
+class DeviceLayout:
+    # Which rows of a device batch carry which property, computed once per
+    # set of devices and reused on every tick
+    __slots__ = ('size', 'property_rows', 'model_rows')
+
+    def __init__(self, size, property_rows, model_rows) -> None:
+        self.size = size
+        self.property_rows = property_rows
+        self.model_rows = model_rows
+
+
+class VectorizedTelemetryGenerator:
+    def __init__(self, schema, seed=None) -> None:
+        self.schema = schema
+        self.rng = np.random.default_rng(seed)
+        self.distributions = {}
+        for name, dtdl_schema in schema.properties.items():
+            distribution = PROPERTY_DISTRIBUTIONS.get(name, SCHEMA_DISTRIBUTIONS.get(dtdl_schema))
+            if distribution is not None:
+                self.distributions[name] = distribution
+        self._layouts = {}
+
+    def layout(self, model_ids):
+        model_ids = np.asarray(model_ids, dtype=object)
+        key = hash(tuple(model_ids))
+        if key in self._layouts:
+            return self._layouts[key]
+        models, codes = np.unique(model_ids, return_inverse=True)
+        model_rows = {model: np.flatnonzero(codes == i) for i, model in enumerate(models)}
+        property_rows = {}
+        for model, rows in model_rows.items():
+            for name in self.schema.model_properties.get(model, []):
+                if name in self.distributions:
+                    property_rows.setdefault(name, []).append(rows)
+        property_rows = {name: np.sort(np.concatenate(parts)) for name, parts in property_rows.items()}
+        layout = DeviceLayout(len(model_ids), property_rows, model_rows)
+        self._layouts = {key: layout}
+        return layout
+
+    def draw_values(self, name, count):
+        kind, *params = self.distributions[name]
+        if kind == 'integer':
+            return self.rng.integers(params[0], params[1] + 1, size=count)
+        if kind == 'uniform':
+            return self.rng.uniform(params[0], params[1], size=count)
+        if kind == 'boolean':
+            return self.rng.random(count) < 0.5
+        choices = np.asarray(params[0], dtype=object)
+        return choices[self.rng.integers(0, len(choices), size=count)]
+
+    def draw(self, layout):
+        # One vectorized draw per property for the whole batch of devices
+        return {
+            name: (rows, self.draw_values(name, len(rows)))
+            for name, rows in layout.property_rows.items()
+        }
+
+    def typed_columns(self, layout, draws):
+        columns = {}
+        for name in self.schema.properties:
+            dtype = self.schema.dtype(name)
+            if dtype == 'float64':
+                column = np.full(layout.size, np.nan)
+            elif dtype == 'string':
+                column = np.full(layout.size, None, dtype=object)
+            else:
+                column = np.zeros(layout.size, dtype='int64' if dtype == 'Int64' else bool)
+            mask = np.ones(layout.size, dtype=bool)
+            if name in draws:
+                rows, values = draws[name]
+                column[rows] = values
+                mask[rows] = False
+            if dtype == 'Int64':
+                columns[name] = pd.arrays.IntegerArray(column, mask)
+            elif dtype == 'boolean':
+                columns[name] = pd.arrays.BooleanArray(column, mask)
+            elif dtype == 'string':
+                columns[name] = pd.array(column, dtype='string')
+            else:
+                columns[name] = column
+        return columns
+
+    def init_data(self, layout, draws):
+        # JSON payloads are only built at the I/O edge, one model at a time
+        payloads = np.empty(layout.size, dtype=object)
+        for model, rows in layout.model_rows.items():
+            names = [name for name in self.schema.model_properties.get(model, []) if name in draws]
+            values = []
+            for name in names:
+                property_rows, drawn = draws[name]
+                values.append(drawn[np.searchsorted(property_rows, rows)].tolist())
+            payloads[rows] = [json.dumps(dict(zip(names, row))) for row in zip(*values)] if names else '{}'
+        return payloads
+
+    def update(self, df, with_init_data=True):
+        layout = self.layout(df['ModelID'].to_numpy())
+        draws = self.draw(layout)
+        columns = self.typed_columns(layout, draws)
+        if with_init_data:
+            columns['Init Data'] = self.init_data(layout, draws)
+        return df.assign(**{name: pd.Series(values, index=df.index) for name, values in columns.items()})
@@ -0,0 +1,79 @@
+import json
+import os
+import pandas as pd
+
+
+# DTDL primitive schema -> pandas (nullable) dtype of the flattened column
+DTDL_DTYPES = {
+    'double': 'float64',
+    'float': 'float64',
+    'integer': 'Int64',
+    'long': 'Int64',
+    'boolean': 'boolean',
+    'string': 'string',
+}
+
+
+def widen(current, new):
+    # Two models declaring the same property name with different schemas
+    if current is None or current == new:
+        return new
+    numeric = {'integer', 'long', 'double', 'float'}
+    if current in numeric and new in numeric:
+        return 'double'
+    return 'string'
+
+
+def load_models(model_path):
+    models = []
+    for filename in sorted(os.listdir(model_path)):
+        if filename.endswith(".json"):
+            with open(os.path.join(model_path, filename), 'r') as f:
+                models.append(json.load(f))
+    return models
+
+
+class TelemetrySchema:
+    def __init__(self, properties, model_properties) -> None:
+        # properties: property name -> DTDL schema, across all models
+        # model_properties: model id -> property names it declares
+        self.properties = properties
+        self.model_properties = model_properties
+
+    @classmethod
+    def from_models(cls, model_path):
+        properties = {}
+        model_properties = {}
+        for model in load_models(model_path):
+            names = []
+            for content in model.get('contents', []):
+                if content.get('@type') != 'Property':
+                    continue
+                schema = content.get('schema')
+                if not isinstance(schema, str) or schema not in DTDL_DTYPES:
+                    continue
+                properties[content['name']] = widen(properties.get(content['name']), schema)
+                names.append(content['name'])
+            model_properties[model['@id']] = names
+        return cls(properties, model_properties)
+
+    def dtype(self, name):
+        return DTDL_DTYPES[self.properties[name]]
+
+    def typed_column(self, values, name):
+        dtype = self.dtype(name)
+        if dtype in ('float64', 'Int64'):
+            values = pd.to_numeric(values, errors='coerce')
+        return values.astype(dtype)
+
+    def flatten(self, df, column='Init Data'):
+        # Decode the JSON payload once and add one typed column per property
+        records = [json.loads(value) if isinstance(value, str) else {} for value in df[column]]
+        values = pd.DataFrame.from_records(records, index=df.index)
+        flat = {}
+        for name in self.properties:
+            if name in values.columns:
+                flat[name] = self.typed_column(values[name], name)
+            else:
+                flat[name] = pd.Series(None, index=df.index, dtype=self.dtype(name))
+        return df.assign(**flat)
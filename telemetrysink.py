@@ -0,0 +1,355 @@
+import os
+import shutil
+import time
+from datetime import datetime
+import pandas as pd
+from telemetryschema import TelemetrySchema
+
+
+def stamp_batch(df, now=None):
+    # Tag a telemetry batch with the tick time it was generated at
+    now = now or datetime.now()
+    return df.assign(
+        Date=now.strftime('%Y-%m-%d'),
+        Time=now.strftime('%H:%M:%S'),
+        Timestamp=pd.Timestamp(now.replace(microsecond=0)),
+    )
+
+
+def row_timestamps(df):
+    if 'Timestamp' in df.columns:
+        return pd.to_datetime(df['Timestamp'])
+    return pd.to_datetime(df['Date'] + ' ' + df['Time'])
+
+
+def filter_range(df, start=None, end=None):
+    if df.empty or (start is None and end is None):
+        return df
+    timestamps = row_timestamps(df)
+    mask = pd.Series(True, index=df.index)
+    if start is not None:
+        mask &= timestamps >= pd.Timestamp(start)
+    if end is not None:
+        mask &= timestamps < pd.Timestamp(end)
+    return df[mask]
+
+
+class TelemetrySink:
+    schema = None
+
+    def prepare(self, df, now=None):
+        # Typed property columns are derived once here, at write time
+        batch = stamp_batch(df, now)
+        if self.schema is not None and not set(self.schema.properties).issubset(batch.columns):
+            batch = self.schema.flatten(batch)
+        return batch
+
+    def append(self, df, now=None):
+        raise NotImplementedError
+
+    def read(self, start=None, end=None, columns=None):
+        raise NotImplementedError
+
+    def changes_since(self, marker, start=None):
+        # Rows appended after `marker` (None for a first load from `start`),
+        # returned together with the marker to pass on the next call
+        raise NotImplementedError
+
+    def marker_for(self, appended):
+        # changes_since marker right after the append that returned
+        # `appended`, or None when the sink cannot tell
+        return None
+
+    def export_excel(self, excel_path, start=None, end=None):
+        # On-demand conversion of (a range of) the history to a single workbook
+        df = self.read(start, end)
+        if 'Timestamp' in df.columns:
+            df = df.drop(columns=['Timestamp'])
+        df.to_excel(excel_path, index=False)
+        print(f"Exported {len(df)} telemetry rows to {excel_path}")
+        return len(df)
+
+
+class ExcelTelemetrySink(TelemetrySink):
+    # Legacy single-workbook datadump. Every append rewrites the whole file,
+    # so this is only kept for small scenarios and backwards compatibility.
+    def __init__(self, dump_path, schema=None) -> None:
+        self.dump_path = dump_path
+        self.schema = schema
+
+    def append(self, df, now=None):
+        batch = self.prepare(df, now)
+        if os.path.exists(self.dump_path):
+            existing_data = pd.read_excel(self.dump_path)
+            batch = pd.concat([existing_data, batch], ignore_index=True)
+        batch.to_excel(self.dump_path, index=False)
+
+    def read(self, start=None, end=None, columns=None):
+        if not os.path.exists(self.dump_path):
+            return pd.DataFrame()
+        df = filter_range(pd.read_excel(self.dump_path), start, end)
+        return df[columns] if columns is not None else df
+
+    def changes_since(self, marker, start=None):
+        # The workbook is rewritten on every append, so the marker is its
+        # mtime plus the number of rows already seen
+        if not os.path.exists(self.dump_path):
+            return pd.DataFrame(), marker
+        mtime = os.path.getmtime(self.dump_path)
+        if marker is not None and marker[0] == mtime:
+            return pd.DataFrame(), marker
+        df = pd.read_excel(self.dump_path)
+        seen = marker[1] if marker is not None else 0
+        new_rows = filter_range(df.iloc[seen:], start) if marker is None else df.iloc[seen:]
+        return new_rows.reset_index(drop=True), (mtime, len(df))
+
+
+class ParquetTelemetrySink(TelemetrySink):
+    # Append-only store: one Parquet segment per tick, partitioned by day as
+    # <root>/date=YYYY-MM-DD/part-<sequence>.parquet. The compactor merges
+    # runs of segments into compact-<first>-<last>.parquet files, which carry
+    # each row's original segment number in a Sequence column.
+    partition_prefix = 'date='
+    segment_prefix = 'part-'
+    compact_prefix = 'compact-'
+    segment_suffix = '.parquet'
+    # Attempts for a read that races a compaction deleting its files
+    read_attempts = 5
+
+    def __init__(self, root, schema=None) -> None:
+        self.root = root
+        self.schema = schema
+        self._last_sequence = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    def _next_sequence(self):
+        # time_ns keeps segment names sortable across restarts
+        self._last_sequence = max(self._last_sequence + 1, time.time_ns())
+        return self._last_sequence
+
+    def partition_path(self, day):
+        return os.path.join(self.root, f"{self.partition_prefix}{day}")
+
+    def append(self, df, now=None):
+        batch = self.prepare(df, now)
+        day = batch['Date'].iloc[0] if len(batch) else datetime.now().strftime('%Y-%m-%d')
+        partition = self.partition_path(day)
+        os.makedirs(partition, exist_ok=True)
+        name = f"{self.segment_prefix}{self._next_sequence()}{self.segment_suffix}"
+        tmp_path = os.path.join(partition, f".{name}.tmp")
+        batch.to_parquet(tmp_path, index=False)
+        # Readers never see a half written segment
+        os.replace(tmp_path, os.path.join(partition, name))
+        return os.path.join(partition, name)
+
+    def partitions(self, start=None, end=None):
+        if not os.path.isdir(self.root):
+            return []
+        first_day = pd.Timestamp(start).strftime('%Y-%m-%d') if start is not None else None
+        last_day = pd.Timestamp(end).strftime('%Y-%m-%d') if end is not None else None
+        days = []
+        for name in os.listdir(self.root):
+            if not name.startswith(self.partition_prefix):
+                continue
+            day = name[len(self.partition_prefix):]
+            if first_day is not None and day < first_day:
+                continue
+            if last_day is not None and day > last_day:
+                continue
+            days.append(day)
+        return sorted(days)
+
+    def segments(self, day):
+        # Live files of a partition in sequence order: a compact file hides
+        # the segments (and older compact files) whose range it covers, so a
+        # listing taken mid-compaction never counts a row twice
+        partition = self.partition_path(day)
+        try:
+            names = os.listdir(partition)
+        except FileNotFoundError:
+            return []
+        paths = [
+            os.path.join(partition, name) for name in names
+            if name.startswith((self.segment_prefix, self.compact_prefix)) and name.endswith(self.segment_suffix)
+        ]
+        ranges = sorted(((self.segment_range(path), path) for path in paths), key=lambda item: (item[0][0], -item[0][1]))
+        live = []
+        covered_to = -1
+        for (first, last), path in ranges:
+            if last <= covered_to:
+                continue
+            live.append(path)
+            covered_to = last
+        return live
+
+    def segment_range(self, path):
+        name = os.path.basename(path)[:-len(self.segment_suffix)]
+        if name.startswith(self.compact_prefix):
+            first, last = name[len(self.compact_prefix):].split('-')
+            return int(first), int(last)
+        sequence = int(name[len(self.segment_prefix):])
+        return sequence, sequence
+
+    def segment_sequence(self, path):
+        return self.segment_range(path)[1]
+
+    def marker_for(self, appended):
+        day = os.path.basename(os.path.dirname(appended))[len(self.partition_prefix):]
+        return day, self.segment_sequence(appended)
+
+    def read_segment(self, path, columns=None, after=None):
+        # `after`: only rows from segments numbered above it (for a compact
+        # file that is partly behind a changes_since marker)
+        frame = pd.read_parquet(path, columns=columns if columns is None or after is None else list(columns) + ['Sequence'])
+        if 'Sequence' in frame.columns:
+            if after is not None:
+                frame = frame[frame['Sequence'] > after]
+            frame = frame.drop(columns=['Sequence'])
+        return frame
+
+    def read_segments(self, paths, columns=None):
+        # paths: file paths, or (path, after) pairs
+        frames = [
+            self.read_segment(path[0], columns, path[1]) if isinstance(path, tuple) else self.read_segment(path, columns)
+            for path in paths
+        ]
+        frames = [frame for frame in frames if not frame.empty]
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)
+
+    def retrying(self, fn, *args):
+        # A compaction may delete files between listing and reading; list again
+        for attempt in range(self.read_attempts):
+            try:
+                return fn(*args)
+            except FileNotFoundError:
+                if attempt == self.read_attempts - 1:
+                    raise
+
+    def read(self, start=None, end=None, columns=None):
+        return self.retrying(self._read, start, end, columns)
+
+    def _read(self, start=None, end=None, columns=None):
+        # Only the partitions overlapping [start, end) are opened
+        paths = []
+        for day in self.partitions(start, end):
+            paths.extend(self.segments(day))
+        read_columns = columns
+        if columns is not None and (start is not None or end is not None) and 'Timestamp' not in columns:
+            read_columns = list(columns) + ['Timestamp']
+        df = filter_range(self.read_segments(paths, read_columns), start, end)
+        return df[columns] if columns is not None else df
+
+    def changes_since(self, marker, start=None):
+        return self.retrying(self._changes_since, marker, start)
+
+    def _changes_since(self, marker, start=None):
+        # The marker is (last day seen, last segment sequence seen); only
+        # partitions from that day on are listed
+        if marker is None:
+            days = self.partitions(start)
+            last_day, last_sequence = None, 0
+        else:
+            last_day, last_sequence = marker
+            days = self.partitions(last_day)
+        paths = []
+        for day in days:
+            for path in self.segments(day):
+                first, sequence = self.segment_range(path)
+                if sequence > last_sequence:
+                    paths.append((path, last_sequence if first <= last_sequence else None))
+                    last_sequence = sequence
+                    last_day = day
+        if not paths:
+            return pd.DataFrame(), (last_day, last_sequence) if last_day else marker
+        new_rows = self.read_segments(paths)
+        if marker is None:
+            new_rows = filter_range(new_rows, start).reset_index(drop=True)
+        return new_rows, (last_day, last_sequence)
+
+    def compact(self, day, max_sequence=None):
+        # Merge the partition's files up to max_sequence into one file sorted
+        # by time. The merged file is renamed into place before the inputs
+        # are removed, so readers see either the old files or the new one.
+        paths = [path for path in self.segments(day) if max_sequence is None or self.segment_sequence(path) <= max_sequence]
+        if len(paths) < 2:
+            return None
+        frames = []
+        for path in paths:
+            frame = pd.read_parquet(path)
+            if 'Sequence' not in frame.columns:
+                frame['Sequence'] = self.segment_sequence(path)
+            frames.append(frame)
+        merged = pd.concat(frames, ignore_index=True)
+        merged = merged.sort_values(['Timestamp', 'Sequence'], kind='stable') if 'Timestamp' in merged.columns else merged
+        first = min(self.segment_range(path)[0] for path in paths)
+        last = max(self.segment_range(path)[1] for path in paths)
+        partition = self.partition_path(day)
+        name = f"{self.compact_prefix}{first}-{last}{self.segment_suffix}"
+        tmp_path = os.path.join(partition, f".{name}.tmp")
+        merged.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, os.path.join(partition, name))
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return os.path.join(partition, name), len(paths)
+
+    def sweep(self, day):
+        # Remove files hidden by a compact file, left behind by a compaction
+        # that was interrupted before it deleted its inputs
+        partition = self.partition_path(day)
+        live = set(self.segments(day))
+        # Only files inside a live compact file's range; anything newer may
+        # have been appended after the listing above
+        covered_to = max((self.segment_range(path)[1] for path in live
+                          if os.path.basename(path).startswith(self.compact_prefix)), default=None)
+        removed = 0
+        if covered_to is None:
+            return removed
+        for name in os.listdir(partition):
+            path = os.path.join(partition, name)
+            if (name.startswith((self.segment_prefix, self.compact_prefix)) and name.endswith(self.segment_suffix)
+                    and path not in live and self.segment_range(path)[1] <= covered_to):
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def drop_partition(self, day):
+        # Renamed out of the date= namespace first, so it disappears from
+        # listings in one step
+        partition = self.partition_path(day)
+        trash = os.path.join(self.root, f".dropped-{os.path.basename(partition)}-{time.time_ns()}")
+        try:
+            os.rename(partition, trash)
+        except FileNotFoundError:
+            return False
+        shutil.rmtree(trash, ignore_errors=True)
+        return True
+
+    def import_excel(self, excel_path):
+        # One-off migration of a legacy datadump.xlsx into day partitions.
+        # The dashboards read typed property columns, so the rows need the
+        # models' schema (see open_sink).
+        if self.schema is None:
+            raise ValueError("importing telemetry needs the DTDL models: use open_sink(dump_path, model_path)")
+        df = pd.read_excel(excel_path)
+        total = 0
+        for (day, clock), batch in df.groupby(['Date', 'Time'], sort=True):
+            now = datetime.strptime(f"{day} {clock}", '%Y-%m-%d %H:%M:%S')
+            self.append(batch.drop(columns=['Date', 'Time']), now=now)
+            total += len(batch)
+        print(f"Imported {total} telemetry rows from {excel_path}")
+        return total
+
+
+def open_sink(dump_path, model_path=None):
+    schema = TelemetrySchema.from_models(model_path) if model_path else None
+    if dump_path.endswith('.xlsx'):
+        return ExcelTelemetrySink(dump_path, schema)
+    return ParquetTelemetrySink(dump_path, schema)
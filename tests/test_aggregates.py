@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+from aggregates import TelemetryAggregates
+
+
+def make_batches(count=30, devices=12, seed=0):
+    rng = np.random.default_rng(seed)
+    models = ['dtmi:example:AC;1', 'dtmi:example:Fan;1', 'dtmi:example:Room;1']
+    batches = []
+    for tick in range(count):
+        power = rng.uniform(0, 100, devices)
+        power[rng.random(devices) < 0.1] = np.nan
+        temperature = rng.normal(22, 3, devices)
+        batches.append(pd.DataFrame({
+            'ModelID': [models[i % len(models)] for i in range(devices)],
+            'ID (must be unique)': [f"D{i}" for i in range(devices)],
+            'Time': f"{tick % 24:02d}:00:00",
+            'powerConsumed': power,
+            'onOff': pd.array(rng.random(devices) < 0.6, dtype='boolean'),
+            'temperature': temperature,
+            'humidity': 40 + 0.5 * temperature + rng.normal(0, 1, devices),
+            'brightness': np.where(rng.random(devices) < 0.2, np.nan, rng.uniform(0, 1, devices)),
+        }))
+    return batches
+
+
+def assert_matches(aggregates, frame):
+    power = frame['powerConsumed']
+    assert np.isclose(aggregates.total_power(), power.sum())
+    assert np.isclose(aggregates.average_power(), power.mean())
+    per_model = frame.groupby('ModelID')['powerConsumed']
+    for model, value in per_model.sum().items():
+        assert np.isclose(aggregates.total_power_per_model()[model], value)
+    for model, value in per_model.mean().items():
+        assert np.isclose(aggregates.average_power_per_model()[model], value)
+    per_device = frame.groupby('ID (must be unique)')['powerConsumed'].mean()
+    streamed = aggregates.average_power_per_device()
+    assert np.allclose(streamed[per_device.index], per_device, equal_nan=True)
+    hourly = frame.assign(Hour=pd.to_datetime(frame['Time'], format='%H:%M:%S').dt.hour).groupby('Hour')['powerConsumed'].sum()
+    streamed = aggregates.hourly_power().set_index('Hour')['powerConsumed']
+    assert np.allclose(streamed[hourly.index], hourly, equal_nan=True)
+    utilization = frame.groupby('ID (must be unique)')['onOff'].mean().astype('float64')
+    streamed = aggregates.utilization_per_device()
+    assert np.allclose(streamed[utilization.index], utilization, equal_nan=True)
+    expected = frame[aggregates.parameters].astype('float64').corr()
+    assert np.allclose(aggregates.correlation().loc[expected.index, expected.columns], expected, equal_nan=True)
+
+
+def test_streaming_matches_full_recompute():
+    batches = make_batches()
+    aggregates = TelemetryAggregates()
+    for batch in batches:
+        aggregates.on_telemetry(batch, batch.iloc[0:0])
+    assert_matches(aggregates, pd.concat(batches, ignore_index=True))
+
+
+def test_evictions_match_recompute_of_window():
+    batches = make_batches(count=40, seed=1)
+    aggregates = TelemetryAggregates()
+    window = 10
+    for i, batch in enumerate(batches):
+        evicted = batches[i - window] if i >= window else batch.iloc[0:0]
+        aggregates.on_telemetry(batch, evicted)
+    assert_matches(aggregates, pd.concat(batches[-window:], ignore_index=True))
+    for batch in batches[-window:-1]:
+        aggregates.remove(batch)
+    assert_matches(aggregates, batches[-1])
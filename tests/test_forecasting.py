@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+from forecasting import DeviceForecaster, ForecastService, ForecastSpec
+
+
+class FakeTelemetry:
+    def __init__(self, frame) -> None:
+        self.frame = frame
+        self.version = 1
+
+    def refresh(self):
+        pass
+
+
+class RecordingDeviceForecaster:
+    # Stands in for a slow per-device fit: records what browsers would see
+    # while it runs
+    def __init__(self, service) -> None:
+        self.service = service
+        self.seen = []
+
+    def update(self, frame, data_version=None):
+        self.seen.append((self.service.version, self.service.latest('power')))
+        return 3
+
+    def shutdown(self):
+        pass
+
+
+def device_frame(ticks, devices=2, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'ID (must be unique)': [f"AC{i}" for _ in range(ticks) for i in range(devices)],
+        'powerConsumed': rng.normal(10, 1, ticks * devices),
+    })
+
+
+def test_snapshot_and_version_publish_before_device_fits():
+    telemetry = FakeTelemetry(device_frame(60))
+    service = ForecastService(telemetry, [ForecastSpec('power', lambda frame: frame['powerConsumed'], order=(1, 0, 0))])
+    service.device_forecaster = devices = RecordingDeviceForecaster(service)
+
+    snapshot = service.update()
+    assert service.version == 1 and devices.seen == []
+    # Device fits run separately and get their own version
+    assert service.update_devices() == 3
+    version, latest = devices.seen[0]
+    assert version == 1 and latest is snapshot['power']
+    assert service.version == 2
+    # Nothing new: no refit and no new version
+    service.update()
+    service.update_devices()
+    assert service.version == 2 and len(devices.seen) == 1
+
+
+def test_device_forecasts_update_without_refitting():
+    forecaster = DeviceForecaster(properties=('powerConsumed',), order=(1, 0, 0), max_workers=1, refit_every=2)
+    frame = device_frame(41)
+    try:
+        assert forecaster.update(frame.iloc[:80]) == 2
+
+        def no_pool():
+            raise AssertionError("refitted in the pool")
+        pool, forecaster._pool = forecaster._pool, no_pool
+        # One new point per device, then a window that also dropped the oldest
+        assert forecaster.update(frame) == 2
+        assert forecaster.update(frame.iloc[2:]) == 2
+        result = forecaster.forecast('AC0')
+        assert len(result.history) == 40 and len(result.forecast) == forecaster.steps
+        # After refit_every in-place updates the parameters are re-estimated
+        forecaster._pool = pool
+        assert forecaster.update(frame.iloc[4:]) == 2
+        assert forecaster.models[('AC0', 'powerConsumed')].updates == 0
+    finally:
+        forecaster.shutdown()
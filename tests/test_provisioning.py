@@ -0,0 +1,139 @@
+import os
+import threading
+import pandas as pd
+import fleet
+import provisioning
+from localtwins import InMemoryDigitalTwinsClient, LocalTwinsError
+from provisioning import ProvisioningEngine
+from telemetryschema import load_models
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Response:
+    def __init__(self, headers) -> None:
+        self.headers = headers
+
+
+class ThrottlingClient(InMemoryDigitalTwinsClient):
+    # Fails the first `failures` calls per twin or relationship with `status`,
+    # and records every call that got through, in order
+    def __init__(self, failures=0, status=429, retry_after=None) -> None:
+        super().__init__()
+        self.failures = failures
+        self.status = status
+        self.retry_after = retry_after
+        self.attempts = {}
+        self.completed = []
+        self._attempts_lock = threading.Lock()
+
+    def throttle(self, key):
+        with self._attempts_lock:
+            self.attempts[key] = self.attempts.get(key, 0) + 1
+            failing = self.attempts[key] <= self.failures
+        if failing:
+            error = LocalTwinsError("Too many requests", self.status)
+            error.response = Response({'Retry-After': self.retry_after} if self.retry_after is not None else {})
+            raise error
+
+    def upsert_digital_twin(self, digital_twin_id, digital_twin):
+        self.throttle(digital_twin_id)
+        result = super().upsert_digital_twin(digital_twin_id, digital_twin)
+        self.completed.append(('twin', digital_twin_id))
+        return result
+
+    def upsert_relationship(self, digital_twin_id, relationship_id, relationship):
+        self.throttle(relationship_id)
+        result = super().upsert_relationship(digital_twin_id, relationship_id, relationship)
+        self.completed.append(('relationship', relationship_id))
+        return result
+
+
+def scenario(client, homes=3):
+    client.create_models(load_models(os.path.join(ROOT, 'assests')))
+    template = pd.read_excel(os.path.join(ROOT, 'assests', 'RoomScenario-smarthome.xlsx'))
+    return pd.concat(fleet.iter_fleet(template, homes, 1), ignore_index=True)
+
+
+def record_sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(provisioning.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+def test_throttled_calls_are_retried_with_backoff(monkeypatch):
+    sleeps = record_sleeps(monkeypatch)
+    client = ThrottlingClient(failures=2, status=429)
+    state = scenario(client)
+    engine = ProvisioningEngine(client, max_workers=4, max_retries=3, base_delay=0.5, max_delay=30.0)
+    try:
+        twins = list(fleet.twins_from(state))
+        results = engine.create_twins(twins)
+    finally:
+        engine.shutdown()
+    report = engine.reports[-1]
+    assert len(results) == len(twins) == report.succeeded and report.failed == 0
+    assert set(client.attempts.values()) == {3}
+    assert report.retries == 2 * len(twins) == len(sleeps)
+    # Full jitter: attempt n waits at most base_delay * 2 ** n
+    assert all(0 <= delay <= 0.5 * 2 for delay in sleeps)
+    assert max(sleeps) > 0.5
+
+
+def test_retry_after_header_is_honoured(monkeypatch):
+    sleeps = record_sleeps(monkeypatch)
+    client = ThrottlingClient(failures=1, status=503, retry_after='7')
+    state = scenario(client, homes=1)
+    engine = ProvisioningEngine(client, max_workers=2)
+    try:
+        engine.create_twins(fleet.twins_from(state))
+    finally:
+        engine.shutdown()
+    assert sleeps and set(sleeps) == {7.0}
+
+
+def test_exhausted_retries_are_reported(monkeypatch, capsys):
+    record_sleeps(monkeypatch)
+    client = ThrottlingClient(failures=10, status=429)
+    state = scenario(client, homes=1)
+    engine = ProvisioningEngine(client, max_workers=2, max_retries=2)
+    try:
+        twins = list(fleet.twins_from(state))
+        assert engine.create_twins(twins) == []
+    finally:
+        engine.shutdown()
+    report = engine.reports[-1]
+    assert report.succeeded == 0 and report.failed == len(twins)
+    assert set(client.attempts.values()) == {3}
+    assert report.errors and 'Too many requests' in report.errors[0][1]
+    assert f"{len(twins)} failed" in capsys.readouterr().out
+
+
+def test_other_errors_are_not_retried(monkeypatch):
+    sleeps = record_sleeps(monkeypatch)
+    client = ThrottlingClient(failures=1, status=400)
+    state = scenario(client, homes=1)
+    engine = ProvisioningEngine(client, max_workers=2)
+    try:
+        engine.create_twins(fleet.twins_from(state))
+    finally:
+        engine.shutdown()
+    assert sleeps == [] and set(client.attempts.values()) == {1}
+    assert engine.reports[-1].failed == len(state)
+
+
+def test_twins_are_created_before_relationships(monkeypatch):
+    record_sleeps(monkeypatch)
+    client = ThrottlingClient(failures=1, status=429)
+    state = scenario(client)
+    engine = ProvisioningEngine(client, max_workers=8)
+    try:
+        engine.create_twins(fleet.twins_from(state))
+        relationships = list(fleet.relationships_from(state))
+        assert len(engine.create_relationships(relationships)) == len(relationships)
+    finally:
+        engine.shutdown()
+    kinds = [kind for kind, _ in client.completed]
+    first_relationship = kinds.index('relationship')
+    assert 'twin' not in kinds[first_relationship:]
+    assert kinds.count('twin') == len(state) and kinds.count('relationship') == len(relationships)
@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta
+import pandas as pd
+from rollups import RollupStore, rollup_frame
+
+
+def ticks(start, count, step=timedelta(minutes=1)):
+    return pd.DataFrame({
+        'Timestamp': [start + step * i for i in range(count) for _ in range(2)],
+        'ModelID': ['dtmi:example:AC;1', 'dtmi:example:TV;1'] * count,
+        'ID (must be unique)': ['AC1', 'TV1'] * count,
+        'powerConsumed': [float(i % 7) for i in range(count * 2)],
+    })
+
+
+def test_chart_reads_persisted_buckets_before_the_raw_window():
+    window_start = datetime(2026, 1, 2)
+    persisted = ticks(window_start - timedelta(hours=6), 6, step=timedelta(hours=1))
+    raw = ticks(window_start, 30)
+    store = RollupStore()
+    store.load({resolution: rollup_frame(persisted, resolution) for resolution in ('1min', '1h', '1d')}, window_start)
+    store.update(raw)
+
+    # Default window: the raw rows only
+    live = store.chart_frame(raw, 'powerConsumed')
+    assert len(live) == len(raw) and live['Timestamp'].min() == window_start
+
+    # A requested range past the raw window comes from the rollups
+    chart = store.chart_frame(raw, 'powerConsumed', start=window_start - timedelta(hours=6))
+    before = chart[chart['Timestamp'] < window_start]
+    assert sorted(before['Timestamp'].unique()) == sorted(persisted['Timestamp'].unique())
+    assert set(chart['ModelID']) == {'dtmi:example:AC;1', 'dtmi:example:TV;1'}
+    assert (chart['Timestamp'] >= window_start).any()
+
+    # With nothing left in the raw window the persisted history still shows
+    assert len(store.chart_frame(raw.iloc[0:0], 'powerConsumed', start=window_start - timedelta(hours=6))) > 0
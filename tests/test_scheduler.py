@@ -0,0 +1,34 @@
+import asyncio
+import pandas as pd
+from scheduler import SimulationScheduler
+
+
+class FakeHome:
+    def __init__(self) -> None:
+        self.state = pd.DataFrame({'ID (must be unique)': ['AC1', 'TV1'], 'ModelID': ['dtmi:example:AC;1', 'dtmi:example:TV;1']})
+        self.persisted = []
+        self.saved = 0
+
+    def generate_batch(self, device_ids):
+        return list(device_ids)
+
+    def persist_batch(self, batch):
+        self.persisted.append(batch)
+
+    def save_state(self):
+        self.saved += 1
+
+
+def run(scheduler, ticks):
+    asyncio.run(scheduler.run(max_ticks=ticks))
+
+
+def test_state_is_saved_unless_disabled():
+    home = FakeHome()
+    run(SimulationScheduler(home, period=0.01, upload_mode=None), 2)
+    assert home.saved == 1 and len(home.persisted) == 2
+
+    home = FakeHome()
+    run(SimulationScheduler(home, period=0.01, upload_mode=None, save_state=False), 2)
+    assert home.saved == 0 and len(home.persisted) == 2
+
@@ -0,0 +1,26 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Seconds `import src` may take; importing pandas or the Azure SDK alone
+# takes several times this
+IMPORT_BUDGET = 0.1
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import src
+elapsed = time.perf_counter() - started
+print(json.dumps({'elapsed': elapsed, 'modules': sorted(sys.modules)}))
+"""
+
+
+def test_import_src_is_light():
+    result = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, capture_output=True, text=True, check=True)
+    probe = json.loads(result.stdout.splitlines()[-1])
+    heavy = [name for name in probe['modules']
+             if name in ('pandas', 'numpy', 'DigitalTwinSmartHome') or name == 'azure' or name.startswith('azure.')]
+    assert heavy == []
+    assert probe['elapsed'] < IMPORT_BUDGET
@@ -0,0 +1,74 @@
+import socket
+import stat
+import os
+import time
+from datetime import datetime
+import pandas as pd
+from telemetrybus import TelemetryPublisher, TelemetrySubscriber, bus_authkey, decode_message, encode_message
+
+
+class RecordingCache:
+    def __init__(self) -> None:
+        self.applied = []
+
+    def apply(self, rows, marker, previous):
+        self.applied.append((previous, marker, rows))
+
+
+def rows():
+    return pd.DataFrame({
+        'Timestamp': [datetime(2026, 1, 1, 12, 0, 0)] * 2,
+        'ModelID': ['dtmi:example:AC;1'] * 2,
+        'ID (must be unique)': ['AC0', 'AC1'],
+        'powerConsumed': [1.5, float('nan')],
+        'onOff': [True, None],
+    })
+
+
+def free_address():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return 'localhost', s.getsockname()[1]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+def test_message_round_trip_without_pickle():
+    payload = encode_message(('2026-01-01', 3), ('2026-01-01', 4), rows())
+    assert not payload.startswith(b'\x80')
+    previous, marker, decoded = decode_message(payload)
+    assert (previous, marker) == (('2026-01-01', 3), ('2026-01-01', 4))
+    pd.testing.assert_frame_equal(decoded, rows())
+    assert decode_message(encode_message(None, None, rows()))[:2] == (None, None)
+
+
+def test_generated_key_is_private_and_required(tmp_path, monkeypatch):
+    monkeypatch.delenv('SMARTHOME_BUS_AUTHKEY', raising=False)
+    monkeypatch.setenv('SMARTHOME_BUS_KEYFILE', str(tmp_path / 'bus.key'))
+    assert bus_authkey() is None
+    key = bus_authkey(create=True)
+    assert key and bus_authkey() == key
+    assert stat.S_IMODE(os.stat(tmp_path / 'bus.key').st_mode) == 0o600
+
+    address = free_address()
+    publisher = TelemetryPublisher(address).start()
+    cache, stranger = RecordingCache(), RecordingCache()
+    subscriber = TelemetrySubscriber(cache, address, retry=0.1).start()
+    intruder = TelemetrySubscriber(stranger, address, authkey=b'guess', retry=0.1).start()
+    try:
+        assert wait_for(lambda: subscriber.connected)
+        publisher.publish(rows(), ('2026-01-01', 1))
+        assert wait_for(lambda: cache.applied)
+        previous, marker, received = cache.applied[0]
+        assert (previous, marker) == (None, ('2026-01-01', 1))
+        pd.testing.assert_frame_equal(received, rows())
+        assert not intruder.connected and stranger.applied == []
+    finally:
+        subscriber.stop()
+        intruder.stop()
+        publisher.close()
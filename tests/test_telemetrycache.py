@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+import pandas as pd
+from telemetrycache import TelemetryCache
+
+
+class ListSink:
+    # changes_since over an in-memory list of stamped batches
+    def __init__(self) -> None:
+        self.batches = []
+
+    def append(self, tick, now):
+        self.batches.append(pd.DataFrame({
+            'ModelID': ['dtmi:example:AC;1', 'dtmi:example:Room;1'],
+            'ID (must be unique)': ['AC', 'Room'],
+            'powerConsumed': [float(tick), float(tick) + 0.5],
+            'Timestamp': [pd.Timestamp(now)] * 2,
+        }))
+
+    def changes_since(self, marker, start=None):
+        first = marker or 0
+        new = self.batches[first:]
+        frame = pd.concat(new, ignore_index=True) if new else pd.DataFrame()
+        if start is not None and not frame.empty:
+            frame = frame[frame['Timestamp'] >= pd.Timestamp(start)].reset_index(drop=True)
+        return frame, len(self.batches)
+
+
+def test_chunked_window_matches_full_frame():
+    sink = ListSink()
+    cache = TelemetryCache(sink, window=timedelta(seconds=50))
+    seen = []
+    cache.add_listener(lambda new, evicted: seen.append((len(new), len(evicted))))
+    now = datetime(2024, 4, 8, 12, 0, 0)
+    clock = [now]
+    # Simulated clock, so rows leave the window as ticks go by
+    cache._window_start = lambda: clock[0] - cache.window
+    expected = []
+    for tick in range(200):
+        clock[0] = now + timedelta(seconds=tick)
+        sink.append(tick, clock[0])
+        expected.append(sink.batches[-1])
+        cache.refresh()
+        assert len(cache.chunks) <= 20
+    frame, rows_seen = cache.snapshot()
+    full = pd.concat(expected, ignore_index=True)
+    window = full[full['Timestamp'] >= frame['Timestamp'].iloc[0]].reset_index(drop=True)
+    pd.testing.assert_frame_equal(frame, window)
+    assert rows_seen == sum(new for new, _ in seen) > len(frame)
+    assert frame['Timestamp'].iloc[0] == pd.Timestamp(clock[0] - cache.window)
+    assert sum(new for new, _ in seen) - sum(evicted for _, evicted in seen) == len(frame)
+
+
+def test_tail_only_returns_unseen_rows():
+    sink = ListSink()
+    cache = TelemetryCache(sink, window=None)
+    now = datetime.now()
+    for tick in range(10):
+        sink.append(tick, now + timedelta(seconds=tick))
+        cache.refresh()
+    rows, rows_seen = cache.tail(15)
+    assert rows_seen == 20
+    assert rows['powerConsumed'].tolist() == [7.5, 8.0, 8.5, 9.0, 9.5]
+    assert len(cache.tail(20)[0]) == 0
+
+
+def test_detector_and_rollups_are_per_cache():
+    from anomaly import get_detector
+    from rollups import get_rollups
+    first, second = ListSink(), ListSink()
+    first_cache = TelemetryCache(first, window=None)
+    second_cache = TelemetryCache(second, window=None)
+    now = datetime.now()
+    first.append(1, now)
+    second.append(2, now)
+    second.append(3, now)
+    assert get_detector(first_cache) is get_detector(first_cache)
+    assert get_detector(first_cache) is not get_detector(second_cache)
+    assert get_rollups(first_cache) is get_rollups(first_cache)
+    assert get_rollups(first_cache) is not get_rollups(second_cache)
+    first_cache.refresh()
+    second_cache.refresh()
+    assert get_detector(first_cache).device_state()['readings'].sum() == 2
+    assert get_detector(second_cache).device_state()['readings'].sum() == 4
+    counts = [get_rollups(cache).table('1min')['count'].sum() for cache in (first_cache, second_cache)]
+    assert counts == [2, 4]
@@ -0,0 +1,73 @@
+import os
+from datetime import datetime, timedelta
+import pandas as pd
+import pytest
+from telemetrysink import ParquetTelemetrySink, open_sink
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def batch(tick, devices=3):
+    return pd.DataFrame({
+        'ModelID': ['dtmi:example:AC;1'] * devices,
+        'ID (must be unique)': [f"AC{i}" for i in range(devices)],
+        'powerConsumed': [float(tick * 10 + i) for i in range(devices)],
+    })
+
+
+def fill(sink, ticks, start):
+    for tick in ticks:
+        sink.append(batch(tick), now=start + timedelta(seconds=tick))
+
+
+def test_changes_since_marker_inside_compact_file(tmp_path):
+    sink = ParquetTelemetrySink(str(tmp_path))
+    start = datetime(2024, 4, 8, 12, 0, 0)
+    fill(sink, range(3), start)
+    rows, marker = sink.changes_since(None)
+    assert len(rows) == 9
+    fill(sink, range(3, 5), start)
+    # The marker now points at a segment inside the compact file
+    path, merged = sink.compact('2024-04-08')
+    assert merged == 5
+    assert [os.path.basename(p) for p in sink.segments('2024-04-08')] == [os.path.basename(path)]
+    new_rows, new_marker = sink.changes_since(marker)
+    assert sorted(new_rows['powerConsumed']) == [30.0, 31.0, 32.0, 40.0, 41.0, 42.0]
+    assert 'Sequence' not in new_rows.columns
+    fill(sink, [5], start)
+    newest, _ = sink.changes_since(new_marker)
+    assert sorted(newest['powerConsumed']) == [50.0, 51.0, 52.0]
+    assert len(sink.read()) == 18
+
+
+def test_covered_segments_are_hidden_and_swept(tmp_path):
+    sink = ParquetTelemetrySink(str(tmp_path))
+    start = datetime(2024, 4, 8, 12, 0, 0)
+    fill(sink, range(4), start)
+    partition = sink.partition_path('2024-04-08')
+    parts = sorted(os.listdir(partition))
+    # An interrupted compaction: merged file in place, inputs still there
+    frames = []
+    for name in parts[:2]:
+        frame = pd.read_parquet(os.path.join(partition, name))
+        frame['Sequence'] = sink.segment_sequence(name)
+        frames.append(frame)
+    first, last = sink.segment_sequence(parts[0]), sink.segment_sequence(parts[1])
+    pd.concat(frames, ignore_index=True).to_parquet(os.path.join(partition, f"compact-{first}-{last}.parquet"), index=False)
+    assert len(sink.read()) == 12
+    assert sink.sweep('2024-04-08') == 2
+    assert len(os.listdir(partition)) == 3
+    assert len(sink.read()) == 12
+
+
+def test_import_excel_writes_typed_columns(tmp_path):
+    legacy = os.path.join(ROOT, 'assests', 'datadump.xlsx')
+    with pytest.raises(ValueError):
+        ParquetTelemetrySink(str(tmp_path / 'untyped')).import_excel(legacy)
+
+    sink = open_sink(str(tmp_path / 'telemetry'), os.path.join(ROOT, 'assests'))
+    assert sink.import_excel(legacy) == 810
+    history = sink.read()
+    assert len(history) == 810
+    assert history['powerConsumed'].dtype == 'float64' and history['powerConsumed'].notna().all()
+    assert history.loc[history['ModelID'] == 'dtmi:example:AC;1', 'onOff'].notna().all()
@@ -0,0 +1,21 @@
+from twinpatch import TwinPatchTracker
+
+AC = 'dtmi:example:AC;1'
+
+
+def test_counters_report_patch_and_full_upsert_bytes():
+    tracker = TwinPatchTracker()
+    first = {'temperature': 21, 'onOff': True, 'powerConsumed': 1.5}
+    tracker.sent('AC1', first)
+    # Every property changed: the patch is larger than a full upsert
+    assert len(tracker.diff('AC1', AC, {'temperature': 22, 'onOff': False, 'powerConsumed': 0.2})) == 3
+    counters = tracker.counters()
+    assert counters['patch_bytes'] > counters['full_upsert_bytes'] > 0
+    assert counters['bytes_saved'] == 0
+
+    # Unchanged twins cost nothing, so the savings catch up
+    for _ in range(5):
+        assert tracker.diff('AC1', AC, first) == []
+    counters = tracker.counters()
+    assert counters['twins_skipped'] == 5
+    assert counters['bytes_saved'] == counters['full_upsert_bytes'] - counters['patch_bytes'] > 0
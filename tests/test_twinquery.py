@@ -0,0 +1,109 @@
+import pytest
+from localtwins import InMemoryDigitalTwinsClient, LocalTwinsError
+from twinquery import QueryError, parse
+
+ROOM = 'dtmi:example:Room;1'
+DEVICE = 'dtmi:example:Device;1'
+AC = 'dtmi:example:AC;1'
+TV = 'dtmi:example:TV;1'
+
+
+def twin(model_id, **properties):
+    return {'$metadata': {'$model': model_id}, **properties}
+
+
+@pytest.fixture
+def client():
+    client = InMemoryDigitalTwinsClient()
+    client.create_models([
+        {'@id': ROOM}, {'@id': DEVICE}, {'@id': AC, 'extends': DEVICE}, {'@id': TV, 'extends': [DEVICE]},
+    ])
+    client.upsert_digital_twin('Room1', twin(ROOM, temperature=21))
+    client.upsert_digital_twin('Room2', twin(ROOM, temperature=25))
+    client.upsert_digital_twin('AC1', twin(AC, onOff=True, powerConsumed=1.5))
+    client.upsert_digital_twin('AC2', twin(AC, onOff=False, powerConsumed=0.2))
+    client.upsert_digital_twin('TV1', twin(TV, onOff=True, powerConsumed=0.8))
+    for room, device in (('Room1', 'AC1'), ('Room1', 'TV1'), ('Room2', 'AC2')):
+        name = 'containsAC' if device.startswith('AC') else 'containsTV'
+        client.upsert_relationship(room, f"{room}-{device}", {'$targetId': device, '$relationshipName': name})
+    return client
+
+
+def ids(results):
+    return sorted(result['$dtId'] for result in results)
+
+
+def test_select_where_and_projection(client):
+    assert ids(client.query_twins("SELECT * FROM DIGITALTWINS")) == ['AC1', 'AC2', 'Room1', 'Room2', 'TV1']
+    assert ids(client.query_twins("SELECT * FROM DIGITALTWINS T WHERE T.$dtId = 'AC1'")) == ['AC1']
+    assert ids(client.query_twins("SELECT * FROM DIGITALTWINS WHERE powerConsumed >= 0.8")) == ['AC1', 'TV1']
+    assert client.query_twins("SELECT T.$dtId AS id, T.temperature FROM DIGITALTWINS T WHERE T.temperature > 22") == [
+        {'id': 'Room2', 'temperature': 25}]
+    assert ids(client.query_twins("SELECT * FROM DIGITALTWINS WHERE STARTSWITH($dtId, 'Ro')")) == ['Room1', 'Room2']
+    assert ids(client.query_twins("SELECT * FROM DIGITALTWINS WHERE IS_DEFINED(onOff) AND NOT onOff = true")) == ['AC2']
+
+
+def test_is_of_model_follows_extends(client):
+    assert ids(client.query_twins(f"SELECT * FROM DIGITALTWINS WHERE IS_OF_MODEL('{DEVICE}')")) == ['AC1', 'AC2', 'TV1']
+    assert ids(client.query_twins(f"SELECT * FROM DIGITALTWINS T WHERE IS_OF_MODEL(T, '{AC}', exact)")) == ['AC1', 'AC2']
+    assert client.query_twins(f"SELECT * FROM DIGITALTWINS WHERE IS_OF_MODEL('{DEVICE}', exact)") == []
+
+
+def test_join_related(client):
+    results = client.query_twins(
+        "SELECT Room, Device, R FROM DIGITALTWINS Room JOIN Device RELATED Room.containsAC R "
+        "WHERE Room.$dtId = 'Room1'")
+    assert len(results) == 1
+    assert results[0]['Room']['$dtId'] == 'Room1' and results[0]['Device']['$dtId'] == 'AC1'
+    assert results[0]['R']['$relationshipId'] == 'Room1-AC1'
+    devices = client.query_twins(
+        "SELECT Device.$dtId AS device FROM DIGITALTWINS Room JOIN Device RELATED Room.containsAC "
+        "WHERE Device.onOff = true")
+    assert devices == [{'device': 'AC1'}]
+
+
+def test_count_top_and_in(client):
+    assert client.query_twins(f"SELECT COUNT() FROM DIGITALTWINS WHERE IS_OF_MODEL('{ROOM}')") == [{'COUNT': 2}]
+    assert len(client.query_twins("SELECT TOP(2) * FROM DIGITALTWINS")) == 2
+    assert ids(client.query_twins("SELECT * FROM DIGITALTWINS WHERE $dtId IN ['AC1', 'TV1', 'nope']")) == ['AC1', 'TV1']
+    assert ids(client.query_twins(f"SELECT * FROM DIGITALTWINS WHERE IS_OF_MODEL('{DEVICE}') AND $dtId NOT IN ['AC1']")) == [
+        'AC2', 'TV1']
+
+
+def test_and_binds_tighter_than_or(client):
+    # a OR (b AND c), not (a OR b) AND c
+    query = "SELECT * FROM DIGITALTWINS WHERE $dtId = 'Room1' OR onOff = true AND powerConsumed > 1"
+    assert ids(client.query_twins(query)) == ['AC1', 'Room1']
+    query = "SELECT * FROM DIGITALTWINS WHERE ($dtId = 'Room1' OR onOff = true) AND powerConsumed > 1"
+    assert ids(client.query_twins(query)) == ['AC1']
+
+
+def test_relationships(client):
+    assert sorted(r['$targetId'] for r in client.list_relationships('Room1')) == ['AC1', 'TV1']
+    assert [r['$targetId'] for r in client.list_relationships('Room1', 'containsTV')] == ['TV1']
+    results = client.query_twins("SELECT * FROM RELATIONSHIPS R WHERE R.$sourceId = 'Room1'")
+    assert sorted(r['$relationshipId'] for r in results) == ['Room1-AC1', 'Room1-TV1']
+    results = client.query_twins("SELECT * FROM RELATIONSHIPS R WHERE R.$targetId = 'AC2'")
+    assert [r['$sourceId'] for r in results] == ['Room2']
+    with pytest.raises(LocalTwinsError):
+        client.delete_digital_twin('AC1')
+    client.delete_relationship('Room1', 'Room1-AC1')
+    client.delete_digital_twin('AC1')
+    assert client.query_twins("SELECT COUNT() FROM DIGITALTWINS Room JOIN Device RELATED Room.containsAC") == [{'COUNT': 1}]
+
+
+@pytest.mark.parametrize('query', [
+    "SELECT * FROM MODELS",
+    "SELECT * FROM RELATIONSHIPS R JOIN T RELATED R.contains",
+    "SELECT * FROM DIGITALTWINS WHERE onOff NOT = true",
+    "SELECT * FROM DIGITALTWINS WHERE $dtId = 'AC1' ORDER BY $dtId",
+    "SELECT * FROM DIGITALTWINS A JOIN B RELATED A.contains WHERE $dtId = 'AC1'",
+    "SELECT * FROM DIGITALTWINS WHERE $dtId ~ 'AC1'",
+    "UPDATE DIGITALTWINS",
+])
+def test_unsupported_syntax_is_rejected(client, query):
+    with pytest.raises(QueryError):
+        parse(query)
+    with pytest.raises(LocalTwinsError) as error:
+        client.query_twins(query)
+    assert error.value.status_code == 400
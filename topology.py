@@ -0,0 +1,73 @@
+import threading
+import time
+
+
+class TopologyCache:
+    # Client-side copy of the twin graph: twin ids with their model and the
+    # relationships as adjacency lists by source and by target. It is loaded
+    # with one twins query and one relationships query, reloaded once `ttl`
+    # seconds old, and invalidated by our own writes to the graph.
+    def __init__(self, client, ttl=60.0, list_relationships=None) -> None:
+        self.client = client
+        self.ttl = ttl
+        # Fallback for services that reject FROM RELATIONSHIPS: ids -> [(source, relationship id)]
+        self.list_relationships = list_relationships
+        self.twins = {}
+        self.outgoing = {}
+        self.incoming = {}
+        self.loaded_at = None
+        self.loads = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self.loaded_at = None
+
+    def stale(self):
+        return self.loaded_at is None or (self.ttl is not None and time.monotonic() - self.loaded_at > self.ttl)
+
+    def ensure(self):
+        with self._lock:
+            if self.stale():
+                self._load()
+        return self
+
+    def _load(self):
+        twins = {
+            twin['$dtId']: twin.get('$metadata', {}).get('$model')
+            for twin in self.client.query_twins('SELECT * FROM digitaltwins')
+        }
+        try:
+            relationships = list(self.client.query_twins('SELECT * FROM relationships'))
+        except Exception as e:
+            if self.list_relationships is None:
+                raise
+            print("Relationship query failed, listing per twin:", e)
+            relationships = [
+                {'$sourceId': source, '$relationshipId': relationship_id}
+                for source, relationship_id in self.list_relationships(list(twins))
+            ]
+        outgoing = {}
+        incoming = {}
+        for relationship in relationships:
+            source = relationship['$sourceId']
+            outgoing.setdefault(source, {})[relationship['$relationshipId']] = relationship
+            if '$targetId' in relationship:
+                incoming.setdefault(relationship['$targetId'], []).append(relationship)
+        self.twins, self.outgoing, self.incoming = twins, outgoing, incoming
+        self.loaded_at = time.monotonic()
+        self.loads += 1
+
+    def twin_ids(self):
+        return list(self.ensure().twins)
+
+    def relationships(self):
+        # (source id, relationship id) for every relationship in the graph
+        self.ensure()
+        return [(source, relationship_id) for source, relationships in self.outgoing.items() for relationship_id in relationships]
+
+    def relationships_from(self, digital_twin_id):
+        return list(self.ensure().outgoing.get(digital_twin_id, {}).values())
+
+    def relationships_to(self, digital_twin_id):
+        return list(self.ensure().incoming.get(digital_twin_id, []))
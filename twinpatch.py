@@ -0,0 +1,65 @@
+import json
+import threading
+
+
+def pointer(key):
+    # JSON Pointer escaping for a top level property name
+    return '/' + str(key).replace('~', '~0').replace('/', '~1')
+
+
+class TwinPatchTracker:
+    # Remembers the last property values sent per $dtId so uploads only carry
+    # JSON Patch operations for the properties that actually changed.
+    def __init__(self) -> None:
+        self.last_sent = {}
+        self.patches_sent = 0
+        self.twins_skipped = 0
+        self.full_bytes = 0
+        self.patch_bytes = 0
+        self._lock = threading.Lock()
+
+    def diff(self, digital_twin_id, model_id, properties):
+        previous = self.last_sent.get(digital_twin_id)
+        operations = [
+            {"op": "add", "path": pointer(key), "value": value}
+            for key, value in properties.items()
+            if previous is None or key not in previous or previous[key] != value
+        ]
+        # What a full upsert of the same twin would have cost
+        full_document = {"$metadata": {"$model": model_id}}
+        full_document.update(properties)
+        with self._lock:
+            self.full_bytes += len(json.dumps(full_document))
+            if not operations:
+                self.twins_skipped += 1
+            else:
+                self.patch_bytes += len(json.dumps(operations))
+        return operations
+
+    def sent(self, digital_twin_id, properties):
+        # Only record state once the patch went through, so a failed upload
+        # is retried in full on the next tick
+        with self._lock:
+            self.patches_sent += 1
+            self.last_sent[digital_twin_id] = dict(properties)
+
+    def forget(self, digital_twin_id=None):
+        with self._lock:
+            if digital_twin_id is None:
+                self.last_sent.clear()
+            else:
+                self.last_sent.pop(digital_twin_id, None)
+
+    def bytes_saved(self):
+        # A patch of every property is larger than the full document, so
+        # when everything changes there is nothing saved rather than a loss
+        return max(0, self.full_bytes - self.patch_bytes)
+
+    def counters(self):
+        return {
+            "patches_sent": self.patches_sent,
+            "twins_skipped": self.twins_skipped,
+            "patch_bytes": self.patch_bytes,
+            "full_upsert_bytes": self.full_bytes,
+            "bytes_saved": self.bytes_saved(),
+        }
@@ -0,0 +1,363 @@
+import re
+
+
+# Subset of the Azure Digital Twins query language:
+#   SELECT [TOP(n)] * | COUNT() | alias, ... | alias.property [AS name], ...
+#   FROM DIGITALTWINS [alias] [JOIN alias RELATED alias.relationshipName [alias]]...
+#   FROM RELATIONSHIPS [alias]
+#   [WHERE condition]
+# Conditions support = != <> < > <= >=, [NOT] IN [...], AND, OR, NOT,
+# parentheses, IS_OF_MODEL, IS_DEFINED, IS_NULL, STARTSWITH, ENDSWITH and
+# CONTAINS.
+
+TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+      | (?P<number>-?\d+(?:\.\d+)?)
+      | (?P<operator>!=|<>|<=|>=|=|<|>)
+      | (?P<punctuation>[(),.\[\]*])
+      | (?P<name>[$A-Za-z_][$\w]*)
+    )""", re.VERBOSE)
+KEYWORDS = {'SELECT', 'TOP', 'COUNT', 'AS', 'FROM', 'JOIN', 'RELATED', 'WHERE', 'AND', 'OR', 'NOT', 'IN',
+            'TRUE', 'FALSE', 'NULL', 'DIGITALTWINS', 'RELATIONSHIPS'}
+FUNCTIONS = {'IS_OF_MODEL', 'IS_DEFINED', 'IS_NULL', 'STARTSWITH', 'ENDSWITH', 'CONTAINS'}
+MISSING = object()
+
+
+class QueryError(Exception):
+    pass
+
+
+def tokenize(text):
+    tokens = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if match is None or match.end() == position:
+            raise QueryError(f"Unexpected input at {position}: {text[position:position + 20]!r}")
+        kind = match.lastgroup
+        value = raw = match.group(kind)
+        if kind == 'string':
+            value = re.sub(r"\\(.)", r"\1", value[1:-1])
+        elif kind == 'number':
+            value = float(value) if '.' in value else int(value)
+        elif kind == 'name' and (value.upper() in KEYWORDS or (
+                value.upper() in FUNCTIONS and text[match.end():].lstrip().startswith('('))):
+            kind, value = 'keyword', value.upper()
+        # The raw text is kept for keywords used as property names (T.from)
+        tokens.append((kind, value, raw))
+        position = match.end()
+    return tokens
+
+
+def lookup(item, keys):
+    for key in keys:
+        if not isinstance(item, dict) or key not in item:
+            return MISSING
+        item = item[key]
+    return item
+
+
+def compare(operator, left, right):
+    if left is MISSING or right is MISSING:
+        return False
+    try:
+        if operator == '=':
+            return left == right
+        if operator in ('!=', '<>'):
+            return left != right
+        if operator == '<':
+            return left < right
+        if operator == '>':
+            return left > right
+        if operator == '<=':
+            return left <= right
+        return left >= right
+    except TypeError:
+        return False
+
+
+class Path:
+    def __init__(self, alias, keys) -> None:
+        self.alias = alias
+        self.keys = keys
+
+    def value(self, bindings, context):
+        return lookup(bindings.get(self.alias), self.keys)
+
+
+class Literal:
+    def __init__(self, value) -> None:
+        self.value_ = value
+
+    def value(self, bindings, context):
+        return self.value_
+
+
+class Condition:
+    # Evaluates against {alias: twin or relationship}. `hints` are the index
+    # lookups implied by this condition: (alias, key, value) with key one of
+    # $dtId, $sourceId, $targetId or model
+    def __init__(self, evaluate, hints=()) -> None:
+        self.evaluate = evaluate
+        self.hints = list(hints)
+
+
+class Query:
+    def __init__(self) -> None:
+        self.top = None
+        self.count = False
+        self.projection = None  # None for *, else [(alias, keys, name)]
+        self.collection = None
+        self.alias = None
+        self.joins = []  # (alias, source alias, relationship name, relationship alias)
+        self.where = None
+
+
+class Parser:
+    def __init__(self, text) -> None:
+        self.tokens = tokenize(text)
+        self.position = 0
+        self.query = Query()
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index][:2] if index < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if token[0] is None or (kind and token[0] != kind) or (value is not None and token[1] != value):
+            raise QueryError(f"Expected {value or kind}, got {token[1]!r}")
+        self.position += 1
+        return token[1]
+
+    def accept(self, kind, value=None):
+        token = self.peek()
+        if token[0] == kind and (value is None or token[1] == value):
+            self.position += 1
+            return True
+        return False
+
+    def parse(self):
+        query = self.query
+        self.take('keyword', 'SELECT')
+        if self.accept('keyword', 'TOP'):
+            self.take('punctuation', '(')
+            query.top = self.take('number')
+            self.take('punctuation', ')')
+        select = self.position
+        # The select list refers to aliases declared after it, so skip it
+        # here and come back once FROM and JOIN are parsed
+        depth = 0
+        while not (depth == 0 and self.peek() == ('keyword', 'FROM')):
+            token = self.take()
+            depth += {'(': 1, ')': -1}.get(token, 0) if isinstance(token, str) else 0
+        self.take('keyword', 'FROM')
+        query.collection = self.take('keyword')
+        if query.collection not in ('DIGITALTWINS', 'RELATIONSHIPS'):
+            raise QueryError(f"Unsupported collection {query.collection}")
+        query.alias = self.take('name') if self.peek()[0] == 'name' else None
+        while self.accept('keyword', 'JOIN'):
+            if query.collection != 'DIGITALTWINS':
+                raise QueryError("JOIN is only supported on DIGITALTWINS")
+            alias = self.take('name')
+            self.take('keyword', 'RELATED')
+            source = self.take('name')
+            self.take('punctuation', '.')
+            name = self.member()
+            relationship_alias = self.take('name') if self.peek()[0] == 'name' else None
+            query.joins.append((alias, source, name, relationship_alias))
+        if self.accept('keyword', 'WHERE'):
+            query.where = self.expression()
+        if self.peek()[0] is not None:
+            raise QueryError(f"Unexpected {self.peek()[1]!r}")
+        end = self.position
+        self.position = select
+        self.select_list()
+        self.position = end
+        return query
+
+    def aliases(self):
+        query = self.query
+        return [alias for alias in [query.alias] + [join[0] for join in query.joins] + [join[3] for join in query.joins] if alias]
+
+    def select_list(self):
+        query = self.query
+        if self.accept('punctuation', '*'):
+            return
+        if self.accept('keyword', 'COUNT'):
+            self.take('punctuation', '(')
+            self.take('punctuation', ')')
+            query.count = True
+            return
+        query.projection = []
+        while True:
+            path = self.path()
+            name = self.take('name') if self.accept('keyword', 'AS') else (path.keys[-1] if path.keys else path.alias)
+            query.projection.append((path.alias, path.keys, name))
+            if not self.accept('punctuation', ','):
+                return
+
+    def member(self):
+        if self.peek()[0] != 'keyword':
+            return self.take('name')
+        self.position += 1
+        return self.tokens[self.position - 1][2]
+
+    def path(self):
+        names = [self.take('name')]
+        while self.accept('punctuation', '.'):
+            names.append(self.member())
+        if names[0] in self.aliases():
+            return Path(names[0], names[1:])
+        if len(self.aliases()) > 1:
+            raise QueryError(f"{'.'.join(names)} must be qualified with an alias")
+        return Path(self.query.alias, names)
+
+    def value(self):
+        kind, value = self.peek()
+        if kind in ('string', 'number'):
+            self.position += 1
+            return Literal(value)
+        if kind == 'keyword' and value in ('TRUE', 'FALSE', 'NULL'):
+            self.position += 1
+            return Literal({'TRUE': True, 'FALSE': False, 'NULL': None}[value])
+        return self.path()
+
+    def expression(self):
+        conditions = [self.conjunction()]
+        while self.accept('keyword', 'OR'):
+            conditions.append(self.conjunction())
+        if len(conditions) == 1:
+            return conditions[0]
+        return Condition(lambda bindings, context: any(c.evaluate(bindings, context) for c in conditions))
+
+    def conjunction(self):
+        conditions = [self.negation()]
+        while self.accept('keyword', 'AND'):
+            conditions.append(self.negation())
+        if len(conditions) == 1:
+            return conditions[0]
+        return Condition(lambda bindings, context: all(c.evaluate(bindings, context) for c in conditions),
+                         [hint for c in conditions for hint in c.hints])
+
+    def negation(self):
+        if self.accept('keyword', 'NOT'):
+            condition = self.negation()
+            return Condition(lambda bindings, context: not condition.evaluate(bindings, context))
+        if self.accept('punctuation', '('):
+            condition = self.expression()
+            self.take('punctuation', ')')
+            return condition
+        if self.peek()[0] == 'keyword' and self.peek()[1] in FUNCTIONS:
+            return self.function()
+        return self.comparison()
+
+    def function(self):
+        name = self.take('keyword')
+        self.take('punctuation', '(')
+        if name == 'IS_OF_MODEL':
+            alias = self.query.alias
+            if self.peek()[0] == 'name':
+                alias = self.take('name')
+                self.take('punctuation', ',')
+            model_id = self.take('string')
+            exact = False
+            if self.accept('punctuation', ','):
+                exact = self.take('name').lower() == 'exact'
+            self.take('punctuation', ')')
+            return Condition(
+                lambda bindings, context: context.is_of_model(bindings.get(alias), model_id, exact),
+                [(alias, 'model', (model_id, exact))])
+        path = self.path()
+        argument = None
+        if name in ('STARTSWITH', 'ENDSWITH', 'CONTAINS'):
+            self.take('punctuation', ',')
+            argument = self.value()
+        self.take('punctuation', ')')
+        if name == 'IS_DEFINED':
+            return Condition(lambda bindings, context: path.value(bindings, context) is not MISSING)
+        if name == 'IS_NULL':
+            return Condition(lambda bindings, context: path.value(bindings, context) is None)
+        method = {'STARTSWITH': 'startswith', 'ENDSWITH': 'endswith', 'CONTAINS': '__contains__'}[name]
+
+        def evaluate(bindings, context):
+            value = path.value(bindings, context)
+            other = argument.value(bindings, context)
+            return isinstance(value, str) and isinstance(other, str) and getattr(value, method)(other)
+        return Condition(evaluate)
+
+    def comparison(self):
+        left = self.value()
+        negated = self.accept('keyword', 'NOT')
+        if self.accept('keyword', 'IN'):
+            self.take('punctuation', '[')
+            values = [self.value()]
+            while self.accept('punctuation', ','):
+                values.append(self.value())
+            self.take('punctuation', ']')
+
+            def evaluate(bindings, context):
+                value = left.value(bindings, context)
+                found = value is not MISSING and any(value == v.value(bindings, context) for v in values)
+                return found != negated
+            return Condition(evaluate)
+        if negated:
+            raise QueryError("Expected IN after NOT")
+        operator = self.take('operator')
+        right = self.value()
+        hints = []
+        if operator == '=':
+            for path, literal in ((left, right), (right, left)):
+                if isinstance(path, Path) and isinstance(literal, Literal) and path.keys in (['$dtId'], ['$sourceId'], ['$targetId']):
+                    hints.append((path.alias, path.keys[0], literal.value_))
+        return Condition(lambda bindings, context: compare(operator, left.value(bindings, context), right.value(bindings, context)), hints)
+
+
+def parse(text):
+    return Parser(text).parse()
+
+
+def run_query(query, context):
+    # context provides candidates(collection, alias, hints), related(twin,
+    # name) -> [(relationship, target)] and is_of_model(twin, model_id, exact)
+    if isinstance(query, str):
+        query = parse(query)
+    hints = query.where.hints if query.where is not None else []
+    rows = [{query.alias: item} for item in context.candidates(query.collection, query.alias, hints)]
+    for alias, source, name, relationship_alias in query.joins:
+        joined = []
+        for bindings in rows:
+            for relationship, target in context.related(bindings.get(source), name):
+                row = dict(bindings)
+                row[alias] = target
+                if relationship_alias:
+                    row[relationship_alias] = relationship
+                joined.append(row)
+        rows = joined
+    results = []
+    count = 0
+    for bindings in rows:
+        if query.where is not None and not query.where.evaluate(bindings, context):
+            continue
+        count += 1
+        if query.count:
+            continue
+        if query.projection is None:
+            if query.joins:
+                results.append({alias: item for alias, item in bindings.items() if alias})
+            else:
+                results.append(bindings[query.alias])
+        else:
+            result = {}
+            for alias, keys, name in query.projection:
+                value = lookup(bindings.get(alias), keys)
+                if value is not MISSING:
+                    result[name] = value
+            results.append(result)
+        if query.top is not None and len(results) >= query.top:
+            break
+    if query.count:
+        return [{'COUNT': count}]
+    return results